@@ -0,0 +1,251 @@
+# Dynamic micro-batching of model calls from concurrent requests (e.g. the threads of the REST API).
+# Instead of running one tiny forward pass per request, calls are queued, flushed as one batch once `max_batch_size`
+# calls are waiting or the oldest one waited `max_wait_ms`, and the results are scattered back to the callers.
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from haystack.database.base import Document
+from haystack.reader.base import BaseReader
+from haystack.retriever.base import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+
+class BatchQueueFullError(Exception):
+    """
+    Raised when a call is submitted to a DynamicBatcher whose queue is full.
+    """
+
+
+class DynamicBatcher:
+    """
+    Collects single calls from concurrent threads into batches for `batch_fn`, which gets a list of inputs
+    and has to return a list with one result per input. `batch_fn` is only ever called from the batcher's own
+    worker thread, i.e. the model behind it doesn't need to be thread safe.
+
+    Usage:
+        >>> batcher = DynamicBatcher(retriever.embed_queries, max_batch_size=32, max_wait_ms=5)
+        >>> embedding = batcher.submit("Who is the father of Arya Stark?")  # from many threads concurrently
+        >>> batcher.metrics()
+    """
+
+    def __init__(self,
+                 batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0,
+                 max_queue_size: int = 256,
+                 name: str = "batcher"):
+        """
+        :param batch_fn: function that processes a list of inputs at once and returns one result per input
+        :param max_batch_size: max. number of inputs passed to `batch_fn` at once
+        :param max_wait_ms: max. time the first input of a batch waits for more inputs before the batch gets flushed
+        :param max_queue_size: max. number of waiting inputs. Further calls of `submit()` raise a BatchQueueFullError.
+        :param name: name of the batcher (worker thread and logs)
+        """
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size needs to be at least 1, not {max_batch_size}.")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=max_queue_size)  # type: queue.Queue
+        self._metrics_lock = threading.Lock()
+        self._batch_sizes = []  # type: List[int]
+        self._wait_ms = 0.0
+        self._batch_ms = 0.0
+        self._max_queue_depth = 0
+        self._rejected = 0
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name=f"{name}-worker", daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """
+        Queue an input for the next batch and wait for its result.
+
+        :param item: one input of `batch_fn`
+        :param timeout: max. seconds to wait for the result (default: no limit)
+        :return: the result of `batch_fn` for this input. Exceptions raised by `batch_fn` are re-raised here.
+        """
+        return self.submit_async(item).result(timeout=timeout)
+
+    def submit_many(self, items: List[Any], timeout: Optional[float] = None) -> List[Any]:
+        """
+        Queue several inputs (that may end up in different batches) and wait for all of their results.
+        """
+        futures = [self.submit_async(item) for item in items]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def submit_async(self, item: Any) -> Future:
+        if self._closed:
+            raise RuntimeError(f"{self.name} is closed.")
+        future = Future()  # type: Future
+        try:
+            self._queue.put_nowait((item, future, time.perf_counter()))
+        except queue.Full:
+            with self._metrics_lock:
+                self._rejected += 1
+            raise BatchQueueFullError(f"Queue of {self.name} is full ({self.max_queue_size} waiting calls).")
+        with self._metrics_lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def close(self):
+        """
+        Process the calls that are already queued and stop the worker thread.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._worker.join()
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Current settings and statistics of the batcher, e.g. to export them to a monitoring system.
+        """
+        with self._metrics_lock:
+            batch_sizes = np.array(self._batch_sizes or [0])
+            num_items = int(batch_sizes.sum())
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "max_queue_size": self.max_queue_size,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "batches": len(self._batch_sizes),
+                "items": num_items,
+                "rejected": self._rejected,
+                "mean_batch_size": float(batch_sizes.mean()),
+                "p95_batch_size": float(np.percentile(batch_sizes, 95)),
+                "mean_wait_ms": self._wait_ms / num_items if num_items else 0.0,
+                "mean_batch_ms": self._batch_ms / len(self._batch_sizes) if self._batch_sizes else 0.0,
+            }
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = first[2] + self.max_wait_ms / 1000
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    # don't wait for more calls once the deadline passed, but take the ones already queued
+                    entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
+            self._process(batch)
+            if stop:
+                break
+
+    def _process(self, batch: List[tuple]):
+        start = time.perf_counter()
+        items = [item for item, _, _ in batch]
+        try:
+            results = self.batch_fn(items)
+            if len(results) != len(items):
+                raise ValueError(f"{self.name}: batch_fn returned {len(results)} results for {len(items)} inputs.")
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+        else:
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        end = time.perf_counter()
+
+        with self._metrics_lock:
+            self._batch_sizes.append(len(batch))
+            self._wait_ms += sum(start - queued for _, _, queued in batch) * 1000
+            self._batch_ms += (end - start) * 1000
+
+
+class BatchedRetriever(BaseRetriever):
+    """
+    Wraps a dense retriever (DensePassageRetriever, EmbeddingRetriever), so that the query embeddings of concurrent
+    `retrieve()` calls are computed in batches. Everything else is delegated to the wrapped retriever.
+    """
+
+    def __init__(self, retriever, max_batch_size: int = 32, max_wait_ms: float = 5.0, max_queue_size: int = 256):
+        self.retriever = retriever
+        self.batcher = DynamicBatcher(retriever.embed_queries, max_batch_size=max_batch_size,
+                                      max_wait_ms=max_wait_ms, max_queue_size=max_queue_size,
+                                      name="query-encoder-batcher")
+
+    def __getattr__(self, name):
+        # only called for attributes that aren't found on the wrapper itself
+        return getattr(self.__dict__["retriever"], name)
+
+    def retrieve(self, query: str, filters: dict = None, top_k: int = 10, index: str = None) -> List[Document]:
+        if index is None:
+            index = self.retriever.document_store.index
+        query_emb = self.batcher.submit(query)
+        return self.retriever.document_store.query_by_embedding(query_emb=query_emb, filters=filters, top_k=top_k,
+                                                                index=index)
+
+    def embed_queries(self, texts: List[str]) -> List[np.array]:
+        return self.batcher.submit_many(texts)
+
+
+class BatchedReader(BaseReader):
+    """
+    Wraps a reader, so that the `predict()` calls of concurrent requests are processed together, i.e. the passages
+    of all calls in a batch go through the model together (FARMReader) or the calls are processed via the
+    reader's `predict_batch()`.
+    """
+
+    def __init__(self, reader: BaseReader, max_batch_size: int = 8, max_wait_ms: float = 5.0,
+                 max_queue_size: int = 256):
+        self.reader = reader
+        self.batcher = DynamicBatcher(self._predict_many, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                      max_queue_size=max_queue_size, name="reader-batcher")
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["reader"], name)
+
+    @property
+    def supports_early_exit(self) -> bool:  # type: ignore
+        # the class attribute of BaseReader would shadow __getattr__
+        return self.reader.supports_early_exit
+
+    def predict(self, question: str, documents: List[Document], top_k: Optional[int] = None,
+                early_exit: bool = False):
+        if early_exit:
+            # reading stops depending on the answers found so far, so these calls can't share batches
+            return self.reader.predict(question=question, documents=documents, top_k=top_k,  # type: ignore
+                                       early_exit=True)
+        return self.batcher.submit((question, documents, top_k))
+
+    def predict_batch(self, questions: List[str], documents_per_question: List[List[Document]],
+                      top_k: Optional[int] = None) -> List[dict]:
+        if len(questions) != len(documents_per_question):
+            raise ValueError(f"Got {len(questions)} questions, but {len(documents_per_question)} lists of documents.")
+        return self.batcher.submit_many([(question, documents, top_k)
+                                         for question, documents in zip(questions, documents_per_question)])
+
+    def _predict_many(self, calls: List[tuple]) -> List[dict]:
+        if hasattr(self.reader, "_predict_many"):
+            return self.reader._predict_many(calls)  # type: ignore
+        # calls may have different top_k, so group them for predict_batch()
+        results = [None] * len(calls)  # type: List[Any]
+        for top_k in set(top_k for _, _, top_k in calls):
+            indices = [idx for idx, call in enumerate(calls) if call[2] == top_k]
+            predictions = self.reader.predict_batch([calls[idx][0] for idx in indices],
+                                                    [calls[idx][1] for idx in indices], top_k=top_k)
+            for idx, prediction in zip(indices, predictions):
+                results[idx] = prediction
+        return results
@@ -0,0 +1,160 @@
+import logging
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# stay below SQLite's limit of variables per statement
+SQLITE_MAX_VARIABLES = 500
+
+
+class KeyValueCache:
+    """
+    Cache of values by string key with two optional layers: the most recently used `max_size` entries in memory
+    and a SQLite file that persists all entries across restarts and processes.
+    Values are pickled for the SQLite file; subclasses can override `serialize()` / `deserialize()`.
+
+    Base of the EmbeddingCache of the retrievers and the ReaderCache of the readers.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, max_size: int = 0, timeout: float = 60.0,
+                 table: str = "entries"):
+        """
+        :param path: path of the SQLite file (created if it doesn't exist). None: only keep entries in memory.
+        :param max_size: max. number of entries kept in memory (least recently used ones are evicted first)
+        :param timeout: seconds to wait for a lock on the file held by another process
+        :param table: name of the table in the SQLite file
+        """
+        if max_size < 0 or (not path and max_size < 1):
+            raise ValueError(f"max_size needs to be at least 1 (or 0 with a path), not {max_size}.")
+        self.path = str(path) if path else None
+        self.max_size = max_size
+        self.timeout = timeout
+        self.table = table
+        self.stats = {"hits": 0, "misses": 0, "hit_rate": 0.0}
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+        self._connection = None  # type: Optional[sqlite3.Connection]
+
+    def __getstate__(self):
+        # connections can't be pickled, each process (e.g. of a PassageEmbeddingPool) opens its own one
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)  # type: ignore
+            connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)  # type: ignore
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                               f"(key TEXT NOT NULL PRIMARY KEY, value BLOB NOT NULL)")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def serialize(self, value: Any) -> bytes:
+        return pickle.dumps(value)
+
+    def deserialize(self, blob: bytes) -> Any:
+        return pickle.loads(blob)
+
+    def get(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Cached values for the given keys (missing keys aren't in the result).
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+            missing = [key for key in keys if key not in found]
+            if self.path and missing:
+                for start in range(0, len(missing), SQLITE_MAX_VARIABLES):
+                    chunk = missing[start:start + SQLITE_MAX_VARIABLES]
+                    rows = self.connection.execute(
+                        f"SELECT key, value FROM {self.table} WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk).fetchall()
+                    for key, blob in rows:
+                        found[key] = self.deserialize(blob)
+                        self._add(key, found[key])
+        return found
+
+    def put(self, values: Dict[str, Any]):
+        with self._lock:
+            for key, value in values.items():
+                self._add(key, value)
+            if self.path:
+                self.connection.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                    [(key, self.serialize(value)) for key, value in values.items()])
+                self.connection.commit()
+
+    def _add(self, key: str, value: Any):
+        if self.max_size < 1:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, keys: List[str], items: List[Any],
+                       compute_fn: Callable[[List[Any]], List[Any]]) -> List[Any]:
+        """
+        Get the values of items from the cache and compute the missing ones with `compute_fn`
+        (items sharing a key only once).
+
+        :param keys: cache key of each item
+        :param items: items to get the values for, e.g. texts to embed
+        :param compute_fn: function that takes a list of items and returns one value per item
+        :return: one value per item
+        """
+        values = self.get(list(set(keys)))
+        hits = sum(1 for key in keys if key in values)
+
+        misses = {}  # type: Dict[str, Any]
+        for key, item in zip(keys, items):
+            if key not in values and key not in misses:
+                misses[key] = item
+        if misses:
+            new_values = dict(zip(misses.keys(), compute_fn(list(misses.values()))))
+            self.put(new_values)
+            values.update(new_values)
+
+        self.add_stats(hits=hits, misses=len(keys) - hits)
+        logger.debug(f"{type(self).__name__}: {hits} / {len(keys)} hits, {len(misses)} computed")
+        return [values[key] for key in keys]
+
+    def add_stats(self, hits: int, misses: int):
+        """
+        Count hits and misses, e.g. the ones of the copies of this cache in the workers of a PassageEmbeddingPool.
+        """
+        with self._lock:
+            self.stats["hits"] += hits
+            self.stats["misses"] += misses
+            total = self.stats["hits"] + self.stats["misses"]
+            self.stats["hit_rate"] = self.stats["hits"] / total if total else 0.0
+
+    def log_stats(self):
+        logger.info(f"{type(self).__name__} {self.path or '(in memory)'}: {self.stats['hits']} hits, "
+                    f"{self.stats['misses']} misses (hit rate {self.stats['hit_rate']:.1%}), "
+                    f"{len(self)} entries in memory")
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -16,6 +16,11 @@ class Document(BaseModel):
     query_score: Optional[float] = Field(None, description="Elasticsearch query score for a retrieved document")
     meta: Dict[str, Any] = Field({}, description="Meta fields for a document like name, url, or author.")
     tags: Optional[Dict[str, Any]] = Field(None, description="Tags that allow filtering of the data")
+    reader_tokens: Optional[Dict[str, Any]] = Field(
+        None,
+        description="Text tokenized at indexing time by the tokenizer of a reader, by tokenizer fingerprint "
+        "(see haystack.reader.pretokenization).",
+    )
 
 
 class BaseDocumentStore(ABC):
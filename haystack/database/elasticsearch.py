@@ -7,6 +7,7 @@ from elasticsearch.helpers import bulk, scan
 import numpy as np
 
 from haystack.database.base import BaseDocumentStore, Document
+from haystack.reader.pretokenization import encode_reader_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +26,7 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
         external_source_id_field: str = "external_source_id",
         embedding_field: Optional[str] = None,
         embedding_dim: Optional[int] = None,
+        reader_tokens_field: Optional[str] = None,
         custom_mapping: Optional[dict] = None,
         excluded_meta_data: Optional[list] = None,
         faq_question_field: Optional[str] = None,
@@ -52,6 +54,9 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
         :param external_source_id_field: If you have an external id (= non-elasticsearch) that identifies your documents, you can specify it here.
         :param embedding_field: Name of field containing an embedding vector (Only needed when using a dense retriever (e.g. DensePassageRetriever, EmbeddingRetriever) on top)
         :param embedding_dim: Dimensionality of embedding vector (Only needed when using a dense retriever (e.g. DensePassageRetriever, EmbeddingRetriever) on top)
+        :param reader_tokens_field: Name of field containing the text tokenized by a reader at indexing time
+                                    (Only needed when using `update_reader_tokens()`, to skip tokenizing passages
+                                    at query time)
         :param custom_mapping: If you want to use your own custom mapping for creating a new index in Elasticsearch, you can supply it here as a dictionary.
         :param excluded_meta_data: Name of fields in Elasticsearch that should not be returned (e.g. [field_one, field_two]).
                                    Helpful if you have fields with long, irrelevant content that you don't want to display in results (e.g. embedding vectors).
@@ -77,6 +82,9 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
             if embedding_field:
                 custom_mapping["mappings"]["properties"][embedding_field] = {"type": "dense_vector",
                                                                              "dims": embedding_dim}
+            if reader_tokens_field:
+                # stored in _source only, never searched
+                custom_mapping["mappings"]["properties"][reader_tokens_field] = {"type": "object", "enabled": False}
         # create an index if not exists
         if create_index:
             self.client.indices.create(index=index, ignore=400, body=custom_mapping)
@@ -93,6 +101,7 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
         self.name_field = name_field
         self.external_source_id_field = external_source_id_field
         self.embedding_field = embedding_field
+        self.reader_tokens_field = reader_tokens_field
         self.excluded_meta_data = excluded_meta_data
         self.faq_question_field = faq_question_field
 
@@ -290,7 +299,8 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
 
     def _convert_es_hit_to_document(self, hit: dict, score_adjustment: int = 0) -> Document:
         # We put all additional data of the doc into meta_data and return it in the API
-        meta_data = {k:v for k,v in hit["_source"].items() if k not in (self.text_field, self.external_source_id_field)}
+        meta_data = {k:v for k,v in hit["_source"].items()
+                     if k not in (self.text_field, self.external_source_id_field, self.reader_tokens_field)}
         meta_data["name"] = meta_data.pop(self.name_field, None)
 
         document = Document(
@@ -299,27 +309,30 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
             external_source_id=hit["_source"].get(self.external_source_id_field),
             meta=meta_data,
             query_score=hit["_score"] + score_adjustment if hit["_score"] else None,
-            question=hit["_source"].get(self.faq_question_field)
+            question=hit["_source"].get(self.faq_question_field),
+            reader_tokens=hit["_source"].get(self.reader_tokens_field) if self.reader_tokens_field else None,
         )
         return document
 
-    def update_embeddings(self, retriever):
+    def update_embeddings(self, retriever, num_workers: int = 1, batch_size: int = 10000):
         """
         Updates the embeddings in the the document store using the encoding model specified in the retriever.
         This can be useful if want to add or change the embeddings for your documents (e.g. after changing the retriever config).
 
         :param retriever: Retriever
+        :param num_workers: Number of processes to compute the embeddings in (see PassageEmbeddingPool).
+                            Default: 1, i.e. embed in this process.
+        :param batch_size: Number of embeddings that get written to Elasticsearch in one bulk request
         :return: None
         """
+        from haystack.retriever.embedding_pool import iter_passage_embeddings
 
         if not self.embedding_field:
             raise RuntimeError("Please specify arg `embedding_field` in ElasticsearchDocumentStore()")
         docs = self.get_all_documents()
         passages = [d.text for d in docs]
         logger.info(f"Updating embeddings for {len(passages)} docs ...")
-        embeddings = retriever.embed_passages(passages)
-
-        assert len(docs) == len(embeddings)
+        embeddings = iter_passage_embeddings(retriever, passages, num_workers=num_workers)
 
         doc_updates = []
         for doc, emb in zip(docs, embeddings):
@@ -329,8 +342,40 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
                       "doc": {self.embedding_field: emb.tolist()},
                       }
             doc_updates.append(update)
+            if len(doc_updates) == batch_size:
+                bulk(self.client, doc_updates, request_timeout=300)
+                doc_updates = []
+
+        if doc_updates:
+            bulk(self.client, doc_updates, request_timeout=300)
+
+    def update_reader_tokens(self, reader, batch_size: int = 10000):
+        """
+        Tokenizes the text of all documents with the tokenizer of the reader and stores the tokens with the documents,
+        so that the reader only needs to tokenize the question at query time. Tokens of several readers (with
+        different tokenizers) can be stored side by side.
 
-        bulk(self.client, doc_updates, request_timeout=300)
+        :param reader: Reader (FARMReader, TransformersReader)
+        :param batch_size: Number of documents that get tokenized and written to Elasticsearch in one bulk request
+        :return: None
+        """
+        if not self.reader_tokens_field:
+            raise RuntimeError("Please specify arg `reader_tokens_field` in ElasticsearchDocumentStore()")
+        docs = self.get_all_documents()
+        fingerprint = reader.tokenizer_fingerprint
+        logger.info(f"Updating reader tokens ({fingerprint}) for {len(docs)} docs ...")
+
+        for start in range(0, len(docs), batch_size):
+            batch = docs[start:start + batch_size]
+            doc_updates = []
+            for doc, tokens in zip(batch, reader.pretokenize([doc.text for doc in batch])):
+                update = {"_op_type": "update",
+                          "_index": self.index,
+                          "_id": doc.id,
+                          "doc": {self.reader_tokens_field: {fingerprint: encode_reader_tokens(tokens)}},
+                          }
+                doc_updates.append(update)
+            bulk(self.client, doc_updates, request_timeout=300)
 
     def add_eval_data(self, filename: str, doc_index: str = "eval_document", label_index: str = "feedback"):
         """
@@ -73,6 +73,7 @@ class InMemoryDocumentStore(BaseDocumentStore):
             text=hit.get("text", None),
             meta=hit.get("meta", {}),
             query_score=hit.get("query_score", None),
+            reader_tokens=hit.get("reader_tokens", None),
         )
         return document
 
@@ -109,16 +110,39 @@ class InMemoryDocumentStore(BaseDocumentStore):
 
         return sorted(candidate_docs, key=lambda x: x.query_score, reverse=True)[0:top_k]
 
-    def update_embeddings(self, retriever):
+    def update_embeddings(self, retriever, num_workers: int = 1):
         """
         Updates the embeddings in the the document store using the encoding model specified in the retriever.
         This can be useful if want to add or change the embeddings for your documents (e.g. after changing the retriever config).
 
         :param retriever: Retriever
+        :param num_workers: Number of processes to compute the embeddings in (see PassageEmbeddingPool).
+                            Default: 1, i.e. embed in this process.
         :return: None
         """
-        #TODO
-        raise NotImplementedError("update_embeddings() is not yet implemented for this DocumentStore")
+        from haystack.retriever.embedding_pool import iter_passage_embeddings
+
+        if not self.embedding_field:
+            raise RuntimeError("Please specify arg `embedding_field` in InMemoryDocumentStore()")
+        doc_ids = list(self.docs.keys())
+        passages = [self.docs[doc_id]["text"] for doc_id in doc_ids]
+        embeddings = iter_passage_embeddings(retriever, passages, num_workers=num_workers)
+        for doc_id, embedding in zip(doc_ids, embeddings):
+            self.docs[doc_id][self.embedding_field] = embedding
+
+    def update_reader_tokens(self, reader):
+        """
+        Tokenizes the text of all documents with the tokenizer of the reader and keeps the tokens (as arrays) with the
+        documents, so that the reader only needs to tokenize the question at query time.
+
+        :param reader: Reader (FARMReader, TransformersReader)
+        :return: None
+        """
+        doc_ids = list(self.docs.keys())
+        fingerprint = reader.tokenizer_fingerprint
+        tokens_per_doc = reader.pretokenize([self.docs[doc_id]["text"] for doc_id in doc_ids])
+        for doc_id, tokens in zip(doc_ids, tokens_per_doc):
+            self.docs[doc_id].setdefault("reader_tokens", {})[fingerprint] = tokens
 
     def get_document_ids_by_tags(self, tags: Union[List[Dict[str, Union[str, List[str]]]], Dict[str, Union[str, List[str]]]]) -> List[str]:
         """
@@ -149,6 +173,7 @@ class InMemoryDocumentStore(BaseDocumentStore):
 
     def get_all_documents(self) -> List[Document]:
         return [
-            Document(id=item[0], text=item[1]["text"], meta=item[1].get("meta", {}))
+            Document(id=item[0], text=item[1]["text"], meta=item[1].get("meta", {}),
+                     reader_tokens=item[1].get("reader_tokens"))
             for item in self.docs.items()
         ]
@@ -1,11 +1,21 @@
-from typing import Any, Dict, Union, List, Optional
-
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, func, ForeignKey, PickleType
+import logging
+import re
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Generator, Union, List, Optional
+
+import numpy as np
+from sqlalchemy import create_engine, text, Column, Integer, String, DateTime, func, ForeignKey, PickleType, \
+    LargeBinary
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker, scoped_session, selectinload
+from sqlalchemy.pool import StaticPool
 
 from haystack.database.base import BaseDocumentStore, Document as DocumentSchema
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()  # type: Any
 
 
@@ -22,6 +32,8 @@ class Document(ORMBase):
 
     text = Column(String)
     meta_data = Column(PickleType)
+    embedding = Column(LargeBinary, nullable=True)  # float32 vector as raw bytes
+    embedding_model = Column(String, nullable=True)  # fingerprint of the model that created the embedding
 
     tags = relationship("Tag", secondary="document_tag", backref="Document")
 
@@ -42,27 +54,265 @@ class DocumentTag(ORMBase):
     tag_id = Column(Integer, ForeignKey("tag.id"), nullable=False)
 
 
+# FTS5 index over document.text using the "external content" mode, i.e. the text is not duplicated.
+# The triggers keep the index in sync with every write to the document table.
+SQLITE_FTS_TABLE = "CREATE VIRTUAL TABLE document_fts USING fts5(text, content='document', content_rowid='id', tokenize='porter unicode61')"
+SQLITE_FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS document_fts_insert AFTER INSERT ON document BEGIN
+           INSERT INTO document_fts(rowid, text) VALUES (new.id, new.text);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS document_fts_delete AFTER DELETE ON document BEGIN
+           INSERT INTO document_fts(document_fts, rowid, text) VALUES ('delete', old.id, old.text);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS document_fts_update AFTER UPDATE OF text ON document BEGIN
+           INSERT INTO document_fts(document_fts, rowid, text) VALUES ('delete', old.id, old.text);
+           INSERT INTO document_fts(rowid, text) VALUES (new.id, new.text);
+       END""",
+]
+
+
 class SQLDocumentStore(BaseDocumentStore):
-    def __init__(self, url: str = "sqlite://"):
-        engine = create_engine(url)
-        ORMBase.metadata.create_all(engine)
-        Session = sessionmaker(bind=engine)
-        self.session = Session()
+    def __init__(
+        self,
+        url: str = "sqlite://",
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_recycle: int = 3600,
+        batch_size: int = 1000,
+        text_search_config: str = "english",
+        embedding_field: str = "embedding",
+    ):
+        """
+        A DocumentStore using any SQL database supported by SQLAlchemy (e.g. SQLite or PostgreSQL).
+
+        Every method opens its own short-lived session, so a single instance can safely be shared across threads
+        (e.g. the threadpool of the REST API).
+
+        :param url: SQLAlchemy database url, e.g. "sqlite:///qa.db" or "postgresql://user:pw@host/db"
+        :param pool_size: Number of connections kept open in the engine's pool (ignored for SQLite)
+        :param max_overflow: Number of additional connections that can be opened on peak load (ignored for SQLite)
+        :param pool_recycle: Seconds after which a pooled connection is recycled (ignored for SQLite)
+        :param batch_size: Number of rows fetched per round trip when streaming large reads (e.g. get_all_documents())
+        :param text_search_config: PostgreSQL text search configuration used for the full-text index (e.g. "english", "simple")
+        :param embedding_field: Name of the key in the documents passed to write_documents() that holds an embedding vector.
+                                Embeddings are stored as float32 blobs and searched via query_by_embedding().
+        """
+        if url.startswith("sqlite"):
+            # SQLite connections must be usable from the threads of a threadpool. An in-memory database only
+            # lives as long as its connection, so all threads need to share the very same one.
+            engine_kwargs = {"connect_args": {"check_same_thread": False}}  # type: Dict[str, Any]
+            if url in ("sqlite://", "sqlite:///:memory:"):
+                engine_kwargs["poolclass"] = StaticPool
+        else:
+            engine_kwargs = {"pool_size": pool_size, "max_overflow": max_overflow, "pool_recycle": pool_recycle,
+                             "pool_pre_ping": True}
+        self.engine = create_engine(url, **engine_kwargs)
+        # The single connection of a StaticPool is not safe for concurrent use, so sessions on it are serialized.
+        self._session_lock = threading.RLock() if engine_kwargs.get("poolclass") is StaticPool else None
+        ORMBase.metadata.create_all(self.engine)
+        self._session_factory = sessionmaker(bind=self.engine, expire_on_commit=False)
+        # thread-local session for callers that work directly on `document_store.session`
+        self.session = scoped_session(self._session_factory)
+        self.batch_size = batch_size
+        self.index = None
+        self.embedding_field = embedding_field
+
+        # Normalized embeddings of all documents, held in memory for vectorized similarity search.
+        # Built lazily on the first query_by_embedding() and extended with rows written afterwards.
+        self._embedding_matrix = None  # type: Optional[np.ndarray]
+        self._embedding_ids = None  # type: Optional[np.ndarray]
+        self._embedding_max_id = 0
+        self._embedding_generation = 0  # incremented by reset_embedding_cache()
+        self._embedding_lock = threading.Lock()
+
+        if not re.fullmatch(r"\w+", text_search_config):
+            raise ValueError(f"Invalid text_search_config '{text_search_config}'")
+        self.text_search_config = text_search_config
+        self.full_text_search = self._init_full_text_index()
+
+    def _init_full_text_index(self) -> bool:
+        """
+        Create the full-text index for BM25-like ranking in the database: FTS5 on SQLite, a GIN index on the
+        tsvector of the text on PostgreSQL. Both are maintained by the database itself on every write.
+
+        :return: Whether full-text search is available for this database.
+        """
+        dialect = self.engine.dialect.name
+        try:
+            with self.engine.begin() as connection:
+                if dialect == "sqlite":
+                    exists = connection.execute(
+                        text("SELECT name FROM sqlite_master WHERE type='table' AND name='document_fts'")
+                    ).first()
+                    if not exists:
+                        connection.execute(text(SQLITE_FTS_TABLE))
+                        # index documents that were written before the index existed
+                        connection.execute(text("INSERT INTO document_fts(document_fts) VALUES ('rebuild')"))
+                    for trigger in SQLITE_FTS_TRIGGERS:
+                        connection.execute(text(trigger))
+                elif dialect == "postgresql":
+                    connection.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS document_text_tsv_idx ON document "
+                        f"USING GIN (to_tsvector('{self.text_search_config}', text))"
+                    ))
+                else:
+                    logger.warning(f"Full-text search is not supported for '{dialect}' databases in SQLDocumentStore.")
+                    return False
+        except OperationalError as e:
+            logger.warning(f"Could not create full-text index ({e}). SQLDocumentStore.query() will not be available.")
+            return False
+        return True
+
+    @contextmanager
+    def _session_scope(self):
+        """
+        Provide a transactional scope around a series of operations using a fresh session.
+        For in-memory SQLite, all sessions share one connection and are therefore used one at a time.
+        """
+        session = self._session_factory()
+        if self._session_lock:
+            self._session_lock.acquire()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+            if self._session_lock:
+                self._session_lock.release()
 
     def get_document_by_id(self, id: str) -> Optional[DocumentSchema]:
-        document_row = self.session.query(Document).get(id)
-        document = self._convert_sql_row_to_document(document_row)
+        with self._session_scope() as session:
+            document_row = session.query(Document).options(selectinload(Document.tags)).get(id)
+            document = self._convert_sql_row_to_document(document_row) if document_row else None
 
         return document
 
     def get_all_documents(self) -> List[DocumentSchema]:
-        document_rows = self.session.query(Document).all()
-        documents = []
-        for row in document_rows:
-            documents.append(self._convert_sql_row_to_document(row))
+        return list(self.get_all_documents_generator())
+
+    def get_all_documents_generator(self, batch_size: Optional[int] = None) -> Generator[DocumentSchema, None, None]:
+        """
+        Stream all documents from the database without materializing all rows at once.
+        Tags of each batch are loaded with a single additional query.
+
+        :param batch_size: Number of rows fetched per round trip. Defaults to the batch_size of the DocumentStore.
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+
+        with self._session_scope() as session:
+            query = session.query(Document).options(selectinload(Document.tags)).order_by(Document.id)
+            for row in query.yield_per(batch_size):
+                yield self._convert_sql_row_to_document(row)
+
+    def query(
+        self,
+        query: Optional[str],
+        filters: Optional[Dict[str, List[str]]] = None,
+        top_k: int = 10,
+        custom_query: Optional[str] = None,
+        index: Optional[str] = None,
+    ) -> List[DocumentSchema]:
+        """
+        Find the documents that are most relevant to the query using the full-text index of the database
+        (bm25() of FTS5 on SQLite, ts_rank() on PostgreSQL). Ranking happens inside the database, only the
+        top_k documents are loaded.
+
+        :param query: The query string. Set to None to only apply the filters.
+        :param filters: Limit the results to documents whose meta data have one of the given values per key,
+                        e.g. {"name": ["some", "more"], "category": ["only_one"]}
+        :param top_k: How many documents to return
+        :param custom_query: Not supported by SQLDocumentStore
+        :param index: Not supported by SQLDocumentStore
+        """
+        if custom_query:
+            raise NotImplementedError("Custom queries are not supported by SQLDocumentStore.")
+        if index:
+            raise NotImplementedError("Switching index is not supported by SQLDocumentStore.")
+        if filters:
+            for key, values in filters.items():
+                if type(values) != list:
+                    raise ValueError(f'Wrong filter format for key "{key}": Please provide a list of allowed values for each key. '
+                                     'Example: {"name": ["some", "more"], "category": ["only_one"]} ')
+
+        # Naive retrieval without ranking, only filtering
+        if query is None:
+            documents = []
+            for document in self.get_all_documents_generator():
+                if self._matches_filters(document, filters):
+                    documents.append(document)
+                    if len(documents) == top_k:
+                        break
+            return documents
+
+        if not self.full_text_search:
+            raise NotImplementedError(f"Full-text search is not available for this database "
+                                      f"('{self.engine.dialect.name}') in SQLDocumentStore.")
+
+        terms = re.findall(r"\w+", query.lower())
+        if not terms:
+            return []
+
+        if self.engine.dialect.name == "sqlite":
+            # quote every term to escape FTS5 syntax and match any of them, similar to BM25 in Elasticsearch
+            ranking_query = text(
+                "SELECT rowid, -bm25(document_fts) AS score FROM document_fts "
+                "WHERE document_fts MATCH :query ORDER BY bm25(document_fts)"
+            )
+            params = {"query": " OR ".join(f'"{term}"' for term in terms)}  # type: Dict[str, Any]
+        else:
+            tsvector = f"to_tsvector('{self.text_search_config}', text)"
+            ranking_query = text(
+                f"SELECT id, ts_rank({tsvector}, q) AS score "
+                f"FROM document, to_tsquery('{self.text_search_config}', :query) q "
+                f"WHERE {tsvector} @@ q ORDER BY score DESC"
+            )
+            params = {"query": " | ".join(terms)}
+
+        # Without filters the database can cut off the ranking at top_k. With filters (applied on the meta data),
+        # we stream the ranking in batches until enough documents passed the filters.
+        if not filters:
+            ranking_query = text(f"{ranking_query.text} LIMIT :top_k")
+            params["top_k"] = top_k
+
+        with self._session_scope() as session:
+            ranked_rows = session.execute(ranking_query, params)
+            ranked_batches = iter(lambda: ranked_rows.fetchmany(self.batch_size), [])
+            documents = self._load_ranked_documents(session, ranked_batches, filters, top_k)
+            ranked_rows.close()
+
+        return documents
 
+    def _load_ranked_documents(self, session, ranked_batches, filters: Optional[Dict[str, List[str]]],
+                               top_k: int) -> List[DocumentSchema]:
+        """
+        Load the documents for batches of (id, score) pairs in ranked order until top_k of them passed the filters.
+        """
+        documents = []  # type: List[DocumentSchema]
+        for batch in ranked_batches:
+            scores = {int(doc_id): score for doc_id, score in batch}
+            document_rows = session.query(Document).options(selectinload(Document.tags)) \
+                .filter(Document.id.in_(scores.keys())).all()
+            rows_by_id = {row.id: row for row in document_rows}
+            for doc_id, score in scores.items():
+                if doc_id not in rows_by_id:  # deleted in the meantime
+                    continue
+                document = self._convert_sql_row_to_document(rows_by_id[doc_id], query_score=float(score))
+                if self._matches_filters(document, filters):
+                    documents.append(document)
+                    if len(documents) == top_k:
+                        return documents
         return documents
 
+    @staticmethod
+    def _matches_filters(document: DocumentSchema, filters: Optional[Dict[str, List[str]]]) -> bool:
+        if not filters:
+            return True
+        return all(document.meta.get(key) in values for key, values in filters.items())
+
     def get_document_ids_by_tags(self, tags: Dict[str, Union[str, List]]) -> List[str]:
         """
         Get list of document ids that have tags from the given list of tags.
@@ -86,9 +336,9 @@ class SQLDocumentStore(BaseDocumentStore):
             tag_filters.append(f"SUM(CASE WHEN t.value='{tag}' THEN 1 ELSE 0 END) > 0")
 
         final_query = f"{query} HAVING {' AND '.join(tag_filters)});"
-        query_results = self.session.execute(final_query)
-
-        doc_ids = [row[0] for row in query_results]
+        with self._session_scope() as session:
+            query_results = session.execute(final_query)
+            doc_ids = [row[0] for row in query_results]
         return doc_ids
 
     def write_documents(self, documents: List[dict]):
@@ -101,25 +351,34 @@ class SQLDocumentStore(BaseDocumentStore):
         :return: None
         """
 
+        rows = []
         for doc in documents:
             if "meta" not in doc.keys():
                 doc["meta"] = {}
             for k, v in doc.items():  # put additional fields other than text in meta
-                if k not in ["text", "meta", "tags"]:
+                if k not in ["text", "meta", "tags", self.embedding_field]:
                     doc["meta"][k] = v
-            row = Document(text=doc["text"], meta_data=doc.get("meta", {}))
-            self.session.add(row)
-        self.session.commit()
+            embedding = doc.get(self.embedding_field)
+            rows.append(Document(text=doc["text"], meta_data=doc.get("meta", {}),
+                                 embedding=self._embedding_to_blob(embedding) if embedding is not None else None))
+
+        with self._session_scope() as session:
+            session.add_all(rows)
 
     def get_document_count(self) -> int:
-        return self.session.query(Document).count()
+        with self._session_scope() as session:
+            count = session.query(Document).count()
+        return count
 
-    def _convert_sql_row_to_document(self, row) -> DocumentSchema:
+    def _convert_sql_row_to_document(self, row, query_score: Optional[float] = None) -> DocumentSchema:
+        # Tags are returned as a {name: value} dict as declared by Document.tags, not as ORM Tag objects
+        # (which are detached once the session is closed).
         document = DocumentSchema(
             id=row.id,
             text=row.text,
             meta=row.meta_data,
-            tags=row.tags
+            query_score=query_score,
+            tags={tag.name: tag.value for tag in row.tags}
         )
         return document
 
@@ -128,7 +387,144 @@ class SQLDocumentStore(BaseDocumentStore):
                            filters: Optional[dict] = None,
                            top_k: int = 10,
                            index: Optional[str] = None) -> List[DocumentSchema]:
+        """
+        Find the documents that are most similar (cosine similarity) to the query embedding.
+
+        The embeddings of all documents are kept as one normalized float32 matrix in memory, so scoring a query is
+        a single matrix-vector product. The matrix is built on the first call and afterwards only extended with rows
+        that were added to the database in the meantime. Call reset_embedding_cache() if embeddings of existing rows
+        were changed by another process.
+
+        :param query_emb: Embedding of the query (e.g. from retriever.embed_queries())
+        :param filters: Limit the results to documents whose meta data have one of the given values per key,
+                        e.g. {"name": ["some", "more"], "category": ["only_one"]}
+        :param top_k: How many documents to return
+        :param index: Not supported by SQLDocumentStore
+        """
+        if index:
+            raise NotImplementedError("Switching index is not supported by SQLDocumentStore.")
+        if query_emb is None:
+            return []
+
+        matrix, ids = self._get_embedding_matrix()
+        if len(ids) == 0:
+            return []
+
+        query_emb = np.asarray(query_emb, dtype=np.float32).reshape(-1)
+        if query_emb.shape[0] != matrix.shape[1]:
+            raise ValueError(f"Dimension of query embedding ({query_emb.shape[0]}) does not match the dimension "
+                             f"of the stored embeddings ({matrix.shape[1]}).")
+        scores = matrix.dot(query_emb / (np.linalg.norm(query_emb) or 1.0))
+
+        if filters:
+            # filters are applied on the meta data, so we walk down the full ranking until we have enough matches
+            order = np.argsort(-scores)
+        else:
+            k = min(top_k, len(scores))
+            order = np.argpartition(-scores, k - 1)[:k]
+            order = order[np.argsort(-scores[order])]
+        ranked_batches = (list(zip(ids[order[i:i + self.batch_size]], scores[order[i:i + self.batch_size]]))
+                          for i in range(0, len(order), self.batch_size))
+
+        with self._session_scope() as session:
+            documents = self._load_ranked_documents(session, ranked_batches, filters, top_k)
+        return documents
 
-        raise NotImplementedError("SQLDocumentStore is currently not supporting embedding queries. "
-                                  "Change the query type (e.g. by choosing a different retriever) "
-                                  "or change the DocumentStore (e.g. to ElasticsearchDocumentStore)")
+    def update_embeddings(self, retriever, num_workers: int = 1):
+        """
+        Updates the embeddings in the the document store using the encoding model specified in the retriever.
+        This can be useful if want to add or change the embeddings for your documents (e.g. after changing the retriever config).
+
+        :param retriever: Retriever
+        :param num_workers: Number of processes to compute the embeddings in (see PassageEmbeddingPool).
+                            Default: 1, i.e. embed in this process.
+        :return: None
+        """
+        # the document stores must not depend on the retriever package at import time
+        from haystack.retriever.embedding_pool import iter_passage_embeddings
+
+        with self._session_scope() as session:
+            rows = session.query(Document.id, Document.text).order_by(Document.id).all()
+        model_fingerprint = getattr(retriever, "model_fingerprint", type(retriever).__name__)
+        logger.info(f"Updating embeddings for {len(rows)} docs ...")
+
+        embedding_iter = iter_passage_embeddings(retriever, [row.text for row in rows], num_workers=num_workers,
+                                                 batch_size=self.batch_size)
+        for batch_start in range(0, len(rows), self.batch_size):
+            batch = rows[batch_start:batch_start + self.batch_size]
+            embeddings = [next(embedding_iter) for _ in batch]
+            with self._session_scope() as session:
+                session.bulk_update_mappings(Document, [
+                    {"id": row.id, "embedding": self._embedding_to_blob(emb), "embedding_model": model_fingerprint}
+                    for row, emb in zip(batch, embeddings)
+                ])
+
+        # embeddings of existing rows changed, so the cached matrix needs a full rebuild
+        self.reset_embedding_cache()
+
+    def reset_embedding_cache(self):
+        """
+        Drop the in-memory embedding matrix. It gets rebuilt from the database on the next query_by_embedding().
+        """
+        with self._embedding_lock:
+            self._embedding_matrix = None
+            self._embedding_ids = None
+            self._embedding_max_id = 0
+            self._embedding_generation += 1
+
+    def _get_embedding_matrix(self):
+        """
+        Return the cached (matrix, ids), after loading all rows that were added since the last call.
+        The rows are read without holding the lock, so concurrent queries only wait for the update of the matrix.
+        """
+        while True:
+            with self._embedding_lock:
+                start_id = self._embedding_max_id
+                generation = self._embedding_generation
+
+            with self._session_scope() as session:
+                query = session.query(Document.id, Document.embedding, Document.embedding_model) \
+                    .filter(Document.id > start_id).order_by(Document.id)
+                max_id = start_id
+                new_ids = []
+                new_vectors = []
+                model_fingerprints = set()
+                for row in query.yield_per(self.batch_size):
+                    max_id = row.id
+                    if row.embedding is None:
+                        continue
+                    new_ids.append(row.id)
+                    new_vectors.append(np.frombuffer(row.embedding, dtype=np.float32))
+                    model_fingerprints.add(row.embedding_model)
+
+            if len(model_fingerprints) > 1:
+                logger.warning(f"Found embeddings created by different models ({model_fingerprints}). "
+                               f"Scores across these models are not comparable. Run update_embeddings() to fix this.")
+
+            with self._embedding_lock:
+                if generation != self._embedding_generation:
+                    # the cache was reset while reading, the rows might be outdated already
+                    continue
+                # another thread might have added (some of) the same rows in the meantime
+                new = [i for i, row_id in enumerate(new_ids) if row_id > self._embedding_max_id]
+                if new:
+                    vectors = np.vstack([new_vectors[i] for i in new])
+                    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                    vectors /= np.where(norms == 0, 1, norms)
+                    ids = np.array([new_ids[i] for i in new], dtype=np.int64)
+                    if self._embedding_matrix is None:
+                        self._embedding_matrix = vectors
+                        self._embedding_ids = ids
+                    else:
+                        self._embedding_matrix = np.vstack([self._embedding_matrix, vectors])
+                        self._embedding_ids = np.concatenate([self._embedding_ids, ids])
+                    logger.debug(f"Added {len(ids)} embeddings to the in-memory matrix")
+                self._embedding_max_id = max(self._embedding_max_id, max_id)
+
+                if self._embedding_matrix is None:
+                    return np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.int64)
+                return self._embedding_matrix, self._embedding_ids
+
+    @staticmethod
+    def _embedding_to_blob(embedding) -> bytes:
+        return np.asarray(embedding, dtype=np.float32).tobytes()
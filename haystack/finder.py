@@ -1,13 +1,17 @@
 import logging
 import time
 from statistics import mean
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 import numpy as np
 from scipy.special import expit
 
+from haystack.database.base import Document
+from haystack.pruning import PassagePruner
+from haystack.ranker.base import BaseRanker
 from haystack.reader.base import BaseReader
 from haystack.retriever.base import BaseRetriever
+from haystack.utils import compare_quantization_results
 
 logger = logging.getLogger(__name__)
 
@@ -19,43 +23,158 @@ class Finder:
     It provides an interface to predict top n answers for a given question.
     """
 
-    def __init__(self, reader: Optional[BaseReader], retriever: Optional[BaseRetriever]):
+    def __init__(self, reader: Optional[BaseReader], retriever: Optional[BaseRetriever],
+                 pruner: Optional[PassagePruner] = None, ranker: Optional[BaseRanker] = None):
+        """
+        :param reader: reader to extract answers from the retrieved documents
+        :param retriever: retriever to get candidate documents
+        :param pruner: optional PassagePruner that shortens long documents to their most relevant sentence windows
+                       before they go to the reader
+        :param ranker: optional ranker (e.g. CrossEncoderRanker) that re-ranks the documents of the retriever and
+                       passes only the best ones to the reader
+        """
         self.retriever = retriever
         self.reader = reader
+        self.pruner = pruner
+        self.ranker = ranker
         if self.reader is None and self.retriever is None:
             raise AttributeError("Finder: self.reader and self.retriever can not be both None")
 
-    def get_answers(self, question: str, top_k_reader: int = 1, top_k_retriever: int = 10, filters: Optional[dict] = None):
+    def get_answers(self, question: str, top_k_reader: int = 1, top_k_retriever: int = 10, filters: Optional[dict] = None,
+                    early_exit: bool = False, top_k_ranker: Optional[int] = None):
         """
         Get top k answers for a given question.
+        The result contains the time spent per stage in milliseconds (`timings`).
 
         :param question: the question string
         :param top_k_reader: number of answers returned by the reader
         :param top_k_retriever: number of text units to be retrieved
         :param filters: limit scope to documents having the given tags and their corresponding values.
             The format for the dict is {"tag-1": ["value-1","value-2"], "tag-2": ["value-3]" ...}
+        :param early_exit: let the reader read the text units in order of their retriever score and stop once it
+            found a confident answer (see FARMReader). The result contains the number of text units that were
+            read (`passages_read`).
+        :param top_k_ranker: number of text units passed from the ranker to the reader (default: `top_k` of the ranker)
         :return:
         """
 
         if self.retriever is None or self.reader is None:
             raise AttributeError("Finder.get_answers requires self.retriever AND self.reader")
+        if early_exit and not self.reader.supports_early_exit:
+            raise ValueError(f"{type(self.reader).__name__} doesn't support early_exit. Use a FARMReader.")
+
+        timings = {}  # type: Dict[str, float]
+        start = time.perf_counter()
 
         # 1) Apply retriever(with optional filters) to get fast candidate documents
         documents = self.retriever.retrieve(question, filters=filters, top_k=top_k_retriever)
+        timings["retriever"], start = self._elapsed_ms(start)
 
         if len(documents) == 0:
             logger.info("Retriever did not return any documents. Skipping reader ...")
-            empty_result = {"question": question, "answers": []}
+            empty_result = {"question": question, "answers": [], "timings": timings}
             return empty_result
 
-        # 2) Apply reader to get granular answer(s)
+        # 2) Optionally re-rank the documents and keep the best ones
+        if self.ranker:
+            num_candidates = len(documents)
+            documents = self.ranker.rank(question, documents, top_k=top_k_ranker)
+            timings["ranker"], start = self._elapsed_ms(start)
+            logger.info(f"Ranker selected {len(documents)} of {num_candidates} documents")
+
+        # 3) Optionally prune long documents to their relevant parts
+        offset_maps = {}  # type: Dict[int, Any]
+        if self.pruner:
+            documents, offset_maps = self.pruner.prune(question, documents)
+            timings["pruner"], start = self._elapsed_ms(start)
+
+        # 4) Apply reader to get granular answer(s)
         len_chars = sum([len(d.text) for d in documents])
         logger.info(f"Reader is looking for detailed answer in {len_chars} chars ...")
 
-        results = self.reader.predict(question=question,
-                                      documents=documents,
-                                      top_k=top_k_reader)  # type: Dict[str, Any]
+        if early_exit:
+            results = self.reader.predict(question=question, documents=documents, top_k=top_k_reader,
+                                          early_exit=True)  # type: Dict[str, Any]
+            logger.info(f"Reader read {results['passages_read']} of {len(documents)} documents")
+        else:
+            results = self.reader.predict(question=question,
+                                          documents=documents,
+                                          top_k=top_k_reader)
+        if self.pruner:
+            self.pruner.restore_offsets(results, documents, offset_maps)
+        self._add_meta(results, documents)
+        timings["reader"], _ = self._elapsed_ms(start)
+        results["timings"] = timings
+        logger.info(f"Time per stage (ms): {timings}")
 
+        return results
+
+    def get_answers_batch(self, questions: List[str], top_k_reader: int = 1, top_k_retriever: int = 10,
+                          filters: Optional[dict] = None, top_k_ranker: Optional[int] = None) -> List[dict]:
+        """
+        Get top k answers for several questions. Documents are retrieved per question, but the reader processes
+        the passages of all questions together (see `predict_batch()` of the readers).
+        Each result contains the time spent per stage for the whole batch in milliseconds (`timings`).
+
+        :param questions: the question strings
+        :param top_k_reader: number of answers returned by the reader per question
+        :param top_k_retriever: number of text units to be retrieved per question
+        :param filters: limit scope to documents having the given tags and their corresponding values (see `get_answers()`)
+        :param top_k_ranker: number of text units passed from the ranker to the reader per question
+        :return: one result (see `get_answers()`) per question
+        """
+        if self.retriever is None or self.reader is None:
+            raise AttributeError("Finder.get_answers_batch requires self.retriever AND self.reader")
+
+        timings = {}  # type: Dict[str, float]
+        start = time.perf_counter()
+
+        documents_per_question = [self.retriever.retrieve(question, filters=filters, top_k=top_k_retriever)
+                                  for question in questions]
+        timings["retriever"], start = self._elapsed_ms(start)
+        with_documents = [idx for idx, documents in enumerate(documents_per_question) if documents]
+        if len(with_documents) < len(questions):
+            logger.info(f"Retriever did not return any documents for {len(questions) - len(with_documents)} questions.")
+
+        results = [{"question": question, "answers": [], "timings": timings}
+                   for question in questions]  # type: List[Dict[str, Any]]
+        if not with_documents:
+            return results
+        if self.ranker:
+            ranked = self.ranker.rank_batch([questions[idx] for idx in with_documents],
+                                            [documents_per_question[idx] for idx in with_documents], top_k=top_k_ranker)
+            for idx, documents in zip(with_documents, ranked):
+                documents_per_question[idx] = documents
+            timings["ranker"], start = self._elapsed_ms(start)
+        offset_maps_per_question = [{} for _ in questions]  # type: List[Dict[int, Any]]
+        if self.pruner:
+            for idx in with_documents:
+                documents_per_question[idx], offset_maps_per_question[idx] = self.pruner.prune(
+                    questions[idx], documents_per_question[idx])
+            timings["pruner"], start = self._elapsed_ms(start)
+        predictions = self.reader.predict_batch(questions=[questions[idx] for idx in with_documents],
+                                                documents_per_question=[documents_per_question[idx]
+                                                                        for idx in with_documents],
+                                                top_k=top_k_reader)
+        for idx, prediction in zip(with_documents, predictions):
+            if self.pruner:
+                self.pruner.restore_offsets(prediction, documents_per_question[idx], offset_maps_per_question[idx])
+            self._add_meta(prediction, documents_per_question[idx])
+            results[idx] = prediction
+        timings["reader"], _ = self._elapsed_ms(start)
+        for result in results:
+            result["timings"] = timings
+        logger.info(f"Time per stage for {len(questions)} questions (ms): {timings}")
+        return results
+
+    @staticmethod
+    def _elapsed_ms(start: float):
+        # milliseconds since start and the new start time for the next stage
+        now = time.perf_counter()
+        return (now - start) * 1000, now
+
+    @staticmethod
+    def _add_meta(results: Dict[str, Any], documents: List[Document]):
         # Add corresponding document_name and more meta data, if an answer contains the document_id
         for ans in results["answers"]:
             ans["meta"] = {}
@@ -63,8 +182,6 @@ class Finder:
                 if doc.id == ans["document_id"]:
                     ans["meta"] = doc.meta
 
-        return results
-
     def get_answers_via_similar_questions(self, question: str, top_k_retriever: int = 10, filters: Optional[dict] = None):
         """
         Get top k answers for a given question using only a retriever.
@@ -108,6 +225,7 @@ class Finder:
         label_origin: str = "gold_label",
         top_k_retriever: int = 10,
         top_k_reader: int = 10,
+        compare_quantization: Optional[str] = None,
     ):
         """
         Evaluation of the whole pipeline by first evaluating the Retriever and then evaluating the Reader on the result
@@ -144,6 +262,9 @@ class Finder:
                                    where the correct document is among the retrieved ones
             - "avg_reader_time": Average time needed to extract answer out of retrieved documents for one question
             - "total_finder_time": Total time for whole pipeline
+            - "quantization" (only if `compare_quantization` is set): change of each reader metric
+              ("<metric>_delta", quantized minus full precision), "speedup" of the avg reader time, "model_size_mb",
+              "quantized_model_size_mb" and "memory_saving" of the reader model
 
         :param label_index: Elasticsearch index where labeled questions are stored
         :type label_index: str
@@ -153,10 +274,16 @@ class Finder:
         :type top_k_retriever: int
         :param top_k_reader: How many answers to return per question
         :type top_k_reader: int
+        :param compare_quantization: Also evaluate the pipeline with a quantized copy of the reader model
+                                     (e.g. "dynamic_int8") and report the differences to the full precision reader.
+        :type compare_quantization: str
         """
 
         if not self.reader or not self.retriever:
             raise Exception("Finder needs to have a reader and retriever for the evaluation.")
+        if compare_quantization:
+            # fail before the (long) evaluation of the full precision pipeline
+            self._quantizable_reader()
 
         finder_start_time = time.time()
         # extract all questions for evaluation
@@ -345,8 +472,45 @@ class Finder:
             "total_finder_time": finder_total_time
         }
 
+        if compare_quantization:
+            results["quantization"] = self._eval_quantized_reader(
+                compare_quantization, results, label_index=label_index, doc_index=doc_index,
+                label_origin=label_origin, top_k_retriever=top_k_retriever, top_k_reader=top_k_reader
+            )
+
         return results
 
+    def _quantizable_reader(self):
+        # the reader itself or the one wrapped by a BatchedReader
+        reader = getattr(self.reader, "reader", self.reader)
+        if not all(hasattr(reader, attr) for attr in ("quantize", "set_quantization", "model_size_mb")):
+            raise ValueError(f"compare_quantization needs a reader that supports quantization (FARMReader or "
+                             f"TransformersReader), but {type(reader).__name__} doesn't.")
+        return reader
+
+    def _eval_quantized_reader(self, quantize: str, results: dict, **eval_kwargs) -> dict:
+        reader = self._quantizable_reader()
+        previous_quantization = reader.quantize
+        try:
+            if previous_quantization is None:
+                fp32_results = results
+            else:
+                reader.set_quantization(None)
+                fp32_results = self.eval(**eval_kwargs)
+            fp32_size = reader.model_size_mb()
+
+            reader.set_quantization(quantize)
+            quantized_results = self.eval(**eval_kwargs)
+            quantized_size = reader.model_size_mb()
+        finally:
+            reader.set_quantization(previous_quantization)
+
+        reader_metrics = [key for key in results if key.startswith("reader_")]
+        return compare_quantization_results(fp32_results, quantized_results, metrics=reader_metrics,
+                                            time=fp32_results["avg_reader_time"],
+                                            quantized_time=quantized_results["avg_reader_time"],
+                                            model_size_mb=fp32_size, quantized_model_size_mb=quantized_size)
+
     @staticmethod
     def print_eval_results(finder_eval_results: Dict):
         print("\n___Retriever Metrics in Finder___")
@@ -382,3 +546,13 @@ class Finder:
         print(f"Avg read time per question    : {finder_eval_results['avg_reader_time']:.3f}")
         print(f"Total Finder time             : {finder_eval_results['total_finder_time']:.3f}")
 
+        if "quantization" in finder_eval_results:
+            quantization = finder_eval_results["quantization"]
+            print("\n___Quantized Reader___")
+            print(f"Reader Top-1 accuracy delta   : {quantization['reader_top1_accuracy_delta']:+.3f}")
+            print(f"Reader Top-k accuracy delta   : {quantization['reader_top_k_accuracy_delta']:+.3f}")
+            print(f"Reader Top-1 F1 delta         : {quantization['reader_top1_f1_delta']:+.3f}")
+            print(f"Speedup of avg read time      : {quantization['speedup']:.2f}x")
+            print(f"Model size (MB)               : {quantization['model_size_mb']:.1f} -> "
+                  f"{quantization['quantized_model_size_mb']:.1f} ({quantization['memory_saving']:.1%} saved)")
+
@@ -0,0 +1,192 @@
+# Query-focused pruning of retrieved documents before they go to the reader.
+# Long documents (e.g. whole PDFs from file upload) are split into windows of a few sentences, the windows are scored
+# against the question and only the best ones are passed to the reader. The offsets of the reader's answers are mapped
+# back to the original documents afterwards.
+
+import logging
+import math
+import re
+from bisect import bisect_right
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from haystack.database.base import Document
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+_TOKEN = re.compile(r"\w+")
+
+# per pruned document: (start in pruned text, start in original text, length) of each kept span
+OffsetMap = List[Tuple[int, int, int]]
+
+
+class PassagePruner:
+    """
+    Keeps only the sentence windows of long documents that are most relevant for the question, so that the reader
+    processes a fraction of the tokens. Windows are scored with BM25 (statistics over the windows of all documents
+    of the call) or, if a dense retriever is given, by the similarity of their embeddings to the query embedding
+    (cached, if the retriever has an `embedding_cache`).
+
+    Usage:
+        >>> pruner = PassagePruner(sentences_per_window=3, top_k_windows=4)
+        >>> finder = Finder(reader, retriever, pruner=pruner)
+
+    or stand-alone:
+        >>> pruned_docs, offset_maps = pruner.prune(question, documents)
+        >>> result = reader.predict(question, pruned_docs)
+        >>> pruner.restore_offsets(result, pruned_docs, offset_maps)
+    """
+
+    def __init__(self,
+                 sentences_per_window: int = 3,
+                 top_k_windows: int = 4,
+                 min_doc_length: int = 2000,
+                 separator: str = "\n",
+                 retriever=None,
+                 k1: float = 1.5,
+                 b: float = 0.75):
+        """
+        :param sentences_per_window: number of consecutive sentences per window
+        :param top_k_windows: number of windows kept per document
+        :param min_doc_length: documents with less characters are passed to the reader as they are
+        :param separator: inserted between kept windows that aren't adjacent in the original document
+        :param retriever: dense retriever (DensePassageRetriever, EmbeddingRetriever) to score the windows with
+                          instead of BM25
+        :param k1: BM25 term frequency saturation
+        :param b: BM25 length normalization
+        """
+        if sentences_per_window < 1 or top_k_windows < 1:
+            raise ValueError("sentences_per_window and top_k_windows need to be at least 1.")
+        self.sentences_per_window = sentences_per_window
+        self.top_k_windows = top_k_windows
+        self.min_doc_length = min_doc_length
+        self.separator = separator
+        self.retriever = retriever
+        self.k1 = k1
+        self.b = b
+
+    def prune(self, question: str, documents: List[Document]) -> Tuple[List[Document], Dict[int, OffsetMap]]:
+        """
+        :return: the pruned documents (same order, ids and meta as the input) and the offset maps of the documents
+                 that were pruned (by position in the list, as documents can share an id, e.g. the paragraphs of
+                 TfidfRetriever), to be passed to `restore_offsets()`
+        """
+        windows_per_doc = [self._split_windows(doc.text) if len(doc.text) >= self.min_doc_length else []
+                           for doc in documents]
+        all_windows = [doc.text[start:end] for doc, windows in zip(documents, windows_per_doc)
+                       for start, end in windows]
+        if not all_windows:
+            return documents, {}
+        scores = iter(self._score(question, all_windows))
+
+        pruned_documents = []
+        offset_maps = {}
+        chars_before = chars_after = 0
+        for position, (doc, windows) in enumerate(zip(documents, windows_per_doc)):
+            doc_scores = [next(scores) for _ in windows]
+            if len(windows) <= self.top_k_windows:
+                pruned_documents.append(doc)
+                continue
+            kept = sorted(np.argsort(-np.array(doc_scores), kind="stable")[:self.top_k_windows])
+            text, offset_map = self._join([windows[idx] for idx in kept], doc.text)
+            pruned_documents.append(doc.copy(update={"text": text, "reader_tokens": None}))
+            offset_maps[position] = offset_map
+            chars_before += len(doc.text)
+            chars_after += len(text)
+        if offset_maps:
+            logger.info(f"Pruned {len(offset_maps)} documents from {chars_before} to {chars_after} chars")
+        return pruned_documents, offset_maps
+
+    def restore_offsets(self, results: dict, documents: List[Document], offset_maps: Dict[int, OffsetMap]) -> dict:
+        """
+        Map `offset_start_in_doc` / `offset_end_in_doc` of the answers from the pruned to the original documents.
+
+        :param results: prediction of the reader on the pruned documents
+        :param documents: the pruned documents as returned by `prune()`
+        :param offset_maps: the offset maps as returned by `prune()`
+        """
+        for answer in results["answers"]:
+            if answer.get("offset_start_in_doc") is None:
+                continue
+            position = self._find_document(answer, documents)
+            if position not in offset_maps:
+                continue
+            offset_map = offset_maps[position]  # type: ignore
+            answer["offset_start_in_doc"] = self._to_doc_offset(offset_map, answer["offset_start_in_doc"])
+            answer["offset_end_in_doc"] = self._to_doc_offset(offset_map, answer["offset_end_in_doc"])
+        return results
+
+    @staticmethod
+    def _find_document(answer: dict, documents: List[Document]) -> Optional[int]:
+        # Position of the document an answer comes from. Documents can share an id (e.g. the paragraphs of
+        # TfidfRetriever), so it's the first one with the answer's id that contains the answer at its offsets.
+        candidates = [position for position, doc in enumerate(documents) if doc.id == answer.get("document_id")]
+        for position in candidates:
+            if documents[position].text[answer["offset_start_in_doc"]:answer["offset_end_in_doc"]] == answer["answer"]:
+                return position
+        return candidates[0] if candidates else None
+
+    def _split_windows(self, text: str) -> List[Tuple[int, int]]:
+        # (start, end) of the sentences, without the whitespace between them
+        sentences = []
+        start = 0
+        for boundary in _SENTENCE_BOUNDARY.finditer(text):
+            if boundary.start() > start:
+                sentences.append((start, boundary.start()))
+            start = boundary.end()
+        if start < len(text):
+            sentences.append((start, len(text)))
+        return [(sentences[idx][0], sentences[min(idx + self.sentences_per_window, len(sentences)) - 1][1])
+                for idx in range(0, len(sentences), self.sentences_per_window)]
+
+    def _join(self, windows: List[Tuple[int, int]], text: str) -> Tuple[str, OffsetMap]:
+        # merge windows that are adjacent in the original text, so that answers can span them
+        spans = []  # type: List[List[int]]
+        for start, end in windows:
+            if spans and not text[spans[-1][1]:start].strip():
+                spans[-1][1] = end
+            else:
+                spans.append([start, end])
+
+        parts = []
+        offset_map = []
+        position = 0
+        for start, end in spans:
+            if parts:
+                parts.append(self.separator)
+                position += len(self.separator)
+            parts.append(text[start:end])
+            offset_map.append((position, start, end - start))
+            position += end - start
+        return "".join(parts), offset_map
+
+    @staticmethod
+    def _to_doc_offset(offset_map: OffsetMap, offset: int) -> int:
+        idx = max(bisect_right([pruned_start for pruned_start, _, _ in offset_map], offset) - 1, 0)
+        pruned_start, doc_start, length = offset_map[idx]
+        return doc_start + min(offset - pruned_start, length)
+
+    def _score(self, question: str, windows: List[str]) -> List[float]:
+        if self.retriever is not None:
+            query_emb = self.retriever.embed_queries([question])[0]
+            return [float(np.dot(query_emb, emb)) for emb in self.retriever.embed_passages(windows)]
+        return self._bm25(question, windows)
+
+    def _bm25(self, question: str, windows: List[str]) -> List[float]:
+        term_frequencies = [Counter(_TOKEN.findall(window.lower())) for window in windows]
+        lengths = [sum(tf.values()) for tf in term_frequencies]
+        avg_length = sum(lengths) / len(lengths) or 1.0
+        scores = [0.0] * len(windows)
+        for term in set(_TOKEN.findall(question.lower())):
+            num_windows = sum(1 for tf in term_frequencies if term in tf)
+            if not num_windows:
+                continue
+            idf = math.log(1 + (len(windows) - num_windows + 0.5) / (num_windows + 0.5))
+            for idx, (tf, length) in enumerate(zip(term_frequencies, lengths)):
+                if term in tf:
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[idx] += idf * tf[term] * (self.k1 + 1) / (tf[term] + norm)
+        return scores
@@ -0,0 +1,25 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from haystack.database.base import Document
+
+
+class BaseRanker(ABC):
+
+    @abstractmethod
+    def rank(self, query: str, documents: List[Document], top_k: Optional[int] = None) -> List[Document]:
+        """
+        Sort the documents by their relevance for the query and return the top_k most relevant ones.
+        """
+        pass
+
+    def rank_batch(self, queries: List[str], documents_per_query: List[List[Document]],
+                   top_k: Optional[int] = None) -> List[List[Document]]:
+        """
+        Rank the documents of several queries. Rankers that can score all (query, document) pairs together
+        (e.g. CrossEncoderRanker) override this.
+        """
+        if len(queries) != len(documents_per_query):
+            raise ValueError(f"Got {len(queries)} queries, but {len(documents_per_query)} lists of documents.")
+        return [self.rank(query=query, documents=documents, top_k=top_k)
+                for query, documents in zip(queries, documents_per_query)]
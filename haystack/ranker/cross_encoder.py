@@ -0,0 +1,144 @@
+import logging
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer
+
+from haystack.database.base import Document
+from haystack.ranker.base import BaseRanker
+from haystack.retriever.backends import BACKEND_FILE_SUFFIX, ExportedEncoder, check_backend, export_encoder
+from haystack.utils import get_model_size_mb, quantize_model
+
+logger = logging.getLogger(__name__)
+
+RANKER_EXPORT_FILE = "ranker"
+
+
+class CrossEncoderRanker(BaseRanker):
+    """
+    Re-ranks the documents of a retriever with a cross-encoder, i.e. a transformer that reads query and document
+    together and outputs a relevance score (e.g. the MS MARCO cross-encoders of sentence-transformers).
+    This is much cheaper than the reader, so the retriever can return more candidates (e.g. 50) and the reader only
+    gets the few best ones.
+
+    Usage:
+        >>> ranker = CrossEncoderRanker("cross-encoder/ms-marco-MiniLM-L-6-v2", top_k=5)
+        >>> finder = Finder(reader, retriever, ranker=ranker)
+        >>> finder.get_answers(question, top_k_retriever=50, top_k_reader=3)
+    """
+
+    def __init__(self,
+                 model_name_or_path: Union[str, Path] = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+                 top_k: int = 10,
+                 batch_size: int = 32,
+                 max_seq_len: int = 256,
+                 use_gpu: bool = False,
+                 backend: str = "torch",
+                 quantize: Optional[str] = None):
+        """
+        :param model_name_or_path: directory of a saved model or the name of a public sequence classification model
+                                   with one output (relevance score) or two outputs (irrelevant / relevant).
+                                   For backends other than "torch" a directory created by `export()`.
+        :param top_k: number of documents returned by `rank()` (if not given there)
+        :param batch_size: number of (query, document) pairs scored at once
+        :param max_seq_len: max number of tokens of query and document together (the document gets truncated)
+        :param use_gpu: whether to use GPU (if available)
+        :param backend: "torch" (eager PyTorch), "torchscript" or "onnx"
+        :param quantize: Quantize the model for faster inference on CPU (backend "torch" only). Options: None,
+                         "dynamic_int8"
+        """
+        check_backend(backend)
+        if quantize and backend != "torch":
+            raise ValueError(f"Quantization is only available for backend 'torch', not for '{backend}'.")
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.max_seq_len = max_seq_len
+        self.backend = backend
+        self.device = torch.device("cuda" if use_gpu and torch.cuda.is_available() else "cpu")
+
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_name_or_path))
+        self.num_labels = AutoConfig.from_pretrained(str(model_name_or_path)).num_labels
+        if backend == "torch":
+            model = AutoModelForSequenceClassification.from_pretrained(str(model_name_or_path))
+            self.model = quantize_model(model.to(self.device).eval(), quantize)
+        else:
+            model_file = Path(model_name_or_path) / (RANKER_EXPORT_FILE + BACKEND_FILE_SUFFIX[backend])
+            if not model_file.exists():
+                raise ValueError(f"Backend '{backend}' needs a model exported via CrossEncoderRanker.export(), "
+                                 f"but {model_file} doesn't exist.")
+            self.model = ExportedEncoder(model_file, backend=backend, device=self.device)
+
+    @classmethod
+    def export(cls, model_name_or_path: Union[str, Path], output_dir: Union[str, Path], backend: str = "onnx",
+               opset_version: int = 11) -> Path:
+        """
+        Export a cross-encoder to TorchScript or ONNX, to be loaded via
+        `CrossEncoderRanker(model_name_or_path=output_dir, backend=backend)`.
+
+        :param model_name_or_path: directory of a saved model or the name of a public model
+        :param output_dir: directory for the exported model, its config and tokenizer
+        :param backend: "torchscript" or "onnx"
+        :param opset_version: ONNX opset version
+        """
+        check_backend(backend)
+        output_dir = Path(output_dir)
+        model = AutoModelForSequenceClassification.from_pretrained(str(model_name_or_path))
+        export_encoder(model, output_dir / RANKER_EXPORT_FILE, backend=backend,
+                       output_axes={"logits": {0: "batch_size"}}, output_indices=(0,), opset_version=opset_version)
+        model.config.save_pretrained(str(output_dir))
+        AutoTokenizer.from_pretrained(str(model_name_or_path)).save_pretrained(str(output_dir))
+        return output_dir
+
+    def model_size_mb(self) -> float:
+        return get_model_size_mb(self.model)
+
+    def rank(self, query: str, documents: List[Document], top_k: Optional[int] = None) -> List[Document]:
+        """
+        Score the documents with the cross-encoder and return the top_k best ones, sorted by their score.
+        The `query_score` of the returned documents is the score of the cross-encoder.
+
+        :param query: query string
+        :param documents: candidate documents, e.g. from a retriever
+        :param top_k: number of documents to return (default: `top_k` of the ranker)
+        """
+        return self.rank_batch([query], [documents], top_k=top_k)[0]
+
+    def rank_batch(self, queries: List[str], documents_per_query: List[List[Document]],
+                   top_k: Optional[int] = None) -> List[List[Document]]:
+        """
+        Like `rank()` for several queries, whose (query, document) pairs are scored in shared batches.
+        """
+        if len(queries) != len(documents_per_query):
+            raise ValueError(f"Got {len(queries)} queries, but {len(documents_per_query)} lists of documents.")
+        if top_k is None:
+            top_k = self.top_k
+
+        pairs = [(query, doc.text) for query, documents in zip(queries, documents_per_query) for doc in documents]
+        scores = iter(self._score(pairs))
+
+        results = []
+        for documents in documents_per_query:
+            doc_scores = [next(scores) for _ in documents]
+            ranked = sorted(zip(documents, doc_scores), key=lambda pair: pair[1], reverse=True)[:top_k]
+            results.append([doc.copy(update={"query_score": score}) for doc, score in ranked])
+        return results
+
+    def _score(self, pairs: List[tuple]) -> List[float]:
+        # sort by length, so that the pairs of a batch need little padding
+        order = sorted(range(len(pairs)), key=lambda idx: len(pairs[idx][0]) + len(pairs[idx][1]))
+        scores = np.zeros(len(pairs), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            batch = [pairs[idx] for idx in order[start:start + self.batch_size]]
+            inputs = self.tokenizer([query for query, _ in batch], [text for _, text in batch], padding=True,
+                                    truncation="only_second", max_length=self.max_seq_len, return_tensors="pt")
+            with torch.no_grad():
+                logits = self.model(**{name: tensor.to(self.device) for name, tensor in inputs.items()})[0]
+            if self.num_labels == 1:
+                batch_scores = logits[:, 0]
+            else:
+                # log-probability of the "relevant" class
+                batch_scores = torch.log_softmax(logits, dim=-1)[:, -1]
+            scores[order[start:start + self.batch_size]] = batch_scores.float().cpu().numpy()
+        return scores.tolist()
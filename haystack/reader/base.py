@@ -5,7 +5,36 @@ from haystack.database.base import Document
 
 
 class BaseReader(ABC):
+    # whether predict() can stop reading early via predict(..., early_exit=True)
+    supports_early_exit = False
+
+    @property
+    def tokenizer_fingerprint(self) -> str:
+        """
+        Key of the tokens stored by `pretokenize()` with the documents (see haystack.reader.pretokenization).
+        """
+        raise NotImplementedError(f"{type(self).__name__} doesn't support pre-tokenized passages.")
+
+    def pretokenize(self, texts: List[str]) -> List[dict]:
+        """
+        Tokenize passages at indexing time (see `update_reader_tokens()` of the document stores), so that only the
+        question needs to be tokenized at query time. Readers that support this override it.
+        """
+        raise NotImplementedError(f"{type(self).__name__} doesn't support pre-tokenized passages.")
 
     @abstractmethod
     def predict(self, question: str, documents: List[Document], top_k: Optional[int] = None):
         pass
+
+    def predict_batch(self, questions: List[str], documents_per_question: List[List[Document]],
+                      top_k: Optional[int] = None) -> List[dict]:
+        """
+        Predict the answers of several questions, each in its own list of documents.
+        Readers that can process all questions together (e.g. FARMReader) override this.
+
+        :return: one prediction (see `predict()`) per question
+        """
+        if len(questions) != len(documents_per_question):
+            raise ValueError(f"Got {len(questions)} questions, but {len(documents_per_question)} lists of documents.")
+        return [self.predict(question=question, documents=documents, top_k=top_k)
+                for question, documents in zip(questions, documents_per_question)]
@@ -0,0 +1,64 @@
+import hashlib
+import re
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple, Union
+
+from haystack.cache import KeyValueCache
+from haystack.database.base import Document
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Lower case, collapsed whitespace and no trailing question marks, so that trivial variants of a question share
+    their cache entries.
+    """
+    return _WHITESPACE.sub(" ", question).strip().rstrip("?").strip().lower()
+
+
+class ReaderCache(KeyValueCache):
+    """
+    Cache of the reader's predictions per (question, passage), i.e. the candidate answers of a passage incl. its
+    "no answer" gap, before they are aggregated over all passages of a query. Readers with a `result_cache` only run
+    the model on the passages that aren't cached yet.
+
+    Entries are keyed by the normalized question, the document id, the hash of the document's exact text (answers
+    contain character offsets, so unlike for embeddings whitespace isn't normalized) and the model version of the
+    reader (model and all settings that change its predictions). The most recently used `max_size` entries are kept
+    in memory, optionally backed by a SQLite file that persists all entries across restarts and processes.
+
+    Usage:
+        >>> cache = ReaderCache(max_size=100000, path="reader_cache.db")
+        >>> reader = FARMReader(model_name_or_path="deepset/roberta-base-squad2", result_cache=cache)
+        >>> cache.stats
+    """
+
+    def __init__(self, max_size: int = 10000, path: Optional[Union[str, Path]] = None, timeout: float = 60.0):
+        """
+        :param max_size: max. number of predictions kept in memory (least recently used ones are evicted first)
+        :param path: optional path of a SQLite file to also store the predictions in (created if it doesn't exist)
+        :param timeout: seconds to wait for a lock on the file held by another process
+        """
+        if max_size < 1:
+            raise ValueError(f"max_size needs to be at least 1, not {max_size}.")
+        super().__init__(path=path, max_size=max_size, timeout=timeout, table="reader_predictions")
+
+    @staticmethod
+    def key(model_version: str, question: str, document: Document) -> str:
+        text_hash = hashlib.sha256(document.text.encode("utf-8")).hexdigest()
+        return f"{model_version}|{document.id}|{text_hash}|{normalize_question(question)}"
+
+    def predict(self, model_version: str, pairs: List[Tuple[str, Document]],
+                predict_fn: Callable[[List[Tuple[str, Document]]], List[Any]]) -> List[Any]:
+        """
+        Get the predictions of (question, document) pairs from the cache and run `predict_fn` on the missing ones
+        (each missing pair only once).
+
+        :param model_version: version of the reader's model and settings (see `model_version` of the readers)
+        :param pairs: (question, document) pairs
+        :param predict_fn: function that predicts a list of pairs and returns one prediction per pair
+        :return: one prediction per pair
+        """
+        keys = [self.key(model_version, question, document) for question, document in pairs]
+        return self.get_or_compute(keys, pairs, predict_fn)
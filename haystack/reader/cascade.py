@@ -0,0 +1,219 @@
+import json
+import logging
+import re
+import string
+import threading
+import time
+from collections import Counter
+from itertools import product
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+from haystack.database.base import Document
+from haystack.reader.base import BaseReader
+
+logger = logging.getLogger(__name__)
+
+
+class CascadeReader(BaseReader):
+    """
+    Two readers in a cascade: a fast one (e.g. a distilled model) answers all questions and only the questions it
+    isn't confident about are escalated to a large one (e.g. deepset/roberta-base-squad2).
+    A question is escalated if the probability of the fast reader's top answer is below `min_probability` or if its
+    "no answer" gap is below `min_no_ans_gap`, i.e. it can hardly decide between an answer and "no answer".
+
+    Use `eval_on_file()` to pick the thresholds for your data and `stats` to monitor the escalation rate.
+
+    Usage:
+        >>> fast_reader = FARMReader(model_name_or_path="distilbert-base-uncased-distilled-squad")
+        >>> large_reader = FARMReader(model_name_or_path="deepset/roberta-base-squad2")
+        >>> reader = CascadeReader(fast_reader, large_reader, min_probability=0.8)
+        >>> finder = Finder(reader, retriever)
+    """
+
+    def __init__(self,
+                 fast_reader: BaseReader,
+                 large_reader: BaseReader,
+                 min_probability: Optional[float] = 0.7,
+                 min_no_ans_gap: Optional[float] = None):
+        """
+        :param fast_reader: reader that answers all questions first
+        :param large_reader: reader for the questions the fast reader isn't confident about
+        :param min_probability: escalate if the top answer of the fast reader has a lower probability (or if there is
+                                no answer at all). None = don't escalate based on the probability.
+        :param min_no_ans_gap: escalate if the absolute "no answer" gap of the fast reader (`no_ans_gap` of
+                               FARMReader's predictions) is lower. None = don't escalate based on the gap.
+        """
+        self.fast_reader = fast_reader
+        self.large_reader = large_reader
+        self.min_probability = min_probability
+        self.min_no_ans_gap = min_no_ans_gap
+        self.stats = {"questions": 0, "escalated": 0, "escalation_rate": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def predict(self, question: str, documents: List[Document], top_k: Optional[int] = None):
+        """
+        Answers of the fast reader, or of the large reader if the question was escalated (see `predict()` of the
+        readers). The result also contains whether the question was escalated (`escalated`).
+
+        :param question: question string
+        :param documents: list of Document in which to search for the answer
+        :param top_k: the maximum number of answers to return
+        :return: dict containing question, answers and escalated
+        """
+        return self.predict_batch([question], [documents], top_k=top_k)[0]
+
+    def predict_batch(self, questions: List[str], documents_per_question: List[List[Document]],
+                      top_k: Optional[int] = None) -> List[dict]:
+        """
+        Like `predict()` for several questions. Each reader processes its questions with one `predict_batch()` call.
+        """
+        if len(questions) != len(documents_per_question):
+            raise ValueError(f"Got {len(questions)} questions, but {len(documents_per_question)} lists of documents.")
+        results = self.fast_reader.predict_batch(questions, documents_per_question, top_k=top_k)
+        escalated = [idx for idx, result in enumerate(results)
+                     if self.needs_escalation(result, self.min_probability, self.min_no_ans_gap)]
+        if escalated:
+            large_results = self.large_reader.predict_batch([questions[idx] for idx in escalated],
+                                                            [documents_per_question[idx] for idx in escalated],
+                                                            top_k=top_k)
+            for idx, result in zip(escalated, large_results):
+                results[idx] = result
+        escalated_set = set(escalated)
+        for idx, result in enumerate(results):
+            result["escalated"] = idx in escalated_set
+
+        with self._stats_lock:
+            self.stats["questions"] += len(questions)
+            self.stats["escalated"] += len(escalated)
+            self.stats["escalation_rate"] = self.stats["escalated"] / self.stats["questions"] \
+                if self.stats["questions"] else 0.0
+        logger.debug(f"Escalated {len(escalated)} of {len(questions)} questions to the large reader")
+        return results
+
+    @staticmethod
+    def needs_escalation(result: dict, min_probability: Optional[float], min_no_ans_gap: Optional[float]) -> bool:
+        """
+        Whether a prediction of the fast reader isn't confident enough for the given thresholds.
+        """
+        if min_probability is not None:
+            if not result["answers"] or result["answers"][0]["probability"] < min_probability:
+                return True
+        if min_no_ans_gap is not None and result.get("no_ans_gap") is not None:
+            if abs(result["no_ans_gap"]) < min_no_ans_gap:
+                return True
+        return False
+
+    def log_stats(self):
+        logger.info(f"Cascade reader: {self.stats['escalated']} of {self.stats['questions']} questions escalated "
+                    f"(escalation rate {self.stats['escalation_rate']:.1%})")
+
+    def eval_on_file(self,
+                     data_dir: Union[str, Path],
+                     test_filename: str,
+                     probability_thresholds: Sequence[Optional[float]] = (0.5, 0.6, 0.7, 0.8, 0.9),
+                     no_ans_gap_thresholds: Sequence[Optional[float]] = (None,),
+                     max_f1_loss: float = 0.01,
+                     batch_size: int = 32) -> dict:
+        """
+        Evaluates the cascade for all combinations of the given thresholds on a SQuAD-formatted file, to pick the
+        thresholds with the best trade-off between accuracy and speed. Both readers answer all questions once (on
+        the question's paragraph), so all combinations are evaluated from the same predictions.
+
+        Returns a dict containing:
+            - "fast" / "large": "EM" (exact match), "f1" and "avg_time" (seconds per question) of each reader alone
+            - "thresholds": one dict per combination of `min_probability` and `min_no_ans_gap` with the
+              "escalation_rate", "EM" and "f1" of the cascade and its estimated "avg_time" per question
+            - "recommended": the combination with the lowest escalation rate whose f1 is at most `max_f1_loss` below
+              the f1 of the large reader (None if there is none)
+
+        Unanswerable questions count as correct, if the top answer is "no answer".
+        The thresholds of the cascade itself aren't changed.
+
+        :param data_dir: The directory in which the test set can be found
+        :param test_filename: The name of the file containing the test data in SQuAD format.
+        :param probability_thresholds: values of `min_probability` to evaluate
+        :param no_ans_gap_thresholds: values of `min_no_ans_gap` to evaluate
+        :param max_f1_loss: max. acceptable f1 loss of the recommended thresholds compared to the large reader
+        :param batch_size: number of questions passed to the readers at once
+        """
+        with open(Path(data_dir) / test_filename, encoding="utf-8") as f:
+            data = json.load(f)["data"]
+        questions = []
+        documents = []
+        gold_answers = []
+        for doc_idx, document in enumerate(data):
+            for par_idx, paragraph in enumerate(document["paragraphs"]):
+                doc = Document(id=f"{doc_idx}-{par_idx}", text=paragraph["context"])
+                for qa in paragraph["qas"]:
+                    questions.append(qa["question"])
+                    documents.append([doc])
+                    gold_answers.append([] if qa.get("is_impossible") else [a["text"] for a in qa["answers"]])
+        if not questions:
+            raise ValueError(f"No questions found in {Path(data_dir) / test_filename}.")
+
+        fast_results, fast_time = self._eval_predict(self.fast_reader, questions, documents, batch_size)
+        large_results, large_time = self._eval_predict(self.large_reader, questions, documents, batch_size)
+        fast_scores = [self._squad_scores(result, gold) for result, gold in zip(fast_results, gold_answers)]
+        large_scores = [self._squad_scores(result, gold) for result, gold in zip(large_results, gold_answers)]
+
+        results = {"fast": self._summarize(fast_scores, fast_time),
+                   "large": self._summarize(large_scores, large_time),
+                   "thresholds": []}  # type: dict
+        for min_probability, min_no_ans_gap in product(probability_thresholds, no_ans_gap_thresholds):
+            escalated = [self.needs_escalation(result, min_probability, min_no_ans_gap) for result in fast_results]
+            scores = [large if escalate else fast for escalate, fast, large in zip(escalated, fast_scores, large_scores)]
+            escalation_rate = sum(escalated) / len(escalated)
+            summary = self._summarize(scores, fast_time + escalation_rate * large_time)
+            results["thresholds"].append(dict(min_probability=min_probability, min_no_ans_gap=min_no_ans_gap,
+                                              escalation_rate=escalation_rate, **summary))
+
+        acceptable = [thresholds for thresholds in results["thresholds"]
+                      if thresholds["f1"] >= results["large"]["f1"] - max_f1_loss]
+        results["recommended"] = min(acceptable, key=lambda thresholds: thresholds["escalation_rate"]) \
+            if acceptable else None
+        return results
+
+    @staticmethod
+    def _eval_predict(reader: BaseReader, questions: List[str], documents: List[List[Document]],
+                      batch_size: int) -> Tuple[List[dict], float]:
+        # predictions of a reader and its average time per question
+        start_time = time.time()
+        results = []  # type: List[dict]
+        for start in range(0, len(questions), batch_size):
+            results += reader.predict_batch(questions[start:start + batch_size],
+                                            documents[start:start + batch_size], top_k=1)
+        return results, (time.time() - start_time) / len(questions)
+
+    @staticmethod
+    def _summarize(scores: List[Tuple[float, float]], avg_time: float) -> dict:
+        return {"EM": sum(em for em, _ in scores) / len(scores),
+                "f1": sum(f1 for _, f1 in scores) / len(scores),
+                "avg_time": avg_time}
+
+    @classmethod
+    def _squad_scores(cls, result: dict, gold_answers: List[str]) -> Tuple[float, float]:
+        # exact match and f1 of the top answer like the official SQuAD evaluation ("no answer" = empty string)
+        prediction = cls._normalize_answer((result["answers"][0]["answer"] or "") if result["answers"] else "")
+        golds = [cls._normalize_answer(answer) for answer in gold_answers] or [""]
+        exact_match = max(float(prediction == gold) for gold in golds)
+        f1 = max(cls._f1(prediction, gold) for gold in golds)
+        return exact_match, f1
+
+    @staticmethod
+    def _normalize_answer(text: str) -> str:
+        text = "".join(char for char in text.lower() if char not in string.punctuation)
+        text = re.sub(r"\b(a|an|the)\b", " ", text)
+        return " ".join(text.split())
+
+    @staticmethod
+    def _f1(prediction: str, gold: str) -> float:
+        prediction_tokens, gold_tokens = prediction.split(), gold.split()
+        if not prediction_tokens or not gold_tokens:
+            return float(prediction_tokens == gold_tokens)
+        overlap = sum((Counter(prediction_tokens) & Counter(gold_tokens)).values())
+        if overlap == 0:
+            return 0.0
+        precision = overlap / len(prediction_tokens)
+        recall = overlap / len(gold_tokens)
+        return 2 * precision * recall / (precision + recall)
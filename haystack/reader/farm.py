@@ -1,16 +1,24 @@
 import logging
+import math
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing.pool import Pool
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
 
 import numpy as np
+import torch
 from farm.data_handler.data_silo import DataSilo
 from farm.data_handler.processor import SquadProcessor
 from farm.data_handler.dataloader import NamedDataLoader
 from farm.data_handler.inputs import QAInput, Question
+from farm.data_handler.samples import SampleBasket
 from farm.infer import QAInferencer
 from farm.modeling.optimization import initialize_optimizer
 from farm.modeling.predictions import QAPred, QACandidate
 from farm.modeling.adaptive_model import BaseAdaptiveModel
+from farm.modeling.tokenization import tokenize_with_metadata
 from farm.train import Trainer
 from farm.eval import Evaluator
 from farm.utils import set_all_seeds, initialize_device_settings
@@ -20,8 +28,57 @@ import shutil
 from haystack.database.base import Document
 from haystack.database.elasticsearch import ElasticsearchDocumentStore
 from haystack.reader.base import BaseReader
+from haystack.reader.cache import ReaderCache
+from haystack.reader.pretokenization import ReaderTokens, get_reader_tokens, make_reader_tokens, tokenizer_fingerprint
+from haystack.utils import compare_quantization_results, get_model_size_mb, quantize_model
 logger = logging.getLogger(__name__)
 
+# processor of a preprocessing worker, sent once when the worker starts instead of with every chunk
+_worker_processor = None
+
+
+def _init_preprocessing_worker(processor: SquadProcessor):
+    global _worker_processor
+    _worker_processor = processor
+
+
+def _preprocess_chunk(chunk: Tuple[List[int], List[dict]]):
+    indices, dicts = chunk
+    return _dataset_from_dicts(_worker_processor, dicts, indices)
+
+
+def _dataset_from_dicts(processor: SquadProcessor, dicts: List[dict], indices: List[int]):
+    """
+    Like `SquadProcessor.dataset_from_dicts(..., return_baskets=True)`, but the passages of dicts with a
+    "document_tokens" entry (tokenized at indexing time, see `FARMReader.pretokenize()`) aren't tokenized again.
+    """
+    if not any("document_tokens" in d for d in dicts):
+        return processor.dataset_from_dicts(dicts, indices=indices, return_baskets=True)
+
+    # the raw baskets as built by SquadProcessor._dicts_to_baskets() for inference dicts
+    baskets = []
+    for index, d in zip(indices, dicts):
+        document = d.get("document_tokens") or tokenize_with_metadata(d["context"], processor.tokenizer)
+        for q_idx, question in enumerate(d["qas"]):
+            question_tokenized = tokenize_with_metadata(question["question"], processor.tokenizer)
+            raw = {"document_text": d["context"],
+                   "document_tokens": document["tokens"],
+                   "document_offsets": document["offsets"],
+                   "document_start_of_word": [int(x) for x in document["start_of_word"]],
+                   "question_text": question["question"],
+                   "question_tokens": question_tokenized["tokens"],
+                   "question_offsets": question_tokenized["offsets"],
+                   "question_start_of_word": [int(x) for x in question_tokenized["start_of_word"]],
+                   "answers": [],
+                   "answer_type": None,
+                   "external_id": question["id"]}
+            baskets.append(SampleBasket(raw=raw, id_internal=f"{index}-{q_idx}", id_external=question["id"]))
+    processor.baskets = baskets
+    processor._init_samples_in_baskets()
+    processor._featurize_samples()
+    dataset, tensor_names = processor._create_dataset(keep_baskets=True)
+    return dataset, tensor_names, processor.baskets
+
 
 class FARMReader(BaseReader):
     """
@@ -33,6 +90,8 @@ class FARMReader(BaseReader):
      - fine-tune the model on QA data via train()
     """
 
+    supports_early_exit = True
+
     def __init__(
         self,
         model_name_or_path: Union[str, Path],
@@ -45,6 +104,13 @@ class FARMReader(BaseReader):
         num_processes: Optional[int] = None,
         max_seq_len: int = 256,
         doc_stride: int = 128,
+        quantize: Optional[str] = None,
+        fast_path_max_passages: int = 16,
+        early_exit_batch_size: int = 2,
+        early_exit_margin: float = 5.0,
+        early_exit_probability: Optional[float] = 0.9,
+        min_retriever_score: Optional[float] = None,
+        result_cache: Optional[ReaderCache] = None,
     ):
 
         """
@@ -74,12 +140,31 @@ class FARMReader(BaseReader):
                                                Note: - This is not the number of "final answers" you will receive
                                                (see `top_k` in FARMReader.predict() or Finder.get_answers() for that)
                                              - FARM includes no_answer in the sorted list of predictions
-        :param num_processes: the number of processes for `multiprocessing.Pool`. Set to value of 0 to disable
-                              multiprocessing. Set to None to let Inferencer determine optimum number. If you
+        :param num_processes: the number of processes of the preprocessing pool, which tokenizes and splits passages
+                              while the model processes the previous chunk of passages. The pool is started with
+                              the first large request and reused afterwards. Set to value of 0 to disable
+                              multiprocessing. Set to None to use all CPU cores minus one. If you
                               want to debug the Language Model, you might need to disable multiprocessing!
         :type num_processes: int
         :param max_seq_len: max sequence length of one input text for the model
         :param doc_stride: length of striding window for splitting long texts (used if len(text) > max_seq_len)
+        :param quantize: Quantize the model for faster inference on CPU. Options: None (default), "dynamic_int8"
+                         (weights of linear layers in int8). Use `eval_on_file(..., compare_quantization=...)` to check
+                         the impact on accuracy for your data.
+        :param fast_path_max_passages: Requests with up to this many passages are preprocessed in the calling
+                                       process, as shipping them to the preprocessing pool costs more than it saves.
+        :param early_exit_batch_size: Number of passages read at once by `predict(..., early_exit=True)`.
+        :param early_exit_margin: `predict(..., early_exit=True)` stops once the score of the best answer exceeds the
+                                  best score of the other passages in the last read batch (or of all other passages
+                                  read so far, if the best answer is the only one in the last batch) by this margin.
+                                  This is a heuristic: it assumes that lower ranked passages don't score higher than
+                                  the last read ones, so a better answer further down can be missed.
+        :param early_exit_probability: `predict(..., early_exit=True)` stops once the best answer has at least this
+                                       probability. None = only use `early_exit_margin`.
+        :param min_retriever_score: `predict(..., early_exit=True)` skips passages with a lower retriever score
+                                    (`Document.query_score`).
+        :param result_cache: ReaderCache for the predictions per (question, passage). Only passages that aren't
+                             cached yet are read by the model.
 
         """
 
@@ -91,7 +176,7 @@ class FARMReader(BaseReader):
         self.top_k_per_candidate = top_k_per_candidate
         self.inferencer = QAInferencer.load(model_name_or_path, batch_size=batch_size, gpu=use_gpu,
                                           task_type="question_answering", max_seq_len=max_seq_len,
-                                          doc_stride=doc_stride, num_processes=num_processes)
+                                          doc_stride=doc_stride, num_processes=0)
         self.inferencer.model.prediction_heads[0].context_window_size = context_window_size
         self.inferencer.model.prediction_heads[0].no_ans_boost = no_ans_boost
         self.inferencer.model.prediction_heads[0].n_best = top_k_per_candidate + 1 # including possible no_answer
@@ -99,8 +184,37 @@ class FARMReader(BaseReader):
             self.inferencer.model.prediction_heads[0].n_best_per_sample = top_k_per_sample
         except:
             logger.warning("Could not set `top_k_per_sample` in FARM. Please update FARM version.")
+        self.model_name_or_path = str(model_name_or_path)
         self.max_seq_len = max_seq_len
+        self.doc_stride = doc_stride
         self.use_gpu = use_gpu
+        self.result_cache = result_cache
+        if num_processes is None:
+            num_processes = max(mp.cpu_count() - 1, 1)
+        self.num_processes = num_processes
+        self.fast_path_max_passages = fast_path_max_passages
+        self.early_exit_batch_size = early_exit_batch_size
+        self.early_exit_margin = early_exit_margin
+        self.early_exit_probability = early_exit_probability
+        self.min_retriever_score = min_retriever_score
+        self._preprocessing_pool = None  # type: Optional[Pool]
+        # the processor keeps the baskets of the dicts it converts as state, so the in-process fast path must not
+        # be used by several threads (e.g. of the REST API) at the same time
+        self._processor_lock = threading.Lock()
+        self._tokenizer_fingerprint = None  # type: Optional[str]
+        self._fp32_model = self.inferencer.model
+        self.quantize = None  # type: Optional[str]
+        self.set_quantization(quantize)
+
+    def set_quantization(self, quantize: Optional[str]):
+        """
+        Switch between the full precision model (None) and a quantized copy of it (e.g. "dynamic_int8").
+        """
+        self.inferencer.model = quantize_model(self._fp32_model, quantize)
+        self.quantize = quantize
+
+    def model_size_mb(self) -> float:
+        return get_model_size_mb(self.inferencer.model)
 
     def train(
         self,
@@ -182,7 +296,7 @@ class FARMReader(BaseReader):
         # Quick-fix until this is fixed upstream in FARM:
         # We must avoid applying DataParallel twice (once when loading the inferencer,
         # once when calling initalize_optimizer)
-        self.inferencer.model.save("tmp_model")
+        self._fp32_model.save("tmp_model")
         model = BaseAdaptiveModel.load(load_dir="tmp_model", device=device, strict=True)
         shutil.rmtree('tmp_model')
 
@@ -210,15 +324,20 @@ class FARMReader(BaseReader):
 
 
         # 5. Let it grow!
-        self.inferencer.model = trainer.train()
+        self._fp32_model = trainer.train()
+        if self.quantize:
+            # a quantized reader runs on CPU
+            self._fp32_model.to("cpu")
+        self.set_quantization(self.quantize)
         self.save(Path(save_dir))
 
     def save(self, directory: Path):
         logger.info(f"Saving reader model to {directory}")
-        self.inferencer.model.save(directory)
+        # quantized models can't be loaded again by FARM, so always save the full precision model
+        self._fp32_model.save(directory)
         self.inferencer.processor.save(directory)
 
-    def predict(self, question: str, documents: List[Document], top_k: Optional[int] = None):
+    def predict(self, question: str, documents: List[Document], top_k: Optional[int] = None, early_exit: bool = False):
         """
         Use loaded QA model to find answers for a question in the supplied list of Document.
 
@@ -241,28 +360,215 @@ class FARMReader(BaseReader):
         :param question: question string
         :param documents: list of Document in which to search for the answer
         :param top_k: the maximum number of answers to return
+        :param early_exit: Read the documents in order of their retriever score in batches of
+                           `early_exit_batch_size` and stop as soon as a good enough answer was found (see
+                           `early_exit_margin`, `early_exit_probability` and `min_retriever_score`). The result
+                           then also contains the number of documents that were read (`passages_read`).
         :return: dict containing question and answers
         """
+        if early_exit:
+            return self._predict_early_exit(question, documents, top_k)
+        return self._predict_many([(question, documents, top_k)])[0]
 
-        # convert input to FARM format
-        inputs = []
-        for doc in documents:
-            cur = QAInput(doc_text=doc.text,
-                          questions=Question(text=question,
-                                             uid=doc.id))
-            inputs.append(cur)
-
-        # get answers from QA model
-        predictions = self.inferencer.inference_from_objects(
-            objects=inputs, return_json=False, multiprocessing_chunksize=1
-        )
+    def predict_batch(self, questions: List[str], documents_per_question: List[List[Document]],
+                      top_k: Optional[int] = None) -> List[dict]:
+        """
+        Use loaded QA model to find answers for several questions, each in its own list of Document.
+
+        All (question, passage) pairs are packed into the same batches of the model, instead of running one
+        inference per question. Answers (incl. "no answer", see `_calc_no_answer()`) are assembled per question.
+
+        :param questions: question strings
+        :param documents_per_question: list of Document to search in for each question
+        :param top_k: the maximum number of answers to return per question
+        :return: one dict containing question and answers per question (like `predict()`)
+        """
+        if len(questions) != len(documents_per_question):
+            raise ValueError(f"Got {len(questions)} questions, but {len(documents_per_question)} lists of documents.")
+        return self._predict_many([(question, documents, top_k)
+                                   for question, documents in zip(questions, documents_per_question)])
+
+    def _predict_many(self, calls: List[Tuple[str, List[Document], Optional[int]]]) -> List[dict]:
+        """
+        Process several `predict()` calls (question, documents, top_k) with one pass of all their passages through
+        the model, e.g. the calls of concurrent requests collected by haystack.batching.BatchedReader.
+        """
+        # the passages of all calls together, so that they share the model's batches
+        predictions = self._predict_passages([(question, doc) for question, documents, _ in calls for doc in documents])
+
+        results = []
+        start = 0
+        for question, documents, top_k in calls:
+            if not documents:
+                results.append({"question": question, "answers": []})
+                continue
+            results.append(self._assemble_answers(question, predictions[start:start + len(documents)], top_k))
+            start += len(documents)
+        return results
+
+    def _predict_early_exit(self, question: str, documents: List[Document], top_k: Optional[int]) -> dict:
+        """
+        Read the documents in batches by descending retriever score and stop once the best answer is good enough.
+        The score the remaining passages could still reach isn't known, so it is estimated by the best score of the
+        other passages in the last batch (heuristic, see `early_exit_margin`).
+        """
+        # highest retriever score first, documents without score keep their position behind the scored ones
+        ranked = sorted(documents, key=lambda doc: doc.query_score if doc.query_score is not None else -np.inf,
+                        reverse=True)
+        if self.min_retriever_score is not None:
+            ranked = [doc for doc in ranked if doc.query_score is None or doc.query_score >= self.min_retriever_score]
+
+        predictions = []  # type: List[QAPred]
+        best_scores = []  # type: List[float]
+        for start in range(0, len(ranked), self.early_exit_batch_size):
+            batch = ranked[start:start + self.early_exit_batch_size]
+            batch_predictions = self._predict_passages([(question, doc) for doc in batch])
+            predictions += batch_predictions
+            # best answer score of each passage read so far
+            best_scores += [max([ans.score for ans in pred.prediction if not self._check_no_answer(ans)],
+                                default=-np.inf) for pred in batch_predictions]
+            if start + len(batch) >= len(ranked):
+                break
+
+            best = int(np.argmax(best_scores))
+            # estimate of the best score of the remaining (lower ranked) passages: the best other one of the last
+            # batch or, if the last batch holds only the best passage (e.g. early_exit_batch_size=1), of all others
+            others = [score for idx, score in enumerate(best_scores[start:], start) if idx != best] or \
+                [score for idx, score in enumerate(best_scores) if idx != best]
+            if others and best_scores[best] - max(others) >= self.early_exit_margin:
+                break
+            if self.early_exit_probability is not None and \
+                    float(expit(best_scores[best] / 8)) >= self.early_exit_probability:
+                break
+
+        logger.info(f"Read {len(predictions)} of {len(documents)} passages "
+                    f"({len(documents) - len(ranked)} below min_retriever_score)")
+        if not predictions:
+            return {"question": question, "answers": [], "passages_read": 0}
+        result = self._assemble_answers(question, predictions, top_k)
+        result["passages_read"] = len(predictions)
+        return result
+
+    def _predict_passages(self, pairs: List[Tuple[str, Document]]) -> List[QAPred]:
+        # predictions per (question, document), from the result cache or the model
+        if self.result_cache is None:
+            return self._read_passages(pairs)
+        return self.result_cache.predict(self.model_version, pairs, self._read_passages)
+
+    def _read_passages(self, pairs: List[Tuple[str, Document]]) -> List[QAPred]:
+        # convert input to FARM format and get answers from QA model
+        inputs = [QAInput(doc_text=doc.text, questions=Question(text=question, uid=doc.id)) for question, doc in pairs]
+        dicts = [cur.to_dict() for cur in inputs]
+        tokenizer = self.inferencer.processor.tokenizer
+        for d, (_, doc) in zip(dicts, pairs):
+            tokens = get_reader_tokens(doc, self.tokenizer_fingerprint) if doc.reader_tokens else None
+            if tokens is not None:
+                d["document_tokens"] = {"tokens": tokenizer.convert_ids_to_tokens(tokens["input_ids"].tolist()),
+                                        "offsets": tokens["offsets"].tolist(),
+                                        "start_of_word": tokens["start_of_word"].tolist()}
+        return self._inference(dicts)
+
+    @property
+    def tokenizer_fingerprint(self) -> str:
+        if self._tokenizer_fingerprint is None:
+            self._tokenizer_fingerprint = tokenizer_fingerprint(self.inferencer.processor.tokenizer, scheme="farm")
+        return self._tokenizer_fingerprint
+
+    def pretokenize(self, texts: List[str]) -> List[ReaderTokens]:
+        """
+        Tokenize passages like the reader's processor does (token ids, character offsets and start of word flags),
+        to be stored with the documents via `update_reader_tokens()` of the document stores.
+        Passages with stored tokens are not tokenized again at query time, only the question is.
+        """
+        tokenizer = self.inferencer.processor.tokenizer
+        tokens_per_text = []
+        for text in texts:
+            tokenized = tokenize_with_metadata(text, tokenizer)
+            tokens_per_text.append(make_reader_tokens(
+                text,
+                input_ids=np.array(tokenizer.convert_tokens_to_ids(tokenized["tokens"]), dtype=np.int32),
+                offsets=np.array(tokenized["offsets"], dtype=np.int32),
+                start_of_word=np.array(tokenized["start_of_word"], dtype=bool)))
+        return tokens_per_text
+
+    @property
+    def model_version(self) -> str:
+        """
+        Model and all settings that change the predictions per passage (key of the result cache).
+        """
+        head = self.inferencer.model.prediction_heads[0]
+        return (f"farm:{self.model_name_or_path}:{self.quantize}:{self.max_seq_len}:{self.doc_stride}:"
+                f"{head.no_ans_boost}:{head.n_best}:{getattr(head, 'n_best_per_sample', None)}:"
+                f"{head.context_window_size}")
+
+    def _inference(self, dicts: List[dict]) -> List[QAPred]:
+        """
+        Preprocess (tokenize and split into windows of max_seq_len with doc_stride) the passages and predict answers.
+
+        Small requests are preprocessed in this process. Larger ones are split into chunks of passages that the
+        preprocessing pool converts while the model processes the chunks that are already done.
+        """
+        if not dicts:
+            return []
+        if self.num_processes == 0 or len(dicts) <= self.fast_path_max_passages:
+            with self._processor_lock:
+                dataset, tensor_names, baskets = _dataset_from_dicts(self.inferencer.processor, dicts,
+                                                                     indices=list(range(len(dicts))))
+            return self._predict_dataset(dataset, tensor_names, baskets)
+
+        # enough chunks to keep all workers busy, but at most batch_size passages, so that the model can start early
+        chunk_size = min(math.ceil(len(dicts) / self.num_processes), self.inferencer.batch_size)
+        chunks = [(list(range(start, min(start + chunk_size, len(dicts)))), dicts[start:start + chunk_size])
+                  for start in range(0, len(dicts), chunk_size)]
+        logger.debug(f"Preprocessing {len(dicts)} passages in {len(chunks)} chunks with {self.num_processes} workers")
+        predictions = []  # type: List[QAPred]
+        for dataset, tensor_names, baskets in self.preprocessing_pool.imap(_preprocess_chunk, chunks):
+            predictions += self._predict_dataset(dataset, tensor_names, baskets)
+        return predictions
+
+    def _predict_dataset(self, dataset, tensor_names: List[str], baskets: list) -> List[QAPred]:
+        # Like Inferencer._get_predictions_and_aggregate(), but slices the batches directly from the dataset's
+        # tensors instead of collating them sample by sample with a DataLoader
+        if dataset is None:
+            return []
+        model = self.inferencer.model
+        batch_size = self.inferencer.batch_size
+        unaggregated_preds_all = []
+        with torch.no_grad():
+            for start in range(0, len(dataset), batch_size):
+                batch = {name: tensor[start:start + batch_size].to(self.inferencer.device)
+                         for name, tensor in zip(tensor_names, dataset.tensors)}
+                logits = model.forward(**batch)
+                unaggregated_preds_all.append(model.logits_to_preds(logits, **batch))
+        return model.formatted_preds(logits=[None], preds=unaggregated_preds_all, baskets=baskets)
+
+    @property
+    def preprocessing_pool(self) -> Pool:
+        # the processor gets pickled for the workers, so not while a request uses it on the fast path
+        with self._processor_lock:
+            if self._preprocessing_pool is None:
+                logger.info(f"Starting {self.num_processes} preprocessing workers")
+                self._preprocessing_pool = Pool(processes=self.num_processes, initializer=_init_preprocessing_worker,
+                                                initargs=(self.inferencer.processor,))
+        return self._preprocessing_pool
+
+    def close_preprocessing_pool(self):
+        """
+        Stop the workers of the preprocessing pool (a new pool is started if needed by a later request).
+        """
+        if self._preprocessing_pool is not None:
+            self._preprocessing_pool.close()
+            self._preprocessing_pool.join()
+            self._preprocessing_pool = None
+
+    def _assemble_answers(self, question: str, predictions: List[QAPred], top_k: Optional[int]) -> dict:
         # assemble answers from all the different documents & format them.
         # For the "no answer" option, we collect all no_ans_gaps and decide how likely
         # a no answer is based on all no_ans_gaps values across all documents
         answers = []
         no_ans_gaps = []
         best_score_answer = 0
-        for pred, inp in zip(predictions, inputs):
+        for pred in predictions:
             answers_per_document = []
             no_ans_gaps.append(pred.no_answer_gap)
             for ans in pred.prediction:
@@ -303,7 +609,7 @@ class FARMReader(BaseReader):
 
         return result
 
-    def eval_on_file(self, data_dir: str, test_filename: str, device: str):
+    def eval_on_file(self, data_dir: str, test_filename: str, device: str, compare_quantization: Optional[str] = None):
         """
         Performs evaluation on a SQuAD-formatted file.
 
@@ -311,6 +617,9 @@ class FARMReader(BaseReader):
             - "EM": exact match score
             - "f1": F1-Score
             - "top_n_accuracy": Proportion of predicted answers that match with correct answer
+            - "quantization" (only if `compare_quantization` is set): change of the metrics above
+              ("EM_delta", "f1_delta", "top_n_accuracy_delta"), "speedup" and "memory_saving" of the quantized
+              model compared to the full precision model
 
         :param data_dir: The directory in which the test set can be found
         :type data_dir: Path or str
@@ -318,7 +627,12 @@ class FARMReader(BaseReader):
         :type test_filename: str
         :param device: The device on which the tensors should be processed. Choose from "cpu" and "cuda".
         :type device: str
+        :param compare_quantization: Also evaluate the full precision model and a quantized copy of it
+                                     (e.g. "dynamic_int8") and report the differences. Requires device "cpu".
         """
+        if compare_quantization and device != "cpu":
+            raise ValueError("Quantized models only run on CPU. Please use device='cpu' to compare quantization.")
+
         eval_processor = SquadProcessor(
             tokenizer=self.inferencer.processor.tokenizer,
             max_seq_len=self.inferencer.processor.max_seq_len,
@@ -336,13 +650,33 @@ class FARMReader(BaseReader):
 
         evaluator = Evaluator(data_loader=data_loader, tasks=eval_processor.tasks, device=device)
 
-        eval_results = evaluator.eval(self.inferencer.model)
+        results, eval_time = self._eval_model(evaluator, self.inferencer.model)
+        if compare_quantization:
+            if self.quantize is None:
+                fp32_results, fp32_time = results, eval_time
+            else:
+                fp32_results, fp32_time = self._eval_model(evaluator, self._fp32_model)
+            quantized_model = quantize_model(self._fp32_model, compare_quantization)
+            quantized_results, quantized_time = self._eval_model(evaluator, quantized_model)
+            results["quantization"] = compare_quantization_results(
+                fp32_results, quantized_results, metrics=["EM", "f1", "top_n_accuracy"],
+                time=fp32_time, quantized_time=quantized_time,
+                model_size_mb=get_model_size_mb(self._fp32_model),
+                quantized_model_size_mb=get_model_size_mb(quantized_model)
+            )
+        return results
+
+    @staticmethod
+    def _eval_model(evaluator: Evaluator, model: BaseAdaptiveModel):
+        start_time = time.time()
+        eval_results = evaluator.eval(model)
+        eval_time = time.time() - start_time
         results = {
             "EM": eval_results[0]["EM"],
             "f1": eval_results[0]["f1"],
             "top_n_accuracy": eval_results[0]["top_n_accuracy"]
         }
-        return results
+        return results, eval_time
 
     def eval(
         self,
@@ -0,0 +1,71 @@
+# Passages tokenized with the tokenizer of a reader at indexing time.
+# The tokens are stored with the documents (`Document.reader_tokens`), keyed by the fingerprint of the reader's
+# tokenizer, so that several readers (or a new version of one) can share a document store. At query time the readers
+# then only tokenize the question and build their windows from the stored tokens of the passages.
+
+import base64
+import hashlib
+import io
+import zlib
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+from haystack.database.base import Document
+
+# arrays of one tokenized passage, e.g. {"input_ids": ..., "offsets": ..., "text_crc32": ...}
+ReaderTokens = Dict[str, np.ndarray]
+
+
+def tokenizer_fingerprint(tokenizer, scheme: str) -> str:
+    """
+    Identifier of a tokenizer (class, lower casing and vocabulary) and of the way a reader applies it (`scheme`).
+    Tokens stored for one fingerprint are only used by readers with the same fingerprint.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{scheme}|{type(tokenizer).__name__}|{tokenizer.init_kwargs.get('do_lower_case')}|".encode())
+    for token, idx in sorted(tokenizer.get_vocab().items()):
+        digest.update(f"{token}\t{idx}\n".encode("utf-8"))
+    return f"{scheme}-{digest.hexdigest()[:16]}"
+
+
+def text_checksum(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def make_reader_tokens(text: str, **arrays: np.ndarray) -> ReaderTokens:
+    """
+    Tokens of `text` incl. a checksum of the text, so that tokens of a document whose text changed afterwards
+    (or that was pruned) aren't used.
+    """
+    return dict(arrays, text_crc32=np.array(text_checksum(text), dtype=np.uint32))
+
+
+def encode_reader_tokens(tokens: ReaderTokens) -> str:
+    """
+    Compressed, base64 encoded arrays for storing them in a document store like Elasticsearch.
+    """
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **tokens)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def decode_reader_tokens(payload: Union[str, ReaderTokens]) -> ReaderTokens:
+    if isinstance(payload, str):
+        with np.load(io.BytesIO(base64.b64decode(payload))) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+    return payload
+
+
+def get_reader_tokens(document: Document, fingerprint: str) -> Optional[ReaderTokens]:
+    """
+    Stored tokens of the document for the tokenizer with this fingerprint. None, if there are none or if they
+    don't belong to the current text of the document.
+    """
+    payload = (document.reader_tokens or {}).get(fingerprint)
+    if payload is None:
+        return None
+    tokens = decode_reader_tokens(payload)
+    if int(tokens["text_crc32"]) != text_checksum(document.text):
+        return None
+    return tokens
@@ -1,9 +1,12 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from haystack.reader.transformers_utils import pipeline
 
 from haystack.database.base import Document
 from haystack.reader.base import BaseReader
+from haystack.reader.cache import ReaderCache
+from haystack.reader.pretokenization import ReaderTokens, get_reader_tokens, make_reader_tokens, tokenizer_fingerprint
+from haystack.utils import get_model_size_mb, quantize_model
 
 
 class TransformersReader(BaseReader):
@@ -23,6 +26,9 @@ class TransformersReader(BaseReader):
         context_window_size: int = 30,
         use_gpu: int = 0,
         n_best_per_passage: int = 2,
+        quantize: Optional[str] = None,
+        batch_size: int = 16,
+        result_cache: Optional[ReaderCache] = None,
     ):
         """
         Load a QA model from Transformers.
@@ -39,13 +45,37 @@ class TransformersReader(BaseReader):
                             The context usually helps users to understand if the answer really makes sense.
         :param use_gpu: < 0  -> use cpu
                         >= 0 -> ordinal of the gpu to use
+        :param quantize: Quantize the model for faster inference on CPU (requires use_gpu < 0).
+                         Options: None (default), "dynamic_int8" (weights of linear layers in int8)
+        :param batch_size: Number of passages (or windows of long passages) the model processes at once.
+                           The passages of all documents (and questions in predict_batch()) are batched together.
+        :param result_cache: ReaderCache for the predictions per (question, passage). Only passages that aren't
+                             cached yet are read by the model.
         """
         self.model = pipeline('question-answering', model=model, tokenizer=tokenizer, device=use_gpu)
+        self.model_name = model
+        self.tokenizer_name = tokenizer
+        self.result_cache = result_cache
+        self._tokenizer_fingerprint = None  # type: Optional[str]
+        self._fp32_model = self.model.model
+        self.quantize = None  # type: Optional[str]
+        self.set_quantization(quantize)
         self.context_window_size = context_window_size
         self.n_best_per_passage = n_best_per_passage
+        self.batch_size = batch_size
         #TODO param to modify bias for no_answer
         # TODO context_window_size behaviour different from behavior in FARMReader
 
+    def set_quantization(self, quantize: Optional[str]):
+        """
+        Switch between the full precision model (None) and a quantized copy of it (e.g. "dynamic_int8").
+        """
+        self.model.model = quantize_model(self._fp32_model, quantize)
+        self.quantize = quantize
+
+    def model_size_mb(self) -> float:
+        return get_model_size_mb(self.model.model)
+
     def predict(self, question: str, documents: List[Document], top_k: Optional[int] = None):
         """
         Use loaded QA model to find answers for a question in the supplied list of Document.
@@ -72,37 +102,88 @@ class TransformersReader(BaseReader):
         :return: dict containing question and answers
 
         """
-        # get top-answers for each candidate passage
-        answers = []
-        for doc in documents:
-            query = {"context": doc.text, "question": question}
-            predictions = self.model(query, topk=self.n_best_per_passage)
-            # for single preds (e.g. via top_k=1) transformers returns a dict instead of a list
-            if type(predictions) == dict:
-                predictions = [predictions]
-            # assemble and format all answers
-            for pred in predictions:
-                if pred["answer"]:
-                    context_start = max(0, pred["start"] - self.context_window_size)
-                    context_end = min(len(doc.text), pred["end"] + self.context_window_size)
-                    answers.append({
-                        "answer": pred["answer"],
-                        "context": doc.text[context_start:context_end],
-                        "offset_start": pred["start"],
-                        "offset_end": pred["end"],
-                        "probability": pred["score"],
-                        "score": None,
-                        "document_id": doc.id,
-                        "meta": doc.meta
-                    })
-
-        # sort answers by their `probability` and select top-k
-        answers = sorted(
-            answers, key=lambda k: k["probability"], reverse=True
-        )
-        answers = answers[:top_k]
-
-        results = {"question": question,
-                   "answers": answers}
+        return self._predict_many([(question, documents, top_k)])[0]
+
+    def predict_batch(self, questions: List[str], documents_per_question: List[List[Document]],
+                      top_k: Optional[int] = None) -> List[dict]:
+        """
+        Use loaded QA model to find answers for several questions, each in its own list of Document.
+        The passages of all questions are run through the model in shared batches.
+
+        :param questions: question strings
+        :param documents_per_question: list of Document to search in for each question
+        :param top_k: the maximum number of answers to return per question
+        :return: one dict containing question and answers per question (like `predict()`)
+        """
+        if len(questions) != len(documents_per_question):
+            raise ValueError(f"Got {len(questions)} questions, but {len(documents_per_question)} lists of documents.")
+        return self._predict_many([(question, documents, top_k)
+                                   for question, documents in zip(questions, documents_per_question)])
+
+    def _predict_many(self, calls: List[Tuple[str, List[Document], Optional[int]]]) -> List[dict]:
+        # get top-answers for each candidate passage (of all calls at once)
+        pairs = [(question, doc) for question, documents, _ in calls for doc in documents]
+        if self.result_cache is None:
+            predictions_per_doc = iter(self._read_passages(pairs))
+        else:
+            predictions_per_doc = iter(self.result_cache.predict(self.model_version, pairs, self._read_passages))
+
+        results = []
+        for question, documents, top_k in calls:
+            answers = []
+            for doc in documents:
+                predictions = next(predictions_per_doc)
+                # assemble and format all answers
+                for pred in predictions:
+                    if pred["answer"]:
+                        context_start = max(0, pred["start"] - self.context_window_size)
+                        context_end = min(len(doc.text), pred["end"] + self.context_window_size)
+                        answers.append({
+                            "answer": pred["answer"],
+                            "context": doc.text[context_start:context_end],
+                            "offset_start": pred["start"],
+                            "offset_end": pred["end"],
+                            "probability": pred["score"],
+                            "score": None,
+                            "document_id": doc.id,
+                            "meta": doc.meta
+                        })
+
+            # sort answers by their `probability` and select top-k
+            answers = sorted(
+                answers, key=lambda k: k["probability"], reverse=True
+            )
+            answers = answers[:top_k]
+
+            results.append({"question": question,
+                            "answers": answers})
 
         return results
+
+    def _read_passages(self, pairs: List[Tuple[str, Document]]) -> List[List[dict]]:
+        examples = [self.model.create_sample(question=question, context=doc.text) for question, doc in pairs]
+        context_tokens = [get_reader_tokens(doc, self.tokenizer_fingerprint) if doc.reader_tokens else None
+                          for _, doc in pairs]
+        return self.model.predict_examples(examples, context_tokens=context_tokens, topk=self.n_best_per_passage,
+                                           batch_size=self.batch_size)
+
+    @property
+    def tokenizer_fingerprint(self) -> str:
+        if self._tokenizer_fingerprint is None:
+            self._tokenizer_fingerprint = tokenizer_fingerprint(self.model.tokenizer, scheme="transformers")
+        return self._tokenizer_fingerprint
+
+    def pretokenize(self, texts: List[str]) -> List[ReaderTokens]:
+        """
+        Tokenize passages like the pipeline does (token ids and the word of each token), to be stored with the
+        documents via `update_reader_tokens()` of the document stores.
+        Passages with stored tokens are not tokenized again at query time, only the question is.
+        """
+        return [make_reader_tokens(text, **self.model.tokenize_context(text)) for text in texts]
+
+    @property
+    def model_version(self) -> str:
+        """
+        Model and all settings that change the predictions per passage (key of the result cache).
+        """
+        return f"transformers:{self.model_name}:{self.tokenizer_name}:{self.quantize}:{self.n_best_per_passage}"
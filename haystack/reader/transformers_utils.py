@@ -36,7 +36,7 @@ import numpy as np
 
 from transformers.configuration_auto import AutoConfig
 from transformers.configuration_utils import PretrainedConfig
-from transformers.data import SquadExample, squad_convert_examples_to_features
+from transformers.data import SquadExample, SquadFeatures, squad_convert_examples_to_features
 from transformers.file_utils import is_tf_available, is_torch_available
 from transformers.modelcard import ModelCard
 from transformers.tokenization_auto import AutoTokenizer
@@ -1233,6 +1233,7 @@ class QuestionAnsweringPipeline(Pipeline):
             data: sequence of SquadExample
             question: (str, List[str]), batch of question(s) to map along with context
             context: (str, List[str]), batch of context(s) associated with the provided question keyword argument
+            batch_size: int, number of features (passages / windows of passages) that go through the model at once
         Returns:
             dict: {'answer': str, 'score": float, 'start": int, "end": int}
             answer: the textual answer in the intial context
@@ -1240,6 +1241,23 @@ class QuestionAnsweringPipeline(Pipeline):
             start: the character index in the original string corresponding to the beginning of the answer' span
             end: the character index in the original string corresponding to the ending of the answer' span
         """
+        examples = self._args_parser(*args, **kwargs)
+        all_answers = [answer for answers in self.predict_examples(examples, **kwargs) for answer in answers]
+
+        if len(all_answers) == 1:
+            return all_answers[0]
+        return all_answers
+
+    def predict_examples(self, examples: List[SquadExample], context_tokens: Optional[List[Optional[dict]]] = None,
+                         **kwargs) -> List[List[dict]]:
+        """
+        Like __call__(), but for a list of SquadExample and returning the answers of each example separately.
+        The contexts of examples whose `context_tokens` (see tokenize_context()) are given aren't tokenized again.
+        The features of all examples are run through the model together in padded batches of `batch_size`.
+
+        Returns:
+            list of the answers (see __call__()) for each example
+        """
         # Set defaults values
         kwargs.setdefault("topk", 1)
         kwargs.setdefault("doc_stride", 128)
@@ -1247,6 +1265,7 @@ class QuestionAnsweringPipeline(Pipeline):
         kwargs.setdefault("max_seq_len", 384)
         kwargs.setdefault("max_question_len", 64)
         kwargs.setdefault("handle_impossible_answer", False)
+        kwargs.setdefault("batch_size", 16)
 
         if kwargs["topk"] < 1:
             raise ValueError("topk parameter should be >= 1 (got {})".format(kwargs["topk"]))
@@ -1255,7 +1274,8 @@ class QuestionAnsweringPipeline(Pipeline):
             raise ValueError("max_answer_len parameter should be >= 1 (got {})".format(kwargs["max_answer_len"]))
 
         # Convert inputs to features
-        examples = self._args_parser(*args, **kwargs)
+        if context_tokens is None or self.tokenizer.padding_side != "right":
+            context_tokens = [None] * len(examples)
         features_list = [
             squad_convert_examples_to_features(
                 examples=[example],
@@ -1266,12 +1286,173 @@ class QuestionAnsweringPipeline(Pipeline):
                 is_training=False,
                 tqdm_enabled=False,
             )
-            for example in examples
+            if tokens is None else
+            self._features_from_context_tokens(
+                example, tokens, kwargs["max_seq_len"], kwargs["doc_stride"], kwargs["max_question_len"]
+            )
+            for example, tokens in zip(examples, context_tokens)
         ]
-        all_answers = []
+        all_features = [feature for features in features_list for feature in features]
+        logits = self._forward_features(all_features, batch_size=kwargs["batch_size"])
+
+        # Logits of all features as [num_features, max_seq_len] arrays (padding cut off in _forward_features() gets
+        # a logit of 0, like all other masked positions)
+        seq_len = max([len(feature.input_ids) for feature in all_features], default=0)
+        start_ = np.zeros((len(all_features), seq_len), dtype=np.float32)
+        end_ = np.zeros((len(all_features), seq_len), dtype=np.float32)
+        p_mask = np.ones((len(all_features), seq_len), dtype=np.float32)
+        token_to_word = np.full((len(all_features), seq_len), -1, dtype=np.int64)
+        for row, (feature, (feature_start, feature_end)) in enumerate(zip(all_features, logits)):
+            start_[row, :len(feature_start)] = feature_start
+            end_[row, :len(feature_end)] = feature_end
+            p_mask[row, :len(feature.p_mask)] = feature.p_mask
+            token_to_word[row, list(feature.token_to_orig_map.keys())] = list(feature.token_to_orig_map.values())
+
+        # Mask padding and question
+        start_, end_ = start_ * (1 - p_mask), end_ * (1 - p_mask)
+
+        # Mask CLS
+        start_[:, 0] = end_[:, 0] = 0
+
+        # Normalize logits and spans to retrieve the answer
+        start_ = self._softmax(start_)
+        end_ = self._softmax(end_)
+        null_scores = start_[:, 0] * end_[:, 0]
+
+        starts, ends, scores = self.decode_batch(start_, end_, kwargs["topk"], kwargs["max_answer_len"])
+
+        answers_per_example = []
+        row = 0
         for features, example in zip(features_list, examples):
-            model_input_names = self.tokenizer.model_input_names + ["input_ids"]
-            fw_args = {k: [feature.__dict__[k] for feature in features] for k in model_input_names}
+            # first / last character of each word of the context
+            char_to_word = np.array(example.char_to_word_offset)
+            word_ids = np.arange(len(example.doc_tokens))
+            word_start_char = np.searchsorted(char_to_word, word_ids, side="left")
+            word_end_char = np.searchsorted(char_to_word, word_ids, side="right") - 1
+
+            answers = []
+            for _ in features:
+                # Convert the answer (tokens) back to the original text
+                for s, e, score in zip(starts[row], ends[row], scores[row]):
+                    if score < 0:
+                        # less than topk valid spans
+                        continue
+                    start_word, end_word = token_to_word[row, s], token_to_word[row, e]
+                    # CUSTOM ADJUSTMENT: We skip spans that can't be mapped to the context (e.g. when the model
+                    # predicts start / end to be the final [SEP] token, https://github.com/huggingface/transformers/issues/5711)
+                    if start_word < 0 or end_word < 0:
+                        logger.warning(
+                            f"Could not map predicted span ({s},{e}) back to token space. Skipping this prediction ...")
+                        continue
+                    answers.append({
+                        "score": score.item(),
+                        "start": word_start_char[start_word].item(),
+                        "end": word_end_char[end_word].item(),
+                        "answer": " ".join(example.doc_tokens[start_word: end_word + 1]),
+                    })
+                row += 1
+
+            if kwargs["handle_impossible_answer"]:
+                min_null_score = min(null_scores[row - len(features):row].min().item(), 1000000) if features \
+                    else 1000000
+                answers.append({"score": min_null_score, "start": 0, "end": 0, "answer": ""})
+
+            answers = sorted(answers, key=lambda x: x["score"], reverse=True)[: kwargs["topk"]]
+            answers_per_example.append(answers)
+
+        return answers_per_example
+
+    def tokenize_context(self, context: str) -> Dict[str, np.ndarray]:
+        """
+        Tokenize a context like squad_convert_examples_to_features() does: the ids of its tokens and the index of the
+        (whitespace separated) word of each token.
+        """
+        example = self.create_sample(question="", context=context)
+        input_ids, words = [], []  # type: List[int], List[int]
+        for word_idx, word in enumerate(example.doc_tokens):
+            word_ids = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(word))
+            input_ids += word_ids
+            words += [word_idx] * len(word_ids)
+        return {"input_ids": np.array(input_ids, dtype=np.int32), "words": np.array(words, dtype=np.int32)}
+
+    def _features_from_context_tokens(
+        self, example: SquadExample, context_tokens: dict, max_seq_len: int, doc_stride: int, max_question_len: int
+    ) -> List[SquadFeatures]:
+        """
+        The features squad_convert_examples_to_features() creates (for tokenizers that put the question first), but
+        from the tokens of the context returned by tokenize_context(), so that only the question gets tokenized.
+        """
+        tokenizer = self.tokenizer
+        question_ids = tokenizer.encode(
+            example.question_text, add_special_tokens=False, truncation=True, max_length=max_question_len
+        )
+        # position of the first context token and max. number of context tokens per window
+        context_start = len(question_ids) + tokenizer.max_len - tokenizer.max_len_single_sentence
+        if "roberta" in str(type(tokenizer)) or "camembert" in str(type(tokenizer)):
+            context_start += 1
+        max_context_len = max_seq_len - len(question_ids) - (tokenizer.max_len - tokenizer.max_len_sentences_pair)
+        context_ids = context_tokens["input_ids"].tolist()
+        words = context_tokens["words"].tolist()
+
+        features = []
+        span_start = 0
+        while span_start < len(context_ids):
+            span_len = min(len(context_ids) - span_start, max_context_len)
+            span_ids = context_ids[span_start:span_start + span_len]
+            input_ids = tokenizer.build_inputs_with_special_tokens(question_ids, span_ids)
+            token_type_ids = tokenizer.create_token_type_ids_from_sequences(question_ids, span_ids)
+            padding = max_seq_len - len(input_ids)
+            padded_ids = input_ids + [tokenizer.pad_token_id] * padding
+            cls_index = input_ids.index(tokenizer.cls_token_id)
+            # mask the question and special tokens, but not CLS (no answer), like squad_convert_examples_to_features()
+            p_mask = np.ones(max_seq_len, dtype=np.int64)
+            p_mask[context_start:] = 0
+            p_mask[np.asarray(tokenizer.get_special_tokens_mask(padded_ids, already_has_special_tokens=True)) == 1] = 1
+            p_mask[cls_index] = 0
+            features.append(
+                SquadFeatures(
+                    padded_ids,
+                    [1] * len(input_ids) + [0] * padding,
+                    token_type_ids + [tokenizer.pad_token_type_id] * padding,
+                    cls_index,
+                    p_mask.tolist(),
+                    example_index=0,
+                    unique_id=0,
+                    paragraph_len=span_len,
+                    token_is_max_context={},
+                    tokens=tokenizer.convert_ids_to_tokens(input_ids),
+                    token_to_orig_map={context_start + i: words[span_start + i] for i in range(span_len)},
+                    start_position=0,
+                    end_position=0,
+                    is_impossible=False,
+                )
+            )
+            if span_start + span_len >= len(context_ids):
+                break
+            span_start += doc_stride
+        return features
+
+    @staticmethod
+    def _softmax(logits: np.ndarray) -> np.ndarray:
+        exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    def _forward_features(self, features: List, batch_size: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Run features through the model in batches and return the start / end logits of each feature.
+        Features of similar length are batched together and (for right padding tokenizers) each batch is cut to its
+        longest feature, so the logits of a feature may be shorter than max_seq_len (only padding is cut).
+        """
+        model_input_names = self.tokenizer.model_input_names + ["input_ids"]
+        lengths = [int(np.sum(feature.attention_mask)) for feature in features]
+        order = sorted(range(len(features)), key=lambda idx: lengths[idx], reverse=True)
+        trim = self.tokenizer.padding_side == "right"
+
+        logits = [None] * len(features)  # type: List[Any]
+        for batch_start in range(0, len(features), batch_size):
+            batch = order[batch_start:batch_start + batch_size]
+            seq_len = lengths[batch[0]] if trim else len(features[batch[0]].input_ids)
+            fw_args = {k: [features[idx].__dict__[k][:seq_len] for idx in batch] for k in model_input_names}
 
             # Manage tensor allocation on correct device
             with self.device_placement():
@@ -1286,70 +1467,9 @@ class QuestionAnsweringPipeline(Pipeline):
                         start, end = self.model(**fw_args)[:2]
                         start, end = start.cpu().numpy(), end.cpu().numpy()
 
-            min_null_score = 1000000  # large and positive
-            answers = []
-            for (feature, start_, end_) in zip(features, start, end):
-                # Mask padding and question
-                start_, end_ = (
-                    start_ * np.abs(np.array(feature.p_mask) - 1),
-                    end_ * np.abs(np.array(feature.p_mask) - 1),
-                )
-
-                # Mask CLS
-                start_[0] = end_[0] = 0
-
-                # # Mask SEP Tokens
-                # sep_pos = np.where(np.array(feature.input_ids) == self.tokenizer.sep_token_id)[0]
-                # start_[sep_pos] = -10
-                # end_[sep_pos] = -10
-
-                # Normalize logits and spans to retrieve the answer
-                start_ = np.exp(start_ - np.log(np.sum(np.exp(start_), axis=-1, keepdims=True)))
-                end_ = np.exp(end_ - np.log(np.sum(np.exp(end_), axis=-1, keepdims=True)))
-
-                if kwargs["handle_impossible_answer"]:
-                    min_null_score = min(min_null_score, (start_[0] * end_[0]).item())
-
-                starts, ends, scores = self.decode(start_, end_, kwargs["topk"], kwargs["max_answer_len"])
-                char_to_word = np.array(example.char_to_word_offset)
-
-                # Convert the answer (tokens) back to the original text
-                for s, e, score in zip(starts, ends, scores):
-                    # CUSTOM ADJUSTMENT: We added this try-catch block here to not crash when model predicts
-                    # start / end to be the final [SEP] token (https://github.com/huggingface/transformers/issues/5711)
-                    try:
-                        answers += [
-                            {
-                                "score": score.item(),
-                                "start": np.where(char_to_word == feature.token_to_orig_map[s])[0][0].item(),
-                                "end": np.where(char_to_word == feature.token_to_orig_map[e])[0][-1].item(),
-                                "answer": " ".join(
-                                    example.doc_tokens[feature.token_to_orig_map[s]: feature.token_to_orig_map[e] + 1]
-                                ),
-                            }]
-                    except KeyError as e:
-                        logger.warning(
-                            f"Could not map predicted span ({s},{e}) back to token space. Skipping this prediction ...")
-                # answers += [
-                #     {
-                #         "score": score.item(),
-                #         "start": np.where(char_to_word == feature.token_to_orig_map[s])[0][0].item(),
-                #         "end": np.where(char_to_word == feature.token_to_orig_map[e])[0][-1].item(),
-                #         "answer": " ".join(
-                #             example.doc_tokens[feature.token_to_orig_map[s]: feature.token_to_orig_map[e] + 1]
-                #         ),
-                #     }
-                #     for s, e, score in zip(starts, ends, scores)
-                # ]
-            if kwargs["handle_impossible_answer"]:
-                answers.append({"score": min_null_score, "start": 0, "end": 0, "answer": ""})
-
-            answers = sorted(answers, key=lambda x: x["score"], reverse=True)[: kwargs["topk"]]
-            all_answers += answers
-
-        if len(all_answers) == 1:
-            return all_answers[0]
-        return all_answers
+            for row, idx in enumerate(batch):
+                logits[idx] = (start[row], end[row])
+        return logits
 
     def decode(self, start: np.ndarray, end: np.ndarray, topk: int, max_answer_len: int) -> Tuple:
         """
@@ -1365,31 +1485,45 @@ class QuestionAnsweringPipeline(Pipeline):
             topk: int, indicates how many possible answer span(s) to extract from the model's output
             max_answer_len: int, maximum size of the answer to extract from the model's output
         """
-        # Ensure we have batch axis
-        if start.ndim == 1:
-            start = start[None]
+        starts, ends, scores = self.decode_batch(np.atleast_2d(start), np.atleast_2d(end), topk, max_answer_len)
+        valid = scores[0] >= 0
+        return starts[0][valid], ends[0][valid], scores[0][valid]
 
-        if end.ndim == 1:
-            end = end[None]
+    @staticmethod
+    def decode_batch(start: np.ndarray, end: np.ndarray, topk: int, max_answer_len: int) -> Tuple:
+        """
+        Top-k answer spans for a batch of features. Only the band of spans with start <= end < start + max_answer_len
+        is scored (as [batch, seq_len, max_answer_len] array instead of seq_len x seq_len per feature).
 
-        # Compute the score of each tuple(start, end) to be the real answer
-        outer = np.matmul(np.expand_dims(start, -1), np.expand_dims(end, 1))
+        Args:
+            start: numpy array [batch, seq_len], start probabilities of each token
+            end: numpy array [batch, seq_len], end probabilities of each token
+            topk: int, number of spans to extract per feature
+            max_answer_len: int, maximum number of tokens of an answer
 
-        # Remove candidate with end < start and end - start > max_answer_len
-        candidates = np.tril(np.triu(outer), max_answer_len - 1)
+        Returns:
+            starts, ends, scores: numpy arrays [batch, topk] sorted by descending score. Features with less than
+            topk valid spans are filled up with a score of -1.
+        """
+        batch_size, seq_len = start.shape
+        width = min(max_answer_len, seq_len)
+        # scores[b, i, k] = start[b, i] * end[b, i + k], -1 where i + k is beyond the sequence
+        scores = np.full((batch_size, seq_len, width), -1.0, dtype=np.result_type(start, end))
+        for k in range(width):
+            scores[:, :seq_len - k, k] = start[:, :seq_len - k] * end[:, k:]
 
         #  Inspired by Chen & al. (https://github.com/facebookresearch/DrQA)
-        scores_flat = candidates.flatten()
+        scores_flat = scores.reshape(batch_size, -1)
+        topk = min(topk, scores_flat.shape[1])
         if topk == 1:
-            idx_sort = [np.argmax(scores_flat)]
-        elif len(scores_flat) < topk:
-            idx_sort = np.argsort(-scores_flat)
+            idx_sort = np.argmax(scores_flat, axis=1)[:, None]
         else:
-            idx = np.argpartition(-scores_flat, topk)[0:topk]
-            idx_sort = idx[np.argsort(-scores_flat[idx])]
+            idx = np.argpartition(-scores_flat, topk - 1, axis=1)[:, :topk]
+            order = np.argsort(-np.take_along_axis(scores_flat, idx, axis=1), axis=1, kind="stable")
+            idx_sort = np.take_along_axis(idx, order, axis=1)
 
-        start, end = np.unravel_index(idx_sort, candidates.shape)[1:]
-        return start, end, candidates[0, start, end]
+        starts, offsets = np.unravel_index(idx_sort, (seq_len, width))
+        return starts, starts + offsets, np.take_along_axis(scores_flat, idx_sort, axis=1)
 
     def span_to_answer(self, text: str, start: int, end: int):
         """
@@ -0,0 +1,198 @@
+# Export and runtime of transformer encoders (DPR's HFBertEncoder, the language model of EmbeddingRetriever)
+# for inference backends other than eager PyTorch, i.e. TorchScript and ONNX Runtime.
+
+import logging
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "torchscript", "onnx")
+BACKEND_FILE_SUFFIX = {"torchscript": ".pt", "onnx": ".onnx"}
+ENCODER_INPUT_NAMES = ["input_ids", "token_type_ids", "attention_mask"]
+
+
+def check_backend(backend: str):
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend '{backend}' is not supported. Choose one of {BACKENDS}.")
+    if backend == "onnx":
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            raise ImportError("The 'onnx' backend requires onnxruntime. Please install it via `pip install onnxruntime`.")
+
+
+class _EncoderOutputs(torch.nn.Module):
+    """
+    Wraps an encoder for tracing / export, so that it takes positional tensors and returns a tuple of tensors only
+    (e.g. HFBertEncoder returns `None` for the hidden states, which can't be traced).
+    """
+
+    def __init__(self, encoder: torch.nn.Module, output_indices: Tuple[int, ...]):
+        super().__init__()
+        self.encoder = encoder
+        self.output_indices = output_indices
+
+    def forward(self, input_ids, token_type_ids, attention_mask):
+        outputs = self.encoder(input_ids=input_ids, token_type_ids=token_type_ids, attention_mask=attention_mask)
+        return tuple(outputs[i] for i in self.output_indices)
+
+
+def export_encoder(encoder: torch.nn.Module,
+                   output_file: Path,
+                   backend: str,
+                   output_axes: Dict[str, Dict[int, str]],
+                   output_indices: Tuple[int, ...],
+                   opset_version: int = 11,
+                   optimize_for_cpu: bool = True) -> Path:
+    """
+    Export an encoder, that is called as `encoder(input_ids=..., token_type_ids=..., attention_mask=...)`,
+    to TorchScript or ONNX.
+    Batch size and sequence length stay dynamic in the exported graph.
+
+    :param encoder: the (eager PyTorch) encoder to export
+    :param output_file: path of the exported model without suffix (".pt" or ".onnx" gets added)
+    :param backend: "torchscript" or "onnx"
+    :param output_axes: names of the exported outputs with their dynamic axes,
+                        e.g. {"pooled_output": {0: "batch_size"}}
+    :param output_indices: positions of the exported outputs in the tuple returned by the encoder
+    :param opset_version: ONNX opset version
+    :param optimize_for_cpu: apply the graph optimizations of ONNX Runtime for CPU and store the optimized graph
+    :return: path of the exported model
+    """
+    if backend not in BACKEND_FILE_SUFFIX:
+        raise ValueError(f"Can only export to {list(BACKEND_FILE_SUFFIX)}, not to '{backend}'.")
+
+    output_file = Path(output_file).with_suffix(BACKEND_FILE_SUFFIX[backend])
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+
+    module = _EncoderOutputs(encoder, output_indices).to("cpu").eval()
+    dummy_input_ids = torch.ones((2, 16), dtype=torch.long)
+    dummy_inputs = (dummy_input_ids, torch.zeros_like(dummy_input_ids), torch.ones_like(dummy_input_ids))
+
+    with torch.no_grad():
+        if backend == "torchscript":
+            traced = torch.jit.trace(module, dummy_inputs, check_trace=False)
+            torch.jit.save(traced, str(output_file))
+        else:
+            dynamic_axes = {name: {0: "batch_size", 1: "max_seq_len"} for name in ENCODER_INPUT_NAMES}
+            dynamic_axes.update(output_axes)
+            torch.onnx.export(module, dummy_inputs, str(output_file),
+                              input_names=ENCODER_INPUT_NAMES,
+                              output_names=list(output_axes),
+                              dynamic_axes=dynamic_axes,
+                              opset_version=opset_version,
+                              do_constant_folding=True)
+            if optimize_for_cpu:
+                import onnxruntime
+
+                # let ONNX Runtime fuse the graph once at export time and store the result instead of the raw graph
+                sess_options = onnxruntime.SessionOptions()
+                sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                sess_options.optimized_model_filepath = str(output_file)
+                onnxruntime.InferenceSession(str(output_file), sess_options, providers=["CPUExecutionProvider"])
+
+    logger.info(f"Exported encoder to {output_file}")
+    return output_file
+
+
+class ExportedEncoder(torch.nn.Module):
+    """
+    Runs an encoder exported with `export_encoder()` and behaves like the original PyTorch module, i.e. it is called
+    with (input_ids, token_type_ids, attention_mask) tensors and returns a tuple of tensors on the input device.
+    """
+
+    def __init__(self, model_file: Union[str, Path], backend: str, device: Union[str, torch.device] = "cpu",
+                 num_threads: int = None):
+        """
+        :param model_file: path of the exported model (with suffix)
+        :param backend: "torchscript" or "onnx"
+        :param device: device to run the model on
+        :param num_threads: number of threads used by ONNX Runtime per inference call (default: all cores)
+        """
+        super().__init__()
+        check_backend(backend)
+        self.model_file = Path(model_file)
+        self.backend = backend
+        self.device = torch.device(device)
+        # some callers (e.g. FARM's language models) check the config of the wrapped transformer
+        self.encoder = SimpleNamespace(output_hidden_states=False)
+
+        if backend == "torchscript":
+            model = torch.jit.load(str(model_file), map_location=self.device).eval()
+            if self.device.type == "cpu":
+                model = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+            self.model = model
+        elif backend == "onnx":
+            import onnxruntime
+
+            sess_options = onnxruntime.SessionOptions()
+            sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if num_threads:
+                sess_options.intra_op_num_threads = num_threads
+            providers = ["CUDAExecutionProvider", "CPUExecutionProvider"] if self.device.type == "cuda" \
+                else ["CPUExecutionProvider"]
+            self.session = onnxruntime.InferenceSession(str(model_file), sess_options, providers=providers)
+            # graph optimizations may remove inputs that don't influence the outputs
+            self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        else:
+            raise ValueError(f"ExportedEncoder can't run backend '{backend}'.")
+
+    @property
+    def size_bytes(self) -> int:
+        """
+        Size of the exported model file(s), incl. external weight files next to an ONNX graph (e.g. "<file>.data").
+        """
+        files = [self.model_file] + [path for path in self.model_file.parent.glob(f"{self.model_file.name}.*")]
+        return sum(path.stat().st_size for path in files if path.is_file())
+
+    def forward(self, input_ids, token_type_ids=None, attention_mask=None):
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+
+        if self.backend == "torchscript":
+            with torch.no_grad():
+                return tuple(self.model(input_ids, token_type_ids, attention_mask))
+
+        inputs = {"input_ids": input_ids, "token_type_ids": token_type_ids, "attention_mask": attention_mask}
+        ort_inputs = {name: inputs[name].cpu().numpy().astype(np.int64) for name in self.input_names}
+        outputs = self.session.run(None, ort_inputs)
+        return tuple(torch.from_numpy(output).to(input_ids.device) for output in outputs)
+
+
+def benchmark_query_latency(retrievers: Dict[str, object], queries: List[str], warmup: int = 3) -> Dict[str, dict]:
+    """
+    Compare the per-query latency of query encoding for retrievers with different backends, e.g.:
+
+        >>> benchmark_query_latency({"torch": DensePassageRetriever(..., backend="torch"),
+        ...                          "onnx": DensePassageRetriever(..., backend="onnx")}, queries)
+
+    :param retrievers: retrievers to compare by name. Each one needs an `embed_queries()` method.
+    :param queries: queries that get embedded one at a time (like in a search request)
+    :param warmup: number of queries to embed before measuring (model loading, graph compilation)
+    :return: latency stats in milliseconds per retriever name ("mean", "p50", "p95", "p99")
+    """
+    results = {}
+    for name, retriever in retrievers.items():
+        for query in queries[:warmup]:
+            retriever.embed_queries([query])  # type: ignore
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            retriever.embed_queries([query])  # type: ignore
+            latencies.append((time.perf_counter() - start) * 1000)
+        results[name] = {
+            "mean": float(np.mean(latencies)),
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+        }
+        logger.info(f"Query latency of {name}: {results[name]}")
+    return results
@@ -1,5 +1,7 @@
+import json
 import logging
-from typing import Type, List, Union, Tuple
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
 import torch
 import numpy as np
 from pathlib import Path
@@ -8,14 +10,34 @@ from farm.infer import Inferencer
 
 from haystack.database.base import Document, BaseDocumentStore
 from haystack.database.elasticsearch import ElasticsearchDocumentStore
+from haystack.retriever.backends import BACKEND_FILE_SUFFIX, ExportedEncoder, check_backend, export_encoder
 from haystack.retriever.base import BaseRetriever
 from haystack.retriever.sparse import logger
 
-from haystack.retriever.dpr_utils import HFBertEncoder, BertTensorizer, BertTokenizer,\
-    Tensorizer, load_states_from_checkpoint, download_dpr
+from haystack.utils import get_model_sha256, quantize_model
+from haystack.retriever.dpr_utils import BertTokenizer, BertTokenizerFast
+from haystack.retriever.embedding_cache import EmbeddingCache
+from haystack.retriever.model_cache import CachedDPRModel, DPRModelCache
 
 logger = logging.getLogger(__name__)
 
+# Process-wide registry of loaded DPR models, so that all DensePassageRetrievers using the same checkpoint
+# (e.g. the ones of the different REST API controllers) share one instance of each encoder and tokenizer.
+_DPR_ENCODERS = {}  # type: Dict[Tuple[str, str, str, Optional[str], str, Optional[str]], torch.nn.Module]
+_DPR_CACHED_MODELS = {}  # type: Dict[Tuple[str, str], CachedDPRModel]
+_DPR_TOKENIZERS = {}  # type: Dict[Tuple[str, bool, bool], Any]
+_DPR_REGISTRY_LOCK = threading.RLock()
+
+# file names of the encoders in a directory created by DensePassageRetriever.export_encoders()
+DPR_EXPORT_FILES = {"question_model.": "query_encoder", "ctx_model.": "passage_encoder"}
+DPR_EXPORT_PARAMS_FILE = "encoder_params.json"
+DPR_EXPORT_TOKENIZER_DIR = "tokenizer"
+# file names in a directory created by EmbeddingRetriever.export_encoder() (next to the saved FARM model)
+EMBEDDING_EXPORT_FILE = "encoder"
+EMBEDDING_EXPORT_CONFIG_FILE = "export_config.json"
+# pooling strategies of EmbeddingRetriever that are computed without FARM's Inferencer
+EMBEDDING_FAST_PATH_STRATEGIES = ("cls_token", "reduce_mean", "reduce_max")
+
 
 class DensePassageRetriever(BaseRetriever):
     """
@@ -32,23 +54,39 @@ class DensePassageRetriever(BaseRetriever):
                  batch_size: int = 16,
                  do_lower_case: bool = False,
                  use_amp: str = None,
+                 use_fast_tokenizer: bool = True,
+                 backend: str = "torch",
+                 quantize: Optional[str] = None,
+                 model_cache_dir: Optional[str] = None,
+                 offline: bool = False,
+                 embedding_cache: Optional[Union[str, EmbeddingCache]] = None,
                  ):
         """
         Init the Retriever incl. the two encoder models from a local or remote model checkpoint.
         The checkpoint format matches the one of the original author's in the repository (https://github.com/facebookresearch/DPR)
         See their readme for manual download instructions: https://github.com/facebookresearch/DPR#resources--data-formats
 
+        The encoders are loaded lazily on first use, i.e. a process that only calls embed_queries() (search)
+        never loads the passage encoder and vice versa (indexing). Loaded encoders are shared between all
+        DensePassageRetrievers of a process that use the same checkpoint, device and amp setting.
+
+        Checkpoints are converted once into a local model cache (see haystack.retriever.model_cache), from which the
+        weights of each encoder are memory-mapped. Once a model is in the cache, startup needs no network access.
+
         :Example:
 
             # remote model from FAIR
             >>> DensePassageRetriever(document_store=your_doc_store, embedding_model="dpr-bert-base-nq", use_gpu=True)
             # or from local path
             >>> DensePassageRetriever(document_store=your_doc_store, embedding_model="some_path/ber-base-encoder.cp", use_gpu=True)
+            # or exported encoders (see export_encoders()) running in ONNX Runtime
+            >>> DensePassageRetriever(document_store=your_doc_store, embedding_model="dpr-export", backend="onnx")
 
         :param document_store: An instance of DocumentStore from which to retrieve documents.
         :param embedding_model: Local path or remote name of model checkpoint. The format equals the 
                                 one used by original author's in https://github.com/facebookresearch/DPR. 
-                                Currently available remote names: "dpr-bert-base-nq" 
+                                Currently available remote names: "dpr-bert-base-nq", "dpr-bert-base-multiset".
+                                Can also be the directory of a converted model in a model cache.
         :param use_gpu: Whether to use gpu or not
         :param batch_size: Number of questions or passages to encode at once
         :param do_lower_case: Whether to lower case the text input in the tokenizer
@@ -59,17 +97,34 @@ class DensePassageRetriever(BaseRetriever):
                               - None -> Not using amp at all
                               - 'O0' -> Regular FP32
                               - 'O1' -> Mixed Precision (recommended, if optimization wanted)
+        :param use_fast_tokenizer: Whether to use the fast (Rust) tokenizer of the transformers library, which
+                                   tokenizes a whole batch of texts at once.
+        :param backend: Inference backend of the encoders. Options: "torch" (eager PyTorch), "torchscript", "onnx"
+                        (ONNX Runtime). The latter two require `embedding_model` to be a directory created by
+                        export_encoders() with the same backend.
+        :param quantize: Quantize the encoders for faster inference on CPU (backend "torch" only).
+                         Options: None (default), "dynamic_int8" (weights of linear layers in int8)
+        :param model_cache_dir: Directory of the model cache
+                                (default: env var HAYSTACK_MODEL_CACHE or ~/.cache/haystack/dpr)
+        :param offline: Only load models that are in the model cache already, never download / convert them
+        :param embedding_cache: EmbeddingCache (or path of its SQLite file) to look up passage embeddings in before
+                                encoding them (see haystack.retriever.embedding_cache)
         """
+        check_backend(backend)
+        if quantize and backend != "torch":
+            raise ValueError(f"Quantization is only available for backend 'torch', not for '{backend}'.")
 
         self.document_store = document_store
         self.embedding_model = embedding_model
         self.batch_size = batch_size
-
-        #TODO Proper Download + Caching of model if not locally available
-        if embedding_model == "dpr-bert-base-nq":
-            if not Path("models/dpr/checkpoint/retriever/single/nq/bert-base-encoder.cp").is_file():
-                download_dpr(resource_key="checkpoint.retriever.single.nq.bert-base-encoder", out_dir="models/dpr")
-            self.embedding_model = "models/dpr/checkpoint/retriever/single/nq/bert-base-encoder.cp"
+        self.backend = backend
+        self.quantize = quantize
+        # sha256 of the checkpoint (from the model cache, or stored by export_encoders()), see model_fingerprint
+        self._checkpoint_sha256 = None  # type: Optional[str]
+        self.model_cache_dir = model_cache_dir
+        self.offline = offline
+        self.embedding_cache = EmbeddingCache(embedding_cache) if isinstance(embedding_cache, (str, Path)) \
+            else embedding_cache
 
         if use_gpu and torch.cuda.is_available():
             self.device = torch.device("cuda")
@@ -78,31 +133,145 @@ class DensePassageRetriever(BaseRetriever):
 
         self.use_amp = use_amp
         self.do_lower_case = do_lower_case
-
-        # Load checkpoint (incl. additional model params)
-        saved_state = load_states_from_checkpoint(self.embedding_model)
-        logger.info('Loaded encoder params:  %s', saved_state.encoder_params)
-        self.do_lower_case = saved_state.encoder_params["do_lower_case"]
-        self.pretrained_model_cfg = saved_state.encoder_params["pretrained_model_cfg"]
-        self.encoder_model_type = saved_state.encoder_params["encoder_model_type"]
-        self.pretrained_file = saved_state.encoder_params["pretrained_file"]
-        self.projection_dim = saved_state.encoder_params["projection_dim"]
-        self.sequence_length = saved_state.encoder_params["sequence_length"]
-
-        # Init & Load Encoders
-        self.query_encoder = HFBertEncoder.init_encoder(self.pretrained_model_cfg,
-                                                        projection_dim=self.projection_dim,
-                                                        dropout=0.0)
-        self.passage_encoder = HFBertEncoder.init_encoder(self.pretrained_model_cfg,
-                                                          projection_dim=self.projection_dim,
-                                                          dropout=0.0)
-        self.passage_encoder = self._prepare_model(self.passage_encoder, saved_state, prefix="ctx_model.")
-        self.query_encoder = self._prepare_model(self.query_encoder, saved_state, prefix="question_model.")
-        #self.encoder = BiEncoder(question_encoder, ctx_encoder, fix_ctx_encoder=self.fix_ctx_encoder)
-
-        # Load Tokenizer & Tensorizer
-        tokenizer = BertTokenizer.from_pretrained(self.pretrained_model_cfg, do_lower_case=self.do_lower_case)
-        self.tensorizer = BertTensorizer(tokenizer, self.sequence_length)
+        self.use_fast_tokenizer = use_fast_tokenizer
+
+        # Params of the checkpoint, set once the checkpoint or one of its encoders gets loaded
+        self.pretrained_model_cfg = None  # type: Optional[str]
+        self.encoder_model_type = None  # type: Optional[str]
+        self.pretrained_file = None  # type: Optional[str]
+        self.projection_dim = None  # type: Optional[int]
+        self.sequence_length = None  # type: Optional[int]
+        self._tokenizer_path = None  # type: Optional[str]
+
+        if self.backend != "torch":
+            params_file = Path(self.embedding_model) / DPR_EXPORT_PARAMS_FILE
+            if not params_file.is_file():
+                raise ValueError(f"Backend '{backend}' needs encoders exported via "
+                                 f"DensePassageRetriever.export_encoders(), but there is no {params_file}.")
+            encoder_params = json.loads(params_file.read_text())
+            # exported encoders produce the same embeddings as the checkpoint they were exported from
+            # (exports of older versions only contain the name of the checkpoint)
+            source_model = encoder_params.pop("source_model")
+            self._checkpoint_sha256 = encoder_params.pop("checkpoint_sha256", None) or source_model
+            tokenizer_dir = Path(self.embedding_model) / DPR_EXPORT_TOKENIZER_DIR
+            tokenizer_path = str(tokenizer_dir) if tokenizer_dir.is_dir() else encoder_params["pretrained_model_cfg"]
+            self._set_encoder_params(encoder_params, tokenizer_path=tokenizer_path)
+
+    @classmethod
+    def export_encoders(cls,
+                        embedding_model: str,
+                        output_dir: Union[str, Path] = "dpr-export",
+                        backend: str = "onnx",
+                        opset_version: int = 11,
+                        optimize_for_cpu: bool = True) -> Path:
+        """
+        Export the query and passage encoder of a DPR checkpoint to TorchScript or ONNX. The output directory can
+        then be loaded as `embedding_model` of a DensePassageRetriever with the same `backend`.
+
+        Usage:
+            >>> DensePassageRetriever.export_encoders(embedding_model="dpr-bert-base-nq", output_dir="dpr-export")
+            >>> DensePassageRetriever(document_store=document_store, embedding_model="dpr-export", backend="onnx")
+
+        :param embedding_model: Local path or remote name of the model checkpoint (see __init__)
+        :param output_dir: Directory to write the exported encoders and their params to
+        :param backend: "torchscript" or "onnx"
+        :param opset_version: ONNX opset version
+        :param optimize_for_cpu: Store the ONNX graph after applying ONNX Runtime's graph optimizations for CPU
+        :return: path of the output directory
+        """
+        output_dir = Path(output_dir)
+        retriever = cls(document_store=None, embedding_model=embedding_model, use_gpu=False)  # type: ignore
+        for prefix, file_name in DPR_EXPORT_FILES.items():
+            export_encoder(retriever._get_encoder(prefix), output_dir / file_name, backend=backend,
+                           output_axes={"pooled_output": {0: "batch_size"}}, output_indices=(1,),
+                           opset_version=opset_version, optimize_for_cpu=optimize_for_cpu)
+
+        encoder_params = dict(retriever._get_cached_model().encoder_params)
+        encoder_params["source_model"] = embedding_model
+        encoder_params["checkpoint_sha256"] = retriever._get_cached_model().manifest["checkpoint_sha256"]
+        (output_dir / DPR_EXPORT_PARAMS_FILE).write_text(json.dumps(encoder_params, default=str))
+        retriever.tokenizer.save_pretrained(str(output_dir / DPR_EXPORT_TOKENIZER_DIR))
+        return output_dir
+
+    def __getstate__(self):
+        # the retriever gets pickled to the processes of a PassageEmbeddingPool, which don't need the document store
+        state = self.__dict__.copy()
+        state["document_store"] = None
+        return state
+
+    @property
+    def model_fingerprint(self) -> str:
+        """
+        Identifies the model that produced an embedding (e.g. stored next to embeddings in the SQLDocumentStore):
+        the sha256 of the checkpoint and the quantization of the encoders.
+        """
+        if self._checkpoint_sha256 is None:
+            self._checkpoint_sha256 = self._get_cached_model().manifest["checkpoint_sha256"]
+        return f"dpr:{self._checkpoint_sha256}:{self.quantize}"
+
+    @property
+    def query_encoder(self) -> torch.nn.Module:
+        return self._get_encoder(prefix="question_model.")
+
+    @property
+    def passage_encoder(self) -> torch.nn.Module:
+        return self._get_encoder(prefix="ctx_model.")
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer_path is None:
+            self._get_cached_model()
+        key = (self._tokenizer_path, self.do_lower_case, self.use_fast_tokenizer)
+        with _DPR_REGISTRY_LOCK:
+            if key not in _DPR_TOKENIZERS:
+                tokenizer_class = BertTokenizerFast if self.use_fast_tokenizer else BertTokenizer
+                _DPR_TOKENIZERS[key] = tokenizer_class.from_pretrained(self._tokenizer_path,
+                                                                       do_lower_case=self.do_lower_case)
+            return _DPR_TOKENIZERS[key]
+
+    def _get_encoder(self, prefix: str) -> torch.nn.Module:
+        """
+        Get the encoder for the given prefix ("question_model." or "ctx_model.") of the checkpoint from the
+        process-wide registry and load it from the model cache, if it's not there yet.
+        """
+        with _DPR_REGISTRY_LOCK:
+            if self.backend != "torch":
+                model_key = str(Path(self.embedding_model).resolve())
+            else:
+                model_key = str(self._get_cached_model().entry_dir)
+            key = (model_key, prefix, str(self.device), self.use_amp, self.backend, self.quantize)
+            if key not in _DPR_ENCODERS and self.backend != "torch":
+                model_file = Path(self.embedding_model) / (DPR_EXPORT_FILES[prefix] + BACKEND_FILE_SUFFIX[self.backend])
+                _DPR_ENCODERS[key] = ExportedEncoder(model_file, backend=self.backend, device=self.device)
+            elif key not in _DPR_ENCODERS:
+                logger.info(f"Loading {prefix.rstrip('.')} from the model cache ...")
+                encoder = self._prepare_model(self._get_cached_model().load_encoder(prefix))
+                _DPR_ENCODERS[key] = quantize_model(encoder, self.quantize)
+            return _DPR_ENCODERS[key]
+
+    def _get_cached_model(self) -> CachedDPRModel:
+        """
+        Get the converted checkpoint from the model cache (downloading / converting it first, if needed).
+        """
+        key = (str(self.model_cache_dir), self.embedding_model)
+        with _DPR_REGISTRY_LOCK:
+            if key not in _DPR_CACHED_MODELS:
+                model_cache = DPRModelCache(cache_dir=self.model_cache_dir, offline=self.offline)
+                _DPR_CACHED_MODELS[key] = model_cache.load(self.embedding_model)
+            cached_model = _DPR_CACHED_MODELS[key]
+        if self.sequence_length is None:
+            self._set_encoder_params(cached_model.encoder_params, tokenizer_path=str(cached_model.tokenizer_dir))
+        return cached_model
+
+    def _set_encoder_params(self, encoder_params: dict, tokenizer_path: str):
+        logger.info('Loaded encoder params:  %s', encoder_params)
+        self.do_lower_case = encoder_params["do_lower_case"]
+        self.pretrained_model_cfg = encoder_params["pretrained_model_cfg"]
+        self.encoder_model_type = encoder_params["encoder_model_type"]
+        self.pretrained_file = encoder_params["pretrained_file"]
+        self.projection_dim = encoder_params["projection_dim"]
+        self.sequence_length = encoder_params["sequence_length"]
+        self._tokenizer_path = tokenizer_path
 
     def retrieve(self, query: str, filters: dict = None, top_k: int = 10, index: str = None) -> List[Document]:
         if index is None:
@@ -118,8 +287,7 @@ class DensePassageRetriever(BaseRetriever):
         :param texts: queries to embed
         :return: embeddings, one per input queries
         """
-        result = self._generate_batch_predictions(texts=texts, model=self.query_encoder,
-                                                  tensorizer=self.tensorizer, batch_size=self.batch_size)
+        result = self._generate_batch_predictions(texts=texts, model=self.query_encoder, batch_size=self.batch_size)
         return result
 
     def embed_passages(self, texts: List[str]) -> List[np.array]:
@@ -129,43 +297,61 @@ class DensePassageRetriever(BaseRetriever):
         :param texts: passage to embed
         :return: embeddings, one per input passage
         """
-        result = self._generate_batch_predictions(texts=texts, model=self.passage_encoder,
-                                                  tensorizer=self.tensorizer, batch_size=self.batch_size)
+        if self.embedding_cache is not None:
+            return self.embedding_cache.embed(self.model_fingerprint, texts, self._embed_passages)
+        return self._embed_passages(texts)
+
+    def _embed_passages(self, texts: List[str]) -> List[np.array]:
+        result = self._generate_batch_predictions(texts=texts, model=self.passage_encoder, batch_size=self.batch_size)
         return result
 
     def _generate_batch_predictions(self,
                                     texts: List[str],
                                     model: torch.nn.Module,
-                                    tensorizer: Tensorizer,
-                                    batch_size: int = 16) -> List[Tuple[object, np.array]]:
+                                    batch_size: int = 16) -> List[np.array]:
         n = len(texts)
-        total = 0
-        results = []
-        for j, batch_start in enumerate(range(0, n, batch_size)):
+        # tokenize all texts in one call (done in parallel by fast tokenizers) without padding
+        token_ids = self.tokenizer([text.strip() for text in texts], add_special_tokens=True, truncation=True,
+                                   max_length=self.sequence_length, padding=False)["input_ids"]
 
-            batch_token_tensors = [tensorizer.text_to_tensor(ctx) for ctx in
-                                   texts[batch_start:batch_start + batch_size]]
+        # Encode texts of similar length together (longest first), so that each batch is only padded to the
+        # length of its own longest text instead of the full sequence_length. Results are put back in input order.
+        order = sorted(range(n), key=lambda idx: len(token_ids[idx]), reverse=True)
+        pad_id = self.tokenizer.pad_token_id
 
-            ctx_ids_batch = torch.stack(batch_token_tensors, dim=0).to(self.device)
-            ctx_seg_batch = torch.zeros_like(ctx_ids_batch).to(self.device)
-            ctx_attn_mask = tensorizer.get_attn_mask(ctx_ids_batch).to(self.device)
+        total = 0
+        results = [None] * n  # type: List[Any]
+        for batch_start in range(0, n, batch_size):
+            batch_indices = order[batch_start:batch_start + batch_size]
+            max_len = len(token_ids[batch_indices[0]])
+
+            ctx_ids_batch = torch.full((len(batch_indices), max_len), pad_id, dtype=torch.long)
+            ctx_attn_mask = torch.zeros((len(batch_indices), max_len), dtype=torch.long)
+            for row, idx in enumerate(batch_indices):
+                seq_len = len(token_ids[idx])
+                ctx_ids_batch[row, :seq_len] = torch.tensor(token_ids[idx], dtype=torch.long)
+                ctx_attn_mask[row, :seq_len] = 1
+
+            ctx_ids_batch = ctx_ids_batch.to(self.device)
+            ctx_seg_batch = torch.zeros_like(ctx_ids_batch)
+            ctx_attn_mask = ctx_attn_mask.to(self.device)
             with torch.no_grad():
-                _, out, _ = model(ctx_ids_batch, ctx_seg_batch, ctx_attn_mask)
+                outputs = model(ctx_ids_batch, ctx_seg_batch, ctx_attn_mask)
+            # HFBertEncoder returns (sequence_output, pooled_output, hidden_states), while exported encoders only
+            # return the pooled output (see export_encoders())
+            out = outputs[0] if isinstance(model, ExportedEncoder) else outputs[1]
             out = out.cpu()
 
-            total += len(batch_token_tensors)
-
-            results.extend([
-                (out[i].view(-1).numpy())
-                for i in range(out.size(0))
-            ])
+            for row, idx in enumerate(batch_indices):
+                results[idx] = out[row].view(-1).numpy()
 
+            total += len(batch_indices)
             if total % 10 == 0:
                 logger.info(f'Embedded {total} / {n} texts')
 
         return results
 
-    def _prepare_model(self, encoder, saved_state, prefix):
+    def _prepare_model(self, encoder):
         encoder.to(self.device)
         if self.use_amp:
             try:
@@ -178,16 +364,6 @@ class DensePassageRetriever(BaseRetriever):
             encoder, _ = amp.initialize(encoder, None, opt_level=self.use_amp)
 
         encoder.eval()
-
-        # load weights from the model file
-        model_to_load = encoder.module if hasattr(encoder, 'module') else encoder
-        logger.info('Loading saved model state ...')
-        logger.debug('saved model keys =%s', saved_state.model_dict.keys())
-
-        prefix_len = len(prefix)
-        ctx_state = {key[prefix_len:]: value for (key, value) in saved_state.model_dict.items() if
-                     key.startswith(prefix)}
-        model_to_load.load_state_dict(ctx_state)
         return encoder
 
 
@@ -200,6 +376,11 @@ class EmbeddingRetriever(BaseRetriever):
         model_format: str = "farm",
         pooling_strategy: str = "reduce_mean",
         emb_extraction_layer: int = -1,
+        backend: str = "torch",
+        quantize: Optional[str] = None,
+        batch_size: int = 32,
+        max_seq_len: int = 512,
+        embedding_cache: Optional[Union[str, EmbeddingCache]] = None,
     ):
         """
         :param document_store: An instance of DocumentStore from which to retrieve documents.
@@ -211,19 +392,67 @@ class EmbeddingRetriever(BaseRetriever):
                                  reduce_max (sentence vector), 'per_token' (individual token vectors)
         :param emb_extraction_layer: Number of layer from which the embeddings shall be extracted (for farm / transformers models only).
                                      Default: -1 (very last layer).
+        :param backend: Inference backend of the language model (for farm / transformers models only).
+                        Options: "torch" (eager PyTorch), "torchscript", "onnx" (ONNX Runtime). The latter two require
+                        `embedding_model` to be a directory created by export_encoder() with the same backend.
+        :param quantize: Quantize the model for faster inference on CPU (backend "torch" only).
+                         Options: None (default), "dynamic_int8" (weights of linear layers in int8)
+        :param batch_size: Number of texts to embed at once
+        :param max_seq_len: Max number of tokens of a text, longer texts get truncated
+        :param embedding_cache: EmbeddingCache (or path of its SQLite file) to look up passage embeddings in before
+                                encoding them (see haystack.retriever.embedding_cache)
         """
+        check_backend(backend)
+        if quantize and backend != "torch":
+            raise ValueError(f"Quantization is only available for backend 'torch', not for '{backend}'.")
+        if backend != "torch":
+            if model_format not in ("farm", "transformers"):
+                raise ValueError(f"Backend '{backend}' is only available for model_format 'farm' or 'transformers'.")
+            if emb_extraction_layer != -1:
+                raise ValueError(f"Backend '{backend}' only supports emb_extraction_layer=-1, as exported models "
+                                 f"don't output the hidden states of the other layers.")
+
         self.document_store = document_store
         self.model_format = model_format
         self.embedding_model = embedding_model
         self.pooling_strategy = pooling_strategy
         self.emb_extraction_layer = emb_extraction_layer
+        self.backend = backend
+        self.quantize = quantize
+        self.batch_size = batch_size
+        self.max_seq_len = max_seq_len
+        self.embedding_cache = EmbeddingCache(embedding_cache) if isinstance(embedding_cache, (str, Path)) \
+            else embedding_cache
+
+        # sha256 of the weights of the model (before quantization), part of model_fingerprint
+        self.model_sha256 = None  # type: Optional[str]
+        if backend != "torch":
+            config_file = Path(embedding_model) / EMBEDDING_EXPORT_CONFIG_FILE
+            if not config_file.is_file():
+                raise ValueError(f"Backend '{backend}' needs a model exported via EmbeddingRetriever.export_encoder(), "
+                                 f"but there is no {config_file}.")
+            # exported models produce the same embeddings as the model they were exported from
+            # (exports of older versions only contain the name of the model)
+            export_config = json.loads(config_file.read_text())
+            self.model_sha256 = export_config.get("model_sha256") or export_config["source_model"]
 
         logger.info(f"Init retriever using embeddings of model {embedding_model}")
         if model_format == "farm" or model_format == "transformers":
             self.embedding_model = Inferencer.load(
                 embedding_model, task_type="embeddings", extraction_strategy=self.pooling_strategy,
-                extraction_layer=self.emb_extraction_layer, gpu=use_gpu, batch_size=4, max_seq_len=512, num_processes=0
+                extraction_layer=self.emb_extraction_layer, gpu=use_gpu, batch_size=batch_size, max_seq_len=max_seq_len,
+                num_processes=0
             )
+            if backend != "torch":
+                # keep FARM's preprocessing and pooling, only run the transformer itself in the exported backend
+                language_model = self.embedding_model.model.language_model
+                model_file = Path(embedding_model) / (EMBEDDING_EXPORT_FILE + BACKEND_FILE_SUFFIX[backend])
+                language_model.model = ExportedEncoder(model_file, backend=backend,
+                                                       device=self.embedding_model.model.device)
+            else:
+                self.model_sha256 = get_model_sha256(self.embedding_model.model)
+            self.embedding_model.model = quantize_model(self.embedding_model.model, quantize)
+            self.embedding_model.model.eval()
 
         elif model_format == "sentence_transformers":
             from sentence_transformers import SentenceTransformer
@@ -234,10 +463,61 @@ class EmbeddingRetriever(BaseRetriever):
                 device = "cuda"
             else:
                 device = "cpu"
-            self.embedding_model = SentenceTransformer(embedding_model, device=device)
+            model = SentenceTransformer(embedding_model, device=device)
+            self.model_sha256 = get_model_sha256(model)
+            self.embedding_model = quantize_model(model, quantize)
         else:
             raise NotImplementedError
 
+        # identifies the model that produced an embedding (e.g. stored next to embeddings in the SQLDocumentStore)
+        self.model_fingerprint = f"{model_format}:{self.model_sha256}:{pooling_strategy}:{emb_extraction_layer}:" \
+                                 f"{quantize}"
+
+    def __getstate__(self):
+        # the retriever gets pickled to the processes of a PassageEmbeddingPool, which don't need the document store
+        state = self.__dict__.copy()
+        state["document_store"] = None
+        return state
+
+    @classmethod
+    def export_encoder(cls,
+                       embedding_model: str,
+                       output_dir: Union[str, Path] = "embedding-export",
+                       backend: str = "onnx",
+                       model_format: str = "farm",
+                       opset_version: int = 11,
+                       optimize_for_cpu: bool = True) -> Path:
+        """
+        Export the language model of a farm / transformers embedding model to TorchScript or ONNX. The output directory
+        can then be loaded as `embedding_model` of an EmbeddingRetriever with the same `backend`.
+
+        Usage:
+            >>> EmbeddingRetriever.export_encoder(embedding_model="deepset/sentence_bert", output_dir="embedding-export")
+            >>> EmbeddingRetriever(document_store=document_store, embedding_model="embedding-export", backend="onnx")
+
+        :param embedding_model: Local path or name of model in Hugging Face's model hub
+        :param output_dir: Directory to write the FARM model (incl. processor) and the exported language model to
+        :param backend: "torchscript" or "onnx"
+        :param model_format: Name of framework that was used for saving the model. Options: 'farm', 'transformers'
+        :param opset_version: ONNX opset version
+        :param optimize_for_cpu: Store the ONNX graph after applying ONNX Runtime's graph optimizations for CPU
+        :return: path of the output directory
+        """
+        output_dir = Path(output_dir)
+        retriever = cls(document_store=None, embedding_model=embedding_model, use_gpu=False,  # type: ignore
+                        model_format=model_format)
+        inferencer = retriever.embedding_model
+        inferencer.model.save(output_dir)  # type: ignore
+        inferencer.processor.save(output_dir)  # type: ignore
+        export_encoder(inferencer.model.language_model.model, output_dir / EMBEDDING_EXPORT_FILE,  # type: ignore
+                       backend=backend,
+                       output_axes={"sequence_output": {0: "batch_size", 1: "max_seq_len"},
+                                    "pooled_output": {0: "batch_size"}},
+                       output_indices=(0, 1), opset_version=opset_version, optimize_for_cpu=optimize_for_cpu)
+        config = {"source_model": embedding_model, "model_sha256": retriever.model_sha256, "backend": backend}
+        (output_dir / EMBEDDING_EXPORT_CONFIG_FILE).write_text(json.dumps(config))
+        return output_dir
+
     def retrieve(self, query: str, filters: dict = None, top_k: int = 10, index: str = None) -> List[Document]:
         if index is None:
             index = self.document_store.index
@@ -259,16 +539,71 @@ class EmbeddingRetriever(BaseRetriever):
         assert type(texts) == list, "Expecting a list of texts, i.e. create_embeddings(texts=['text1',...])"
 
         if self.model_format == "farm" or self.model_format == "transformers":
-            emb = self.embedding_model.inference_from_dicts(dicts=[{"text": t} for t in texts])  # type: ignore
-            emb = [(r["vec"]) for r in emb]
+            if self._can_embed_direct():
+                emb = self._embed_direct(texts)
+            else:
+                emb = self.embedding_model.inference_from_dicts(dicts=[{"text": t} for t in texts])  # type: ignore
+                emb = [np.asarray(r["vec"], dtype=np.float32) for r in emb]
         elif self.model_format == "sentence_transformers":
             # text is single string, sentence-transformers needs a list of strings
-            # get back list of numpy embedding vectors
-            emb = self.embedding_model.encode(texts)  # type: ignore
-            # cast to float64 as float32 can cause trouble when serializing for ES
-            emb = [(r.astype('float64')) for r in emb]
+            # get back list of numpy embedding vectors (float32)
+            emb = self.embedding_model.encode(texts, batch_size=self.batch_size)  # type: ignore
+            emb = [r.astype(np.float32, copy=False) for r in emb]
         return emb
 
+    def _can_embed_direct(self) -> bool:
+        # _embed_direct() calls the tokenizer on the whole texts, while FARM's processor normalizes the whitespace and
+        # tokenizes word by word. Both give the same tokens for WordPiece tokenizers (BERT, DistilBERT), but not for
+        # others, e.g. the byte-level BPE of RoBERTa, which encodes the whitespace in front of a word.
+        return self.pooling_strategy in EMBEDDING_FAST_PATH_STRATEGIES and self.emb_extraction_layer == -1 and \
+            isinstance(self.embedding_model.processor.tokenizer, (BertTokenizer, BertTokenizerFast))  # type: ignore
+
+    def _embed_direct(self, texts: List[str]) -> List[np.array]:
+        """
+        Embed texts by running FARM's tokenizer, language model and pooling directly, without the processor, dataset
+        and dataloader of `Inferencer.inference_from_dicts()`, which cost more than the model itself for a single query.
+        Texts of similar length are encoded together and each batch is only padded to its longest text.
+        Gives the same embeddings as the inferencer (which ignores the first token for mean / max pooling) for models
+        with a WordPiece tokenizer (see `_can_embed_direct()`).
+        """
+        tokenizer = self.embedding_model.processor.tokenizer  # type: ignore
+        model = self.embedding_model.model  # type: ignore
+        token_ids = tokenizer(texts, add_special_tokens=True, truncation=True, max_length=self.max_seq_len,
+                              padding=False)["input_ids"]
+        order = sorted(range(len(texts)), key=lambda idx: len(token_ids[idx]), reverse=True)
+
+        results = [None] * len(texts)  # type: List[Any]
+        for batch_start in range(0, len(texts), self.batch_size):
+            batch_indices = order[batch_start:batch_start + self.batch_size]
+            max_len = len(token_ids[batch_indices[0]])
+            input_ids = torch.full((len(batch_indices), max_len), tokenizer.pad_token_id, dtype=torch.long)
+            padding_mask = torch.zeros((len(batch_indices), max_len), dtype=torch.long)
+            for row, idx in enumerate(batch_indices):
+                input_ids[row, :len(token_ids[idx])] = torch.tensor(token_ids[idx], dtype=torch.long)
+                padding_mask[row, :len(token_ids[idx])] = 1
+            input_ids = input_ids.to(model.device)
+            padding_mask = padding_mask.to(model.device)
+
+            with torch.no_grad():
+                sequence_output, _ = model.language_model(input_ids=input_ids, segment_ids=torch.zeros_like(input_ids),
+                                                          padding_mask=padding_mask)
+                vecs = self._pool_tokens(sequence_output.float(), padding_mask)
+            vecs = vecs.cpu().numpy()
+            for row, idx in enumerate(batch_indices):
+                results[idx] = vecs[row]
+        return results
+
+    def _pool_tokens(self, sequence_output: torch.Tensor, padding_mask: torch.Tensor) -> torch.Tensor:
+        if self.pooling_strategy == "cls_token":
+            return sequence_output[:, 0, :]
+        # aggregate the non-padding tokens except for the first one (like FARM)
+        mask = padding_mask.clone()
+        mask[:, 0] = 0
+        mask = mask.unsqueeze(-1).to(sequence_output.dtype)
+        if self.pooling_strategy == "reduce_mean":
+            return (sequence_output * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return sequence_output.masked_fill(mask == 0, float("-inf")).max(dim=1)[0]
+
     def embed_queries(self, texts: List[str]) -> List[np.array]:
         """
         Create embeddings for a list of queries. For this Retriever type: The same as calling .embed()
@@ -285,5 +620,7 @@ class EmbeddingRetriever(BaseRetriever):
         :param texts: passage to embed
         :return: embeddings, one per input passage
         """
-
+        if self.embedding_cache is not None:
+            # the max. length changes the embeddings of long passages
+            return self.embedding_cache.embed(f"{self.model_fingerprint}:{self.max_seq_len}", texts, self.embed)
         return self.embed(texts)
@@ -21,7 +21,7 @@ from torch.serialization import default_restore_location
 import collections
 from farm.file_utils import http_get
 
-from transformers.tokenization_bert import BertTokenizer
+from transformers.tokenization_bert import BertTokenizer, BertTokenizerFast
 from transformers.modeling_bert import BertModel, BertConfig
 
 logger = logging.getLogger(__name__)
@@ -99,7 +99,7 @@ class Tensorizer(object):
 
 
 class BertTensorizer(Tensorizer):
-    def __init__(self, tokenizer: BertTokenizer, max_length: int, pad_to_max: bool = True):
+    def __init__(self, tokenizer: Union[BertTokenizer, BertTokenizerFast], max_length: int, pad_to_max: bool = True):
         self.tokenizer = tokenizer
         self.max_length = max_length
         self.pad_to_max = pad_to_max
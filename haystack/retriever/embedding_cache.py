@@ -0,0 +1,61 @@
+import hashlib
+import re
+from pathlib import Path
+from typing import Callable, List, Union
+
+import numpy as np
+
+from haystack.cache import KeyValueCache
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def text_hash(text: str) -> str:
+    """
+    Hash of a text after normalizing its whitespace, which doesn't change the tokens (and embeddings) of the text.
+    """
+    normalized = _WHITESPACE.sub(" ", text).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache(KeyValueCache):
+    """
+    Persistent cache of passage embeddings in a SQLite file, keyed by the fingerprint of the model that produced
+    an embedding and the hash of the (whitespace normalized) text. Embeddings are stored as float32 blobs.
+
+    Retrievers with an `embedding_cache` look up passages in `embed_passages()` and only encode the misses
+    (duplicate texts only once), so re-indexing an unchanged or slightly changed corpus is cheap.
+
+    Usage:
+        >>> cache = EmbeddingCache("embeddings.db")
+        >>> retriever = DensePassageRetriever(..., embedding_cache=cache)
+        >>> document_store.update_embeddings(retriever)
+        >>> cache.stats
+    """
+
+    def __init__(self, path: Union[str, Path] = "embedding_cache.db", timeout: float = 60.0, max_size: int = 0):
+        """
+        :param path: path of the SQLite file (created if it doesn't exist)
+        :param timeout: seconds to wait for a lock on the file held by another process (e.g. embedding workers)
+        :param max_size: max. number of embeddings additionally kept in memory (default: none)
+        """
+        super().__init__(path=path, max_size=max_size, timeout=timeout, table="embedding_entries")
+
+    def serialize(self, value: np.ndarray) -> bytes:
+        return np.asarray(value, dtype=np.float32).tobytes()
+
+    def deserialize(self, blob: bytes) -> np.ndarray:
+        return np.frombuffer(blob, dtype=np.float32).copy()
+
+    def embed(self, model: str, texts: List[str], embed_fn: Callable[[List[str]], List[np.ndarray]]) -> List[np.ndarray]:
+        """
+        Get the embeddings of texts from the cache and compute the missing ones with `embed_fn`.
+
+        :param model: fingerprint of the model (see `model_fingerprint` of the retrievers)
+        :param texts: texts to embed
+        :param embed_fn: function that embeds a list of texts
+        :return: embeddings (float32), one per text
+        """
+        keys = [f"{model}|{text_hash(text)}" for text in texts]
+        embeddings = self.get_or_compute(keys, texts, embed_fn)
+        return [np.asarray(embedding, dtype=np.float32) for embedding in embeddings]
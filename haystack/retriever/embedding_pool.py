@@ -0,0 +1,203 @@
+import logging
+import os
+import queue
+import time
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+logger = logging.getLogger(__name__)
+
+
+def _embedding_worker(worker_id: int, retriever, num_threads: int, task_queue, result_queue):
+    torch.set_num_threads(num_threads)
+    cache = getattr(retriever, "embedding_cache", None)
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, texts = task
+        start = time.perf_counter()
+        hits, misses = (cache.stats["hits"], cache.stats["misses"]) if cache is not None else (0, 0)
+        try:
+            embeddings = torch.from_numpy(np.stack(retriever.embed_passages(texts)))
+        except Exception as e:
+            result_queue.put((task_id, worker_id, None, f"{type(e).__name__}: {e}", 0.0, None))
+            continue
+        # hits and misses of the worker's copy of the embedding cache, added to the cache of the parent process
+        cache_stats = (cache.stats["hits"] - hits, cache.stats["misses"] - misses) if cache is not None else None
+        # tensors are moved to shared memory by torch.multiprocessing instead of being pickled
+        result_queue.put((task_id, worker_id, embeddings, None, time.perf_counter() - start, cache_stats))
+
+
+class PassageEmbeddingPool:
+    """
+    Embeds passages with the `embed_passages()` of a retriever in several worker processes, each holding its own
+    replica of the retriever's model and using a share of the CPU cores (`torch.set_num_threads`).
+
+    Texts are sorted by length within chunks and sent to the workers in batches of similar length (less padding).
+    Embeddings are returned through shared memory and yielded in the order of the input texts.
+
+    Usage:
+        >>> with PassageEmbeddingPool(retriever, num_workers=8) as pool:
+        ...     for embedding in pool.embed(texts):
+        ...         ...
+        >>> pool.stats  # passages/s per worker
+
+    The retriever gets pickled to each worker without its document store. DensePassageRetriever loads its encoders
+    in each worker, tensors of other models (e.g. EmbeddingRetriever) are shared via shared memory.
+    Hits and misses of the retriever's embedding cache in the workers are counted in the `stats` of the cache in
+    this process.
+    """
+
+    def __init__(self,
+                 retriever,
+                 num_workers: Optional[int] = None,
+                 threads_per_worker: Optional[int] = None,
+                 batch_size: int = 64,
+                 chunk_size: Optional[int] = None):
+        """
+        :param retriever: retriever with an `embed_passages()` method (e.g. DensePassageRetriever, EmbeddingRetriever)
+        :param num_workers: number of worker processes (default: number of CPU cores // 4)
+        :param threads_per_worker: torch threads of each worker (default: number of CPU cores // num_workers)
+        :param batch_size: number of passages sent to a worker at once
+        :param chunk_size: number of passages that get sorted by length together. Embeddings are streamed back
+                           chunk by chunk, so larger chunks mean less padding but more memory and latency.
+                           Default: 8 batches per worker.
+        """
+        cpu_count = os.cpu_count() or 1
+        self.retriever = retriever
+        self.num_workers = num_workers or max(1, cpu_count // 4)
+        self.threads_per_worker = threads_per_worker or max(1, cpu_count // self.num_workers)
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size or batch_size * self.num_workers * 8
+        self.stats = {}  # type: Dict[int, Dict[str, float]]
+
+        self._context = mp.get_context("spawn")
+        self._workers = []  # type: List
+        self._task_queue = None
+        self._result_queue = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        if self._workers:
+            return
+        self._task_queue = self._context.Queue()
+        self._result_queue = self._context.Queue()
+        self.stats = {worker_id: {"passages": 0, "seconds": 0.0, "passages_per_sec": 0.0}
+                      for worker_id in range(self.num_workers)}
+        for worker_id in range(self.num_workers):
+            worker = self._context.Process(target=_embedding_worker,
+                                           args=(worker_id, self.retriever, self.threads_per_worker,
+                                                 self._task_queue, self._result_queue),
+                                           daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Started {self.num_workers} embedding workers with {self.threads_per_worker} threads each")
+
+    def close(self):
+        for _ in self._workers:
+            self._task_queue.put(None)  # type: ignore
+        for worker in self._workers:
+            worker.join(timeout=30)
+            # workers still busy with batches of an abandoned embed() generator
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        self._log_stats()
+
+    def embed(self, texts: List[str]) -> Iterator[np.ndarray]:
+        """
+        Embed passages in the worker processes.
+
+        :param texts: passages to embed
+        :return: generator of embeddings, one per passage in the order of `texts`
+        """
+        self.start()
+        chunks = [(start, texts[start:start + self.chunk_size]) for start in range(0, len(texts), self.chunk_size)]
+        pending = {}  # type: Dict[int, dict]
+        next_chunk_to_send = 0
+        next_chunk_to_yield = 0
+
+        while next_chunk_to_yield < len(chunks):
+            # keep the workers busy with the next chunk, while the current one is still being processed
+            while next_chunk_to_send < len(chunks) and next_chunk_to_send <= next_chunk_to_yield + 1:
+                pending[next_chunk_to_send] = self._send_chunk(next_chunk_to_send, chunks[next_chunk_to_send][1])
+                next_chunk_to_send += 1
+
+            chunk = pending[next_chunk_to_yield]
+            while chunk["open_batches"] > 0:
+                self._receive(pending)
+
+            for embedding in chunk["embeddings"]:
+                yield embedding
+            del pending[next_chunk_to_yield]
+            next_chunk_to_yield += 1
+
+    def _send_chunk(self, chunk_id: int, texts: List[str]) -> dict:
+        # character length is a cheap proxy of the token length
+        order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]), reverse=True)
+        batches = [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+        for batch_id, batch in enumerate(batches):
+            self._task_queue.put(((chunk_id, batch_id), [texts[idx] for idx in batch]))  # type: ignore
+        return {"batches": batches, "open_batches": len(batches), "embeddings": [None] * len(texts)}
+
+    def _receive(self, pending: Dict[int, dict]):
+        while True:
+            try:
+                (chunk_id, batch_id), worker_id, embeddings, error, seconds, cache_stats = \
+                    self._result_queue.get(timeout=5)  # type: ignore
+                break
+            except queue.Empty:
+                dead_workers = [worker.pid for worker in self._workers if not worker.is_alive()]
+                if dead_workers:
+                    raise RuntimeError(f"Embedding worker processes {dead_workers} died unexpectedly.")
+        if error:
+            raise RuntimeError(f"Embedding worker {worker_id} failed: {error}")
+
+        chunk = pending[chunk_id]
+        embeddings = embeddings.numpy()
+        for row, idx in enumerate(chunk["batches"][batch_id]):
+            chunk["embeddings"][idx] = embeddings[row].copy()
+        chunk["open_batches"] -= 1
+
+        stats = self.stats[worker_id]
+        stats["passages"] += len(embeddings)
+        stats["seconds"] += seconds
+        stats["passages_per_sec"] = stats["passages"] / stats["seconds"] if stats["seconds"] else 0.0
+        if cache_stats:
+            self.retriever.embedding_cache.add_stats(*cache_stats)
+
+    def _log_stats(self):
+        for worker_id, stats in self.stats.items():
+            logger.info(f"Embedding worker {worker_id}: {stats['passages']} passages, "
+                        f"{stats['passages_per_sec']:.1f} passages/s")
+
+
+def iter_passage_embeddings(retriever, texts: List[str], num_workers: int = 1, batch_size: int = 64) -> Iterator[np.ndarray]:
+    """
+    Embed passages with the retriever's `embed_passages()`, either in this process (num_workers=1)
+    or in a PassageEmbeddingPool with `num_workers` processes.
+
+    :return: generator of embeddings in the order of `texts`
+    """
+    if num_workers <= 1:
+        for batch_start in range(0, len(texts), batch_size):
+            embeddings = retriever.embed_passages(texts[batch_start:batch_start + batch_size])
+            assert len(embeddings) == len(texts[batch_start:batch_start + batch_size])
+            for embedding in embeddings:
+                yield embedding
+    else:
+        with PassageEmbeddingPool(retriever, num_workers=num_workers, batch_size=batch_size) as pool:
+            for embedding in pool.embed(texts):
+                yield embedding
+    if getattr(retriever, "embedding_cache", None) is not None:
+        retriever.embedding_cache.log_stats()
@@ -0,0 +1,259 @@
+# Local, content-addressed cache of DPR models.
+#
+# A DPR checkpoint (as published in https://github.com/facebookresearch/DPR) contains both encoders together with the
+# optimizer state and gets fully unpickled by torch.load(). The cache converts each checkpoint once into
+#   <cache_dir>/<sha256 of the checkpoint>/
+#       manifest.json                      encoder params, tensor index and sha256 of each weight file
+#       question_model.<dtype>.npy         flat weights of the query encoder (one file per dtype)
+#       ctx_model.<dtype>.npy              flat weights of the passage encoder
+#       config/                            BertConfig of the encoders
+#       tokenizer/                         vocab of the tokenizer
+# and a reference <cache_dir>/refs/<model name or local checkpoint> pointing to that directory.
+# Weight files are memory-mapped on load (their hashes are recorded at conversion time and checked on request, see
+# CachedDPRModel.verify()) and startup doesn't need network access.
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import numpy as np
+import torch
+from transformers.modeling_bert import BertConfig
+
+from haystack.retriever.dpr_utils import HFBertEncoder, BertTokenizer, RESOURCES_MAP, load_states_from_checkpoint, \
+    download_dpr
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path(os.getenv("HAYSTACK_MODEL_CACHE", Path.home() / ".cache" / "haystack" / "dpr"))
+MANIFEST_FILE = "manifest.json"
+ENCODER_PREFIXES = ("question_model.", "ctx_model.")
+# remote model names that can be passed as `embedding_model` to the DensePassageRetriever
+REMOTE_CHECKPOINTS = {
+    "dpr-bert-base-nq": "checkpoint.retriever.single.nq.bert-base-encoder",
+    "dpr-bert-base-multiset": "checkpoint.retriever.multiset.bert-base-encoder",
+}
+
+
+def _file_sha256(path: Path, chunk_size: int = 2 ** 24) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class CachedDPRModel:
+    """
+    A converted DPR checkpoint in the model cache (see DPRModelCache).
+    """
+
+    def __init__(self, entry_dir: Union[str, Path]):
+        self.entry_dir = Path(entry_dir)
+        self.manifest = json.loads((self.entry_dir / MANIFEST_FILE).read_text())
+        self.encoder_params = self.manifest["encoder_params"]
+        self.config_dir = self.entry_dir / "config"
+        self.tokenizer_dir = self.entry_dir / "tokenizer"
+
+    def verify(self, prefix: str):
+        """
+        Check the weight files of an encoder against the hashes recorded at conversion time.
+        """
+        for weight_file in self.manifest["encoders"][prefix]["files"].values():
+            if _file_sha256(self.entry_dir / weight_file["file"]) != weight_file["sha256"]:
+                raise ValueError(f"Weight file {self.entry_dir / weight_file['file']} doesn't match its hash. "
+                                 f"Please delete {self.entry_dir} to convert the checkpoint again.")
+
+    def load_state_dict(self, prefix: str, verify: bool = False) -> Dict[str, torch.Tensor]:
+        """
+        State dict of an encoder ("question_model." or "ctx_model.") with tensors backed by the memory-mapped files.
+
+        :param verify: check the weight files against their hashes first (reads the files completely)
+        """
+        if verify:
+            self.verify(prefix)
+        encoder = self.manifest["encoders"][prefix]
+        # copy-on-write mapping: nothing gets read before it's used and the files are never modified
+        arrays = {dtype: np.load(str(self.entry_dir / weight_file["file"]), mmap_mode="c")
+                  for dtype, weight_file in encoder["files"].items()}
+        state_dict = {}
+        for name, tensor in encoder["tensors"].items():
+            flat = arrays[tensor["dtype"]][tensor["offset"]:tensor["offset"] + tensor["numel"]]
+            state_dict[name] = torch.from_numpy(flat).view(tensor["shape"])
+        return state_dict
+
+    def load_encoder(self, prefix: str, verify: bool = False) -> HFBertEncoder:
+        """
+        Build the encoder from the cached config (no download of pretrained weights) and use the memory-mapped
+        weights as its parameters, i.e. the weights are neither initialized nor copied.
+
+        :param verify: check the weight files against their hashes first (reads the files completely)
+        """
+        config = BertConfig.from_pretrained(str(self.config_dir))
+        with ExitStack() as stack:
+            if hasattr(torch.device, "__enter__"):
+                # torch >= 2.0: don't allocate (and randomly initialize) weights that get replaced anyway
+                stack.enter_context(torch.device("meta"))
+            encoder = HFBertEncoder(config, project_dim=self.encoder_params["projection_dim"])
+        _assign_state_dict(encoder, self.load_state_dict(prefix, verify=verify))
+        return encoder
+
+
+def _assign_state_dict(model: torch.nn.Module, state_dict: Dict[str, torch.Tensor]):
+    """
+    Like model.load_state_dict(), but the tensors of the state dict become the parameters / buffers of the model.
+    """
+    expected = dict(model.named_parameters())
+    expected.update(model.named_buffers())
+    if set(state_dict) != set(expected):
+        raise ValueError(f"Cached weights don't match the encoder: missing {sorted(set(expected) - set(state_dict))}, "
+                         f"unexpected {sorted(set(state_dict) - set(expected))}")
+    modules = dict(model.named_modules())
+    for name, tensor in state_dict.items():
+        if tensor.shape != expected[name].shape:
+            raise ValueError(f"Cached weight {name} has shape {list(tensor.shape)} instead of "
+                             f"{list(expected[name].shape)}")
+        module_name, _, attribute = name.rpartition(".")
+        module = modules[module_name]
+        if attribute in module._parameters:
+            module._parameters[attribute] = torch.nn.Parameter(tensor, requires_grad=expected[name].requires_grad)
+        else:
+            module._buffers[attribute] = tensor
+
+
+class DPRModelCache:
+    """
+    Converts DPR checkpoints once into memory-mappable per-encoder weight files and keeps them by the hash of
+    the checkpoint, so that startup only maps the weights of the needed encoder and works offline.
+
+    Usage:
+        >>> cached_model = DPRModelCache().load("dpr-bert-base-nq")
+        >>> query_encoder = cached_model.load_encoder("question_model.")
+    """
+
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None, offline: bool = False):
+        """
+        :param cache_dir: directory of the cache (default: env var HAYSTACK_MODEL_CACHE or ~/.cache/haystack/dpr)
+        :param offline: never download anything, fail if a model isn't in the cache yet
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR
+        self.offline = offline
+
+    def load(self, embedding_model: str) -> CachedDPRModel:
+        """
+        Get a model from the cache and download / convert it first, if needed.
+
+        :param embedding_model: remote model name (see REMOTE_CHECKPOINTS), path of a DPR checkpoint
+                                or directory of a converted model (e.g. copied from another cache)
+        """
+        if (Path(embedding_model) / MANIFEST_FILE).is_file():
+            return CachedDPRModel(embedding_model)
+
+        if embedding_model not in REMOTE_CHECKPOINTS and not Path(embedding_model).is_file():
+            raise ValueError(f"'{embedding_model}' is neither a DPR checkpoint, nor a converted model, nor one of the "
+                             f"remote models {list(REMOTE_CHECKPOINTS)}.")
+
+        ref_file = self._ref_file(embedding_model)
+        if ref_file.is_file():
+            entry_dir = self.cache_dir / ref_file.read_text().strip()
+            if (entry_dir / MANIFEST_FILE).is_file():
+                return CachedDPRModel(entry_dir)
+
+        if self.offline:
+            raise ValueError(f"Model '{embedding_model}' is not in the model cache {self.cache_dir} yet and "
+                             f"downloading / converting it is disabled (offline mode).")
+
+        downloaded = embedding_model in REMOTE_CHECKPOINTS
+        checkpoint = self._download(embedding_model) if downloaded else Path(embedding_model)
+        entry_dir = self.convert(checkpoint, source=embedding_model)
+
+        ref_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_ref_file = ref_file.with_name(f".{ref_file.name}.{os.getpid()}")
+        tmp_ref_file.write_text(entry_dir.name)
+        os.replace(str(tmp_ref_file), str(ref_file))
+        if downloaded:
+            # the converted model has everything needed, no need to keep the checkpoint incl. optimizer state
+            checkpoint.unlink()
+        return CachedDPRModel(entry_dir)
+
+    def convert(self, checkpoint: Path, source: str) -> Path:
+        """
+        Convert a DPR checkpoint into a cache entry (if there is no entry for a checkpoint with the same content yet).
+
+        :param checkpoint: path of the DPR checkpoint
+        :param source: name of the model (stored in the manifest)
+        :return: directory of the cache entry
+        """
+        digest = _file_sha256(checkpoint)
+        entry_dir = self.cache_dir / digest
+        if (entry_dir / MANIFEST_FILE).is_file():
+            return entry_dir
+
+        logger.info(f"Converting DPR checkpoint {checkpoint} into the model cache {entry_dir} ...")
+        tmp_dir = self.cache_dir / f".tmp-{digest}-{os.getpid()}"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        saved_state = load_states_from_checkpoint(str(checkpoint))
+        encoder_params = dict(saved_state.encoder_params)
+
+        encoders = {}
+        for prefix in ENCODER_PREFIXES:
+            state_dict = {key[len(prefix):]: value for key, value in saved_state.model_dict.items()
+                          if key.startswith(prefix)}
+            encoders[prefix] = self._write_weights(state_dict, tmp_dir, prefix.rstrip("."))
+        del saved_state
+
+        pretrained_model_cfg = encoder_params["pretrained_model_cfg"] or "bert-base-uncased"
+        BertConfig.from_pretrained(pretrained_model_cfg).save_pretrained(str(tmp_dir / "config"))
+        BertTokenizer.from_pretrained(pretrained_model_cfg).save_pretrained(str(tmp_dir / "tokenizer"))
+
+        manifest = {"source": source, "checkpoint_sha256": digest, "encoder_params": encoder_params,
+                    "encoders": encoders}
+        (tmp_dir / MANIFEST_FILE).write_text(json.dumps(manifest, default=str))
+        try:
+            os.replace(str(tmp_dir), str(entry_dir))
+        except OSError:
+            # another process converted the same checkpoint in the meantime
+            shutil.rmtree(str(tmp_dir), ignore_errors=True)
+        return entry_dir
+
+    @staticmethod
+    def _write_weights(state_dict: Dict[str, torch.Tensor], out_dir: Path, name: str) -> dict:
+        tensors = {}
+        arrays_by_dtype = {}  # type: Dict[str, list]
+        offsets = {}  # type: Dict[str, int]
+        for key, value in state_dict.items():
+            array = value.detach().cpu().numpy()
+            dtype = str(array.dtype)
+            offset = offsets.get(dtype, 0)
+            tensors[key] = {"dtype": dtype, "shape": list(array.shape), "offset": offset, "numel": int(array.size)}
+            arrays_by_dtype.setdefault(dtype, []).append(array.reshape(-1))
+            offsets[dtype] = offset + array.size
+
+        files = {}
+        for dtype, arrays in arrays_by_dtype.items():
+            file_name = f"{name}.{dtype}.npy"
+            np.save(str(out_dir / file_name), np.concatenate(arrays))
+            files[dtype] = {"file": file_name, "sha256": _file_sha256(out_dir / file_name)}
+        return {"tensors": tensors, "files": files}
+
+    def _ref_file(self, embedding_model: str) -> Path:
+        if embedding_model in REMOTE_CHECKPOINTS:
+            return self.cache_dir / "refs" / embedding_model
+        # local checkpoints are referenced by path, size and modification time, so that they don't need to be
+        # hashed on every startup
+        path = Path(embedding_model).resolve()
+        stat = path.stat()
+        key = hashlib.sha1(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+        return self.cache_dir / "refs" / f"local-{key}"
+
+    def _download(self, embedding_model: str) -> Path:
+        resource_key = REMOTE_CHECKPOINTS[embedding_model]
+        download_dir = self.cache_dir / "downloads"
+        download_dpr(resource_key=resource_key, out_dir=str(download_dir))
+        *path_names, file_name = resource_key.split(".")
+        return download_dir.joinpath(*path_names, file_name + RESOURCES_MAP[resource_key]["original_ext"])
@@ -1,9 +1,13 @@
+import json
 import logging
-from collections import OrderedDict
-from typing import List
+import pickle
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
 
 from haystack.database.base import Document, BaseDocumentStore
 from haystack.database.elasticsearch import ElasticsearchDocumentStore
@@ -133,30 +137,94 @@ class TfidfRetriever(BaseRetriever):
     Split documents into smaller units (eg, paragraphs or pages) to reduce the
     computations when text is passed on to a Reader for QA.
 
-    It uses sklearn's TfidfVectorizer to compute a tf-idf matrix.
+    It uses sklearn's TfidfVectorizer to compute a tf-idf matrix. For large or noisy corpora, a HashingVectorizer
+    can be used instead (`vectorizer_type="hashing"`). Its memory is bounded by `n_features` rather than by the size
+    of the vocabulary and paragraphs are vectorized batch by batch into a float32 matrix. Documents are read from
+    a SQLDocumentStore batch by batch as well. The paragraphs (incl. their texts) are held in memory, as they are
+    returned by retrieve().
+
+    A fitted retriever can be persisted via save() and restored via TfidfRetriever.load(), which avoids
+    reading and fitting the whole DocumentStore on every start. New documents can be made searchable
+    via add_documents() without a full refit.
     """
 
-    def __init__(self, document_store: BaseDocumentStore):
-        self.vectorizer = TfidfVectorizer(
-            lowercase=True,
-            stop_words=None,
-            token_pattern=r"(?u)\b\w\w+\b",
-            ngram_range=(1, 1),
-        )
+    def __init__(
+        self,
+        document_store: BaseDocumentStore,
+        refit_ratio: Optional[float] = 0.1,
+        auto_fit: bool = True,
+        vectorizer_type: str = "tfidf",
+        n_features: int = 2 ** 20,
+        batch_size: int = 10000,
+    ):
+        """
+        :param document_store: an instance of a DocumentStore to retrieve documents from.
+        :param refit_ratio: Policy for refreshing the IDF statistics in add_documents(). New paragraphs are
+                            vectorized with the existing vocabulary and IDF weights until their number exceeds
+                            this fraction of the paragraphs seen at the last fit. Then the vectorizer is refit on all
+                            paragraphs. Set to 0 to refit on every call, None to never refit.
+        :param auto_fit: Whether to read all documents from the DocumentStore and fit right away.
+        :param vectorizer_type: "tfidf" (vocabulary-based TfidfVectorizer) or "hashing" (HashingVectorizer + IDF
+                                weighting, with a fixed number of features)
+        :param n_features: Number of hash buckets (= columns of the tf-idf matrix) for vectorizer_type "hashing"
+        :param batch_size: Number of paragraphs vectorized at once when fitting with vectorizer_type "hashing" and
+                           of documents read at once from a SQLDocumentStore
+        """
+        if vectorizer_type == "tfidf":
+            self.vectorizer = TfidfVectorizer(
+                lowercase=True,
+                stop_words=None,
+                token_pattern=r"(?u)\b\w\w+\b",
+                ngram_range=(1, 1),
+            )  # type: Union[TfidfVectorizer, HashingVectorizer]
+        elif vectorizer_type == "hashing":
+            self.vectorizer = HashingVectorizer(
+                lowercase=True,
+                stop_words=None,
+                token_pattern=r"(?u)\b\w\w+\b",
+                ngram_range=(1, 1),
+                n_features=n_features,
+                alternate_sign=False,
+                norm=None,
+                dtype=np.float32,
+            )
+        else:
+            raise ValueError(f"Unknown vectorizer_type '{vectorizer_type}'. Choose 'tfidf' or 'hashing'.")
 
         self.document_store = document_store
-        self.paragraphs = self._get_all_paragraphs()
-        self.df = None
-        self.fit()
+        self.refit_ratio = refit_ratio
+        self.vectorizer_type = vectorizer_type
+        self.batch_size = batch_size
+        self.idf = None  # type: Optional[np.ndarray]
+        self.paragraphs = []  # type: List[Paragraph]
+        self.n_paragraphs_at_fit = 0
+        self._meta_index = None  # type: Optional[Dict[str, Dict[Any, List[int]]]]
+        if auto_fit:
+            self.paragraphs = self._get_all_paragraphs()
+            self.fit()
 
     def _get_all_paragraphs(self) -> List[Paragraph]:
         """
-        Split the list of documents in paragraphs
+        Split the list of documents in paragraphs.
+        DocumentStores with a get_all_documents_generator() (SQLDocumentStore) are read in batches of `batch_size`
+        documents, so that only the paragraphs and not all documents are held in memory.
         """
-        documents = self.document_store.get_all_documents()
+        if hasattr(self.document_store, "get_all_documents_generator"):
+            documents = self.document_store.get_all_documents_generator(batch_size=self.batch_size)  # type: ignore
+        else:
+            documents = self.document_store.get_all_documents()
+        paragraphs = []  # type: List[Paragraph]
+        n_documents = 0
+        for document in documents:
+            paragraphs += self._split_paragraphs([document], first_paragraph_id=len(paragraphs))
+            n_documents += 1
+        logger.info(f"Found {len(paragraphs)} candidate paragraphs from {n_documents} docs in DB")
+        return paragraphs
 
+    @staticmethod
+    def _split_paragraphs(documents: List[Document], first_paragraph_id: int) -> List[Paragraph]:
         paragraphs = []
-        p_id = 0
+        p_id = first_paragraph_id
         for doc in documents:
             for p in doc.text.split("\n\n"):  # TODO: this assumes paragraphs are separated by "\n\n". Can be switched to paragraph tokenizer.
                 if not p.strip():  # skip empty paragraphs
@@ -165,53 +233,261 @@ class TfidfRetriever(BaseRetriever):
                     Paragraph(document_id=doc.id, paragraph_id=p_id, text=(p,), meta=doc.meta)
                 )
                 p_id += 1
-        logger.info(f"Found {len(paragraphs)} candidate paragraphs from {len(documents)} docs in DB")
         return paragraphs
 
-    def _calc_scores(self, query: str) -> dict:
-        question_vector = self.vectorizer.transform([query])
+    def _calc_scores(self, query: str, top_k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score all paragraphs against the query and select the top_k ones.
+        Only paragraphs sharing at least one term with the query get a (nonzero) score, so the selection
+        runs on the nonzero entries of the sparse score vector instead of all paragraphs.
 
-        scores = self.tfidf_matrix.dot(question_vector.T).toarray()
-        idx_scores = [(idx, score) for idx, score in enumerate(scores)]
-        indices_and_scores = OrderedDict(
-            sorted(idx_scores, key=(lambda tup: tup[1]), reverse=True)
-        )
-        return indices_and_scores
+        :param mask: Boolean array marking the paragraphs that may be returned (e.g. the ones matching filters)
+        :return: indices of the top_k paragraphs and their scores, sorted by descending score
+        """
+        question_vector = self._vectorize([query])
+        # (n_paragraphs x 1) sparse column holding only the paragraphs that share a term with the query
+        scores = self.tfidf_matrix.dot(question_vector.T).tocsc()
+        candidate_indices = scores.indices
+        candidate_scores = scores.data
+        if mask is not None:
+            allowed = mask[candidate_indices]
+            candidate_indices = candidate_indices[allowed]
+            candidate_scores = candidate_scores[allowed]
+
+        if len(candidate_scores) > top_k:
+            top = np.argpartition(-candidate_scores, top_k - 1)[:top_k]
+            candidate_indices = candidate_indices[top]
+            candidate_scores = candidate_scores[top]
+        # sort by score, ties by paragraph position
+        order = np.lexsort((candidate_indices, -candidate_scores))
+        indices = candidate_indices[order]
+        indices_scores = candidate_scores[order]
+
+        # fill up with non-matching paragraphs (score 0) if the query matched less than top_k paragraphs
+        n_allowed = len(self.paragraph_texts) if mask is None else int(mask.sum())
+        n_missing = min(top_k, n_allowed) - len(indices)
+        if n_missing > 0:
+            # the first n_missing + len(indices) allowed paragraphs contain at least n_missing non-matching ones
+            n_candidates = n_missing + len(indices)
+            if mask is None:
+                allowed_indices = np.arange(n_candidates)
+            else:
+                allowed_indices = np.flatnonzero(mask)[:n_candidates]
+            fill = np.setdiff1d(allowed_indices, indices)[:n_missing].astype(indices.dtype)
+            indices = np.concatenate([indices, fill])
+            indices_scores = np.concatenate([indices_scores, np.zeros(len(fill), dtype=indices_scores.dtype)])
+        return indices, indices_scores
 
     def retrieve(self, query: str, filters: dict = None, top_k: int = 10, index: str = None) -> List[Document]:
-        if filters:
-            raise NotImplementedError("Filters are not implemented in TfidfRetriever.")
+        """
+        :param query: The query string
+        :param filters: Limit the results to paragraphs whose meta data have one of the given values per key,
+                        e.g. {"name": ["some", "more"], "category": ["only_one"]}
+        :param top_k: How many paragraphs to return
+        :param index: Not supported by TfidfRetriever
+        """
         if index:
             raise NotImplementedError("Switching index is not supported in TfidfRetriever.")
 
-        # get scores
-        indices_and_scores = self._calc_scores(query)
+        mask = self._get_filter_mask(filters) if filters else None
 
-        # rank paragraphs
-        df_sliced = self.df.loc[indices_and_scores.keys()]  # type: ignore
-        df_sliced = df_sliced[:top_k]
+        # get scores & rank paragraphs
+        indices, scores = self._calc_scores(query, top_k, mask=mask)
 
-        logger.debug(
-            f"Identified {df_sliced.shape[0]} candidates via retriever:\n {df_sliced.to_string(col_space=10, index=False)}"
-        )
+        logger.debug(f"Identified {len(indices)} candidates via retriever: "
+                     f"{[(self.paragraph_document_ids[idx], score) for idx, score in zip(indices, scores)]}")
 
         # get actual content for the top candidates
-        paragraphs = list(df_sliced.text.values)
-        meta_data = [{"document_id": row["document_id"], "paragraph_id": row["paragraph_id"],  "meta": row.get("meta", {})}
-                     for idx, row in df_sliced.iterrows()]
-
         documents = []
-        for para, meta in zip(paragraphs, meta_data):
+        for idx in indices:
             documents.append(
                 Document(
-                    id=meta["document_id"],
-                    text=para,
-                    meta=meta.get("meta", {})
+                    id=self.paragraph_document_ids[idx],
+                    text=self.paragraph_texts[idx],
+                    meta=self.paragraph_metas[idx] or {}
                 ))
 
         return documents
 
+    def _get_filter_mask(self, filters: Dict[str, Any]) -> np.ndarray:
+        """
+        Boolean row mask of the paragraphs whose meta data match all filters (any of the values per key).
+        Uses an inverted index from (meta field, value) to paragraph rows that is built on first use.
+        """
+        if self._meta_index is None:
+            meta_index = {}  # type: Dict[str, Dict[Any, List[int]]]
+            for row, meta in enumerate(self.paragraph_metas):
+                for key, value in (meta or {}).items():
+                    try:
+                        meta_index.setdefault(key, {}).setdefault(value, []).append(row)
+                    except TypeError:  # unhashable values (e.g. lists) can't be used for filtering
+                        continue
+            self._meta_index = meta_index
+
+        mask = np.ones(len(self.paragraph_texts), dtype=bool)
+        for key, values in filters.items():
+            if not isinstance(values, list):
+                values = [values]
+            key_mask = np.zeros(len(self.paragraph_texts), dtype=bool)
+            for value in values:
+                key_mask[self._meta_index.get(key, {}).get(value, [])] = True
+            mask &= key_mask
+        return mask
+
+    def _vectorize(self, texts: List[str]):
+        """
+        Turn texts into rows of the tf-idf matrix (using the current vocabulary / IDF weights).
+        """
+        if self.vectorizer_type == "tfidf":
+            return self.vectorizer.transform(texts)
+        return self._apply_idf(self.vectorizer.transform(texts))
+
+    def _apply_idf(self, term_frequencies):
+        weighted = term_frequencies.tocsr() @ sparse.diags(self.idf, format="csr")
+        return normalize(weighted, norm="l2", copy=False)
+
     def fit(self):
-        self.df = pd.DataFrame.from_dict(self.paragraphs)
-        self.df["text"] = self.df["text"].apply(lambda x: " ".join(x))
-        self.tfidf_matrix = self.vectorizer.fit_transform(self.df["text"])
\ No newline at end of file
+        # flat per-paragraph arrays, aligned with the rows of the tf-idf matrix
+        self.paragraph_texts = [" ".join(p.text) for p in self.paragraphs]
+        self.paragraph_document_ids = [p.document_id for p in self.paragraphs]
+        self.paragraph_metas = [p.meta for p in self.paragraphs]
+        self._meta_index = None
+        if self.vectorizer_type == "tfidf":
+            self.tfidf_matrix = self.vectorizer.fit_transform(self.paragraph_texts).tocsr()
+        else:
+            self.tfidf_matrix = self._fit_hashing()
+        self.n_paragraphs_at_fit = len(self.paragraphs)
+
+    def _fit_hashing(self):
+        """
+        Vectorize the paragraphs batch by batch while counting document frequencies, then apply the IDF weights
+        (smoothed like in sklearn's TfidfTransformer) and build the float32 CSR matrix once. Each batch is weighted
+        in place and released as soon as it is copied into the matrix, so the peak memory stays close to the size
+        of the final matrix. The paragraph texts themselves are kept, as retrieve() returns them.
+        """
+        n_features = self.vectorizer.n_features
+        document_frequencies = np.zeros(n_features, dtype=np.int64)
+        batches = []
+        for batch_start in range(0, len(self.paragraph_texts), self.batch_size):
+            term_frequencies = self.vectorizer.transform(
+                self.paragraph_texts[batch_start:batch_start + self.batch_size]).tocsr()
+            # each row holds every feature at most once, so counting the column indices gives document frequencies
+            document_frequencies += np.bincount(term_frequencies.indices, minlength=n_features)
+            batches.append(term_frequencies)
+
+        n_paragraphs = len(self.paragraph_texts)
+        self.idf = (np.log((1 + n_paragraphs) / (1 + document_frequencies)) + 1).astype(np.float32)
+
+        nnz = sum(batch.nnz for batch in batches)
+        data = np.empty(nnz, dtype=np.float32)
+        indices = np.empty(nnz, dtype=np.int32)
+        indptr = np.zeros(n_paragraphs + 1, dtype=np.int64 if nnz > np.iinfo(np.int32).max else np.int32)
+        row = 0
+        batches.reverse()
+        while batches:
+            batch = batches.pop()
+            batch.data *= self.idf[batch.indices]
+            normalize(batch, norm="l2", copy=False)
+            offset = indptr[row]
+            data[offset:offset + batch.nnz] = batch.data
+            indices[offset:offset + batch.nnz] = batch.indices
+            indptr[row + 1:row + 1 + batch.shape[0]] = batch.indptr[1:] + offset
+            row += batch.shape[0]
+        return sparse.csr_matrix((data, indices, indptr), shape=(n_paragraphs, n_features))
+
+    def add_documents(self, documents: List[Document]):
+        """
+        Make new documents searchable without reading the whole DocumentStore again.
+
+        The paragraphs of the documents are vectorized with the current vocabulary and IDF weights and appended
+        to the tf-idf matrix. Terms that are not in the vocabulary yet are ignored until the next refit,
+        which happens according to `refit_ratio`.
+
+        :param documents: Documents that were written to the DocumentStore after the retriever was fitted
+        """
+        new_paragraphs = self._split_paragraphs(documents, first_paragraph_id=len(self.paragraphs))
+        if not new_paragraphs:
+            return
+        self.paragraphs.extend(new_paragraphs)
+
+        n_added_since_fit = len(self.paragraphs) - self.n_paragraphs_at_fit
+        # a retriever without any fitted paragraphs (e.g. auto_fit=False) has no vocabulary yet and is always fitted
+        if self.n_paragraphs_at_fit == 0 or \
+                (self.refit_ratio is not None and n_added_since_fit > self.refit_ratio * self.n_paragraphs_at_fit):
+            logger.info(f"Refitting TfidfRetriever on {len(self.paragraphs)} paragraphs "
+                        f"({n_added_since_fit} added since the last fit)")
+            self.fit()
+            return
+
+        new_texts = [" ".join(p.text) for p in new_paragraphs]
+        new_rows = self._vectorize(new_texts)
+        # extend the per-paragraph arrays before the matrix, so every row of the matrix has its paragraph
+        self.paragraph_texts.extend(new_texts)
+        self.paragraph_document_ids.extend(p.document_id for p in new_paragraphs)
+        self.paragraph_metas.extend(p.meta for p in new_paragraphs)
+        self._meta_index = None
+        self.tfidf_matrix = sparse.vstack([self.tfidf_matrix, new_rows], format="csr")
+        logger.info(f"Added {len(new_paragraphs)} paragraphs from {len(documents)} docs to TfidfRetriever")
+
+    def save(self, save_dir: Union[Path, str]):
+        """
+        Save the fitted vectorizer (vocabulary + IDF weights), the tf-idf matrix and the paragraphs to a directory.
+        The arrays of the CSR matrix are stored as plain .npy files, so they can be memory-mapped by load().
+
+        :param save_dir: Directory to save to (created if not existing)
+        """
+        save_dir = Path(save_dir)
+        save_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Saving TfidfRetriever to {save_dir}")
+
+        with open(save_dir / "vectorizer.pkl", "wb") as f:
+            pickle.dump(self.vectorizer, f)
+        with open(save_dir / "paragraphs.pkl", "wb") as f:
+            pickle.dump(self.paragraphs, f)
+        matrix = self.tfidf_matrix.tocsr()
+        np.save(save_dir / "tfidf_data.npy", matrix.data)
+        np.save(save_dir / "tfidf_indices.npy", matrix.indices)
+        np.save(save_dir / "tfidf_indptr.npy", matrix.indptr)
+        if self.idf is not None:
+            np.save(save_dir / "idf.npy", self.idf)
+        with open(save_dir / "tfidf_config.json", "w") as f:
+            json.dump({"shape": list(matrix.shape), "n_paragraphs_at_fit": self.n_paragraphs_at_fit,
+                       "refit_ratio": self.refit_ratio, "vectorizer_type": self.vectorizer_type,
+                       "batch_size": self.batch_size}, f)
+
+    @classmethod
+    def load(cls, load_dir: Union[Path, str], document_store: BaseDocumentStore, mmap: bool = True):
+        """
+        Load a TfidfRetriever that was saved via save(), without fitting it again.
+
+        :param load_dir: Directory the retriever was saved to
+        :param document_store: The DocumentStore that holds the documents the retriever was fitted on
+        :param mmap: Whether to memory-map the tf-idf matrix instead of reading it into memory
+        """
+        load_dir = Path(load_dir)
+        with open(load_dir / "tfidf_config.json") as f:
+            config = json.load(f)
+
+        retriever = cls(document_store=document_store, refit_ratio=config["refit_ratio"], auto_fit=False,
+                        vectorizer_type=config.get("vectorizer_type", "tfidf"),
+                        batch_size=config.get("batch_size", 10000))
+        with open(load_dir / "vectorizer.pkl", "rb") as f:
+            retriever.vectorizer = pickle.load(f)
+        if retriever.vectorizer_type == "hashing":
+            retriever.idf = np.load(load_dir / "idf.npy")
+        with open(load_dir / "paragraphs.pkl", "rb") as f:
+            retriever.paragraphs = [Paragraph(*p) for p in pickle.load(f)]
+
+        mmap_mode = "r" if mmap else None
+        retriever.tfidf_matrix = sparse.csr_matrix(
+            (np.load(load_dir / "tfidf_data.npy", mmap_mode=mmap_mode),
+             np.load(load_dir / "tfidf_indices.npy", mmap_mode=mmap_mode),
+             np.load(load_dir / "tfidf_indptr.npy", mmap_mode=mmap_mode)),
+            shape=tuple(config["shape"]),
+        )
+        retriever.paragraph_texts = [" ".join(p.text) for p in retriever.paragraphs]
+        retriever.paragraph_document_ids = [p.document_id for p in retriever.paragraphs]
+        retriever.paragraph_metas = [p.meta for p in retriever.paragraphs]
+        retriever.n_paragraphs_at_fit = config["n_paragraphs_at_fit"]
+        logger.info(f"Loaded TfidfRetriever with {len(retriever.paragraphs)} paragraphs from {load_dir}")
+        return retriever
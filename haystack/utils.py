@@ -1,12 +1,20 @@
+import hashlib
+import io
 import json
 from collections import defaultdict
 import logging
 import pprint
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+
+import torch
+
 from haystack.database.sql import Document
+from haystack.retriever.backends import ExportedEncoder
 
 logger = logging.getLogger(__name__)
 
+QUANTIZATION_OPTIONS = ("dynamic_int8",)
+
 
 def print_answers(results: dict, details: str = "all"):
     answers = results["answers"]
@@ -79,3 +87,77 @@ def convert_labels_to_squad(labels_file: str):
 
     with open("labels_in_squad_format.json", "w+") as outfile:
         json.dump(labels_in_squad_format, outfile)
+
+
+def quantize_model(model: torch.nn.Module, quantize: Optional[str]) -> torch.nn.Module:
+    """
+    Quantize a PyTorch model for faster inference on CPU.
+    "dynamic_int8" stores the weights of all linear layers as int8 and quantizes their activations on the fly.
+
+    :param model: the model to quantize (it stays unchanged)
+    :param quantize: None (return the model as it is) or "dynamic_int8"
+    :return: a quantized copy of the model
+    """
+    if quantize is None:
+        return model
+    if quantize not in QUANTIZATION_OPTIONS:
+        raise ValueError(f"Quantization '{quantize}' is not supported. Choose one of {QUANTIZATION_OPTIONS} or None.")
+    if any(param.is_cuda for param in model.parameters()):
+        raise ValueError("Dynamic int8 quantization only runs on CPU. Please disable the GPU (use_gpu) to use it.")
+
+    quantized_model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    logger.info(f"Quantized model ({quantize}): {get_model_size_mb(model):.1f} MB -> "
+                f"{get_model_size_mb(quantized_model):.1f} MB")
+    return quantized_model
+
+
+def get_model_size_mb(model: torch.nn.Module) -> float:
+    """
+    Size of the serialized weights of a model in MB.
+    Encoders exported to ONNX / TorchScript (ExportedEncoder) keep their weights outside of the state dict, so the
+    size of their model files is counted instead.
+    """
+    exported = {name: module for name, module in model.named_modules() if isinstance(module, ExportedEncoder)}
+    prefixes = tuple(f"{name}." if name else "" for name in exported)
+    state_dict = {key: value for key, value in model.state_dict().items()
+                  if not (prefixes and key.startswith(prefixes))}
+    buffer = io.BytesIO()
+    torch.save(state_dict, buffer)
+    exported_size = sum(module.size_bytes for module in exported.values())
+    return (buffer.tell() + exported_size) / 1e6
+
+
+def get_model_sha256(model: torch.nn.Module) -> str:
+    """
+    sha256 of the weights of a model (names, shapes, dtypes and values of all tensors in its state dict).
+    """
+    sha256 = hashlib.sha256()
+    for name, tensor in sorted(model.state_dict().items()):
+        tensor = tensor.detach().cpu().contiguous()
+        sha256.update(f"{name}|{tuple(tensor.shape)}|{tensor.dtype}|".encode())
+        sha256.update(tensor.numpy().tobytes())
+    return sha256.hexdigest()
+
+
+def compare_quantization_results(results: dict, quantized_results: dict, metrics: List[str],
+                                 time: float, quantized_time: float,
+                                 model_size_mb: float, quantized_model_size_mb: float) -> dict:
+    """
+    Summarize the evaluation of a full precision model and its quantized copy.
+
+    :param results: eval metrics of the full precision model
+    :param quantized_results: eval metrics of the quantized model
+    :param metrics: names of the metrics to compare
+    :param time: inference time of the full precision model
+    :param quantized_time: inference time of the quantized model on the same data
+    :param model_size_mb: size of the full precision model in MB
+    :param quantized_model_size_mb: size of the quantized model in MB
+    :return: dict with the change of each metric ("<metric>_delta", quantized minus full precision), the "speedup"
+             and the "memory_saving" (relative reduction of the model size)
+    """
+    comparison = {f"{metric}_delta": quantized_results[metric] - results[metric] for metric in metrics}
+    comparison["speedup"] = time / quantized_time if quantized_time else float("nan")
+    comparison["model_size_mb"] = model_size_mb
+    comparison["quantized_model_size_mb"] = quantized_model_size_mb
+    comparison["memory_saving"] = 1 - quantized_model_size_mb / model_size_mb
+    return comparison
@@ -10,6 +10,16 @@ GPU_NUMBER = int(os.getenv("GPU_NUMBER", 1))
 MAX_PROCESSES = int(os.getenv("MAX_PROCESSES", 1))
 BATCHSIZE = int(os.getenv("BATCHSIZE", 50))
 CONCURRENT_REQUEST_PER_WORKER = int(os.getenv("CONCURRENT_REQUEST_PER_WORKER", 4))              
+# Dynamic batching of query encoding and reading across concurrent requests
+DYNAMIC_BATCHING = os.getenv("DYNAMIC_BATCHING", "False").lower() == "true"
+BATCH_MAX_SIZE_RETRIEVER = int(os.getenv("BATCH_MAX_SIZE_RETRIEVER", 32))
+BATCH_MAX_SIZE_READER = int(os.getenv("BATCH_MAX_SIZE_READER", 8))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 5))
+BATCH_MAX_QUEUE_SIZE = int(os.getenv("BATCH_MAX_QUEUE_SIZE", 256))
+# Pruning of long documents to their most relevant sentence windows before the reader
+PASSAGE_PRUNING = os.getenv("PASSAGE_PRUNING", "False").lower() == "true"
+PRUNING_SENTENCES_PER_WINDOW = int(os.getenv("PRUNING_SENTENCES_PER_WINDOW", 3))
+PRUNING_TOP_K_WINDOWS = int(os.getenv("PRUNING_TOP_K_WINDOWS", 4))
 
 # DB
 DB_HOST = os.getenv("DB_HOST", "35.188.203.27")
@@ -24,6 +34,7 @@ SEARCH_FIELD_NAME = os.getenv("SEARCH_FIELD_NAME", "text")
 FAQ_QUESTION_FIELD_NAME = os.getenv("FAQ_QUESTION_FIELD_NAME", "question")
 EMBEDDING_FIELD_NAME = os.getenv("EMBEDDING_FIELD_NAME", "embedding")
 EMBEDDING_DIM = os.getenv("EMBEDDING_DIM", 768)
+READER_TOKENS_FIELD_NAME = os.getenv("READER_TOKENS_FIELD_NAME", None)  # field of pre-tokenized passages
 
 # Reader
 READER_MODEL_PATH = os.getenv("READER_MODEL_PATH", "deepset/roberta-base-squad2")
@@ -31,6 +42,11 @@ READER_TYPE = os.getenv("READER_TYPE", "FARMReader") # alternative: 'Transformer
 READER_TOKENIZER = os.getenv("READER_TOKENIZER", None)
 CONTEXT_WINDOW_SIZE = int(os.getenv("CONTEXT_WINDOW_SIZE", 500))
 DEFAULT_TOP_K_READER = int(os.getenv("DEFAULT_TOP_K_READER", 5))
+READER_CACHE_SIZE = int(os.getenv("READER_CACHE_SIZE", 0))  # predictions per (question, passage) kept in memory, 0 = off
+READER_CACHE_PATH = os.getenv("READER_CACHE_PATH", None)  # optional SQLite file backing the reader cache
+CASCADE_FAST_READER_MODEL_PATH = os.getenv("CASCADE_FAST_READER_MODEL_PATH", None)  # e.g. "distilbert-base-uncased-distilled-squad"
+CASCADE_MIN_PROBABILITY = float(os.getenv("CASCADE_MIN_PROBABILITY", 0.7))  # escalate less confident answers
+CASCADE_MIN_NO_ANS_GAP = float(os.getenv("CASCADE_MIN_NO_ANS_GAP")) if os.getenv("CASCADE_MIN_NO_ANS_GAP") else None
 TOP_K_PER_CANDIDATE = int(os.getenv("TOP_K_PER_CANDIDATE", 3))
 NO_ANS_BOOST = int(os.getenv("NO_ANS_BOOST", -10))
 DOC_STRIDE = int(os.getenv("DOC_STRIDE", 128))
@@ -44,6 +60,14 @@ if EXCLUDE_META_DATA_FIELDS:
     EXCLUDE_META_DATA_FIELDS = ast.literal_eval(EXCLUDE_META_DATA_FIELDS)
 EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "dpr-bert-base-nq")
 EMBEDDING_MODEL_FORMAT = os.getenv("EMBEDDING_MODEL_FORMAT", "farm")
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", None)
+MODEL_CACHE_OFFLINE = os.getenv("MODEL_CACHE_OFFLINE", "False").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", None)  # SQLite file of passage embeddings, e.g. for re-indexing
+
+# Ranker (re-ranks the documents of the retriever before the reader, e.g. with a larger DEFAULT_TOP_K_RETRIEVER)
+RANKER_MODEL_PATH = os.getenv("RANKER_MODEL_PATH", None)  # e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RANKER_TOP_K = int(os.getenv("RANKER_TOP_K", 10))
+RANKER_BACKEND = os.getenv("RANKER_BACKEND", "torch")
 
 # File uploads
 FILE_UPLOAD_PATH = os.getenv("FILE_UPLOAD_PATH", "file-uploads")
@@ -13,9 +13,19 @@ from rest_api.config import DB_HOST, DB_PORT, DB_USER, DB_PW, DB_INDEX, ES_CONN_
     EMBEDDING_DIM, EMBEDDING_FIELD_NAME, EXCLUDE_META_DATA_FIELDS, RETRIEVER_TYPE, EMBEDDING_MODEL_PATH, USE_GPU, READER_MODEL_PATH, \
     BATCHSIZE, CONTEXT_WINDOW_SIZE, TOP_K_PER_CANDIDATE, NO_ANS_BOOST, MAX_PROCESSES, MAX_SEQ_LEN, DOC_STRIDE, \
     DEFAULT_TOP_K_READER, DEFAULT_TOP_K_RETRIEVER, CONCURRENT_REQUEST_PER_WORKER, FAQ_QUESTION_FIELD_NAME, \
-    EMBEDDING_MODEL_FORMAT, READER_TYPE, READER_TOKENIZER, GPU_NUMBER
+    EMBEDDING_MODEL_FORMAT, READER_TYPE, READER_TOKENIZER, GPU_NUMBER, MODEL_CACHE_DIR, MODEL_CACHE_OFFLINE, \
+    DYNAMIC_BATCHING, BATCH_MAX_SIZE_RETRIEVER, BATCH_MAX_SIZE_READER, BATCH_MAX_WAIT_MS, BATCH_MAX_QUEUE_SIZE, \
+    PASSAGE_PRUNING, PRUNING_SENTENCES_PER_WINDOW, PRUNING_TOP_K_WINDOWS, RANKER_MODEL_PATH, RANKER_TOP_K, RANKER_BACKEND, \
+    READER_CACHE_SIZE, READER_CACHE_PATH, READER_TOKENS_FIELD_NAME, CASCADE_FAST_READER_MODEL_PATH, \
+    CASCADE_MIN_PROBABILITY, CASCADE_MIN_NO_ANS_GAP
 from rest_api.controller.utils import RequestLimiter
+from haystack.batching import BatchedReader, BatchedRetriever, BatchQueueFullError
 from haystack.database.elasticsearch import ElasticsearchDocumentStore
+from haystack.pruning import PassagePruner
+from haystack.ranker.cross_encoder import CrossEncoderRanker
+from haystack.reader.base import BaseReader
+from haystack.reader.cache import ReaderCache
+from haystack.reader.cascade import CascadeReader
 from haystack.reader.farm import FARMReader
 from haystack.reader.transformers import TransformersReader
 from haystack.retriever.base import BaseRetriever
@@ -39,6 +49,7 @@ document_store = ElasticsearchDocumentStore(
     search_fields=SEARCH_FIELD_NAME,
     embedding_dim=EMBEDDING_DIM,
     embedding_field=EMBEDDING_FIELD_NAME,
+    reader_tokens_field=READER_TOKENS_FIELD_NAME,
     excluded_meta_data=EXCLUDE_META_DATA_FIELDS,  # type: ignore
     faq_question_field=FAQ_QUESTION_FIELD_NAME,
 )
@@ -58,7 +69,9 @@ elif RETRIEVER_TYPE == "DensePassageRetriever":
         document_store=document_store,
         embedding_model=EMBEDDING_MODEL_PATH,
         do_lower_case=True,
-        use_gpu=USE_GPU
+        use_gpu=USE_GPU,
+        model_cache_dir=MODEL_CACHE_DIR,
+        offline=MODEL_CACHE_OFFLINE
     )
 elif RETRIEVER_TYPE is None or RETRIEVER_TYPE == "ElasticsearchFilterOnlyRetriever":
     retriever = ElasticsearchFilterOnlyRetriever(document_store=document_store)
@@ -70,18 +83,22 @@ else:
                      )
 
 
-if READER_MODEL_PATH:  # for extractive doc-qa
+reader_cache = ReaderCache(max_size=READER_CACHE_SIZE, path=READER_CACHE_PATH) if READER_CACHE_SIZE else None
+
+def load_reader(model_name_or_path: str, tokenizer: Optional[str] = None) -> BaseReader:
     if READER_TYPE == "TransformersReader":
         use_gpu = -1 if not USE_GPU else GPU_NUMBER
-        reader = TransformersReader(
-            model=str(READER_MODEL_PATH),
+        return TransformersReader(
+            model=str(model_name_or_path),
             use_gpu=use_gpu,
             context_window_size=CONTEXT_WINDOW_SIZE,
-            tokenizer=str(READER_TOKENIZER)
-        )  # type: Optional[FARMReader]
+            tokenizer=str(tokenizer or model_name_or_path),
+            batch_size=BATCHSIZE,
+            result_cache=reader_cache
+        )
     elif READER_TYPE == "FARMReader":
-        reader = FARMReader(
-            model_name_or_path=str(READER_MODEL_PATH),
+        return FARMReader(
+            model_name_or_path=str(model_name_or_path),
             batch_size=BATCHSIZE,
             use_gpu=USE_GPU,
             context_window_size=CONTEXT_WINDOW_SIZE,
@@ -90,16 +107,40 @@ if READER_MODEL_PATH:  # for extractive doc-qa
             num_processes=MAX_PROCESSES,
             max_seq_len=MAX_SEQ_LEN,
             doc_stride=DOC_STRIDE,
-        )  # type: Optional[FARMReader]
+            result_cache=reader_cache,
+        )
     else:
         raise ValueError(f"Could not load Reader of type '{READER_TYPE}'. "
                          f"Please adjust READER_TYPE to one of: "
                          f"'FARMReader', 'TransformersReader', None"
                          )
+
+
+if READER_MODEL_PATH:  # for extractive doc-qa
+    reader = load_reader(READER_MODEL_PATH, tokenizer=READER_TOKENIZER)  # type: Optional[BaseReader]
+    if CASCADE_FAST_READER_MODEL_PATH:
+        # the fast reader answers first, only the questions it isn't confident about go to the reader above
+        reader = CascadeReader(load_reader(CASCADE_FAST_READER_MODEL_PATH), reader,
+                               min_probability=CASCADE_MIN_PROBABILITY, min_no_ans_gap=CASCADE_MIN_NO_ANS_GAP)
 else:
     reader = None  # don't need one for pure FAQ matching
 
-FINDERS = {1: Finder(reader=reader, retriever=retriever)}
+if DYNAMIC_BATCHING:
+    # process the query encoding and reading of concurrent requests in batches
+    if isinstance(retriever, (EmbeddingRetriever, DensePassageRetriever)):
+        retriever = BatchedRetriever(retriever, max_batch_size=BATCH_MAX_SIZE_RETRIEVER,
+                                     max_wait_ms=BATCH_MAX_WAIT_MS, max_queue_size=BATCH_MAX_QUEUE_SIZE)
+    if reader:
+        reader = BatchedReader(reader, max_batch_size=BATCH_MAX_SIZE_READER, max_wait_ms=BATCH_MAX_WAIT_MS,
+                               max_queue_size=BATCH_MAX_QUEUE_SIZE)
+
+pruner = PassagePruner(sentences_per_window=PRUNING_SENTENCES_PER_WINDOW,
+                       top_k_windows=PRUNING_TOP_K_WINDOWS) if PASSAGE_PRUNING else None
+
+ranker = CrossEncoderRanker(model_name_or_path=RANKER_MODEL_PATH, top_k=RANKER_TOP_K,
+                            backend=RANKER_BACKEND) if RANKER_MODEL_PATH else None
+
+FINDERS = {1: Finder(reader=reader, retriever=retriever, pruner=pruner, ranker=ranker)}
 
 
 #############################################
@@ -147,23 +188,23 @@ def doc_qa(model_id: int, request: Question):
 
         finder = FINDERS.get(model_id, None)
 
-        results = []
-        for question in request.questions:
-            if request.filters:
-                filters = {key: [value] for key, value in request.filters.items() if value is not None}
-                logger.info(f" [{datetime.now()}] Request: {request}")
-            else:
-                filters = {}
+        if request.filters:
+            filters = {key: [value] for key, value in request.filters.items() if value is not None}
+            logger.info(f" [{datetime.now()}] Request: {request}")
+        else:
+            filters = {}
 
-            result = finder.get_answers(
-                question=question,
+        # all questions of the request are read together
+        try:
+            results = finder.get_answers_batch(
+                questions=request.questions,
                 top_k_retriever=request.top_k_retriever,
                 top_k_reader=request.top_k_reader,
                 filters=filters,
             )
-            print(result)
-            results.append(result)
-        
+        except BatchQueueFullError:
+            raise HTTPException(status_code=503, detail="The server is busy processing requests.")
+
         print(results)
         elasticapm.set_custom_context({"results": results})
         end_time = time.time()
@@ -181,22 +222,23 @@ def doc_qa(model_id: int, request: Question):
                 status_code=404, detail=f"Couldn't get Finder with ID {model_id}. Available IDs: {list(FINDERS.keys())}"
             )
 
-        results = []
-        for question in request.questions:
-            if request.filters:
-                # put filter values into a list and remove filters with null value
-                filters = {key: [value] for key, value in request.filters.items() if value is not None}
-                logger.info(f" [{datetime.now()}] Request: {request}")
-            else:
-                filters = {}
-
-            result = finder.get_answers(
-                question=question,
+        if request.filters:
+            # put filter values into a list and remove filters with null value
+            filters = {key: [value] for key, value in request.filters.items() if value is not None}
+            logger.info(f" [{datetime.now()}] Request: {request}")
+        else:
+            filters = {}
+
+        # all questions of the request are read together
+        try:
+            results = finder.get_answers_batch(
+                questions=request.questions,
                 top_k_retriever=request.top_k_retriever,
                 top_k_reader=request.top_k_reader,
                 filters=filters,
             )
-            results.append(result)
+        except BatchQueueFullError:
+            raise HTTPException(status_code=503, detail="The server is busy processing requests.")
 
         elasticapm.set_custom_context({"results": results})
         end_time = time.time()
@@ -231,3 +273,20 @@ def faq_qa(model_id: int, request: Question):
     logger.info({"request": request.json(), "results": results})
 
     return {"results": results}
+
+
+@router.get("/metrics/batching")
+def batching_metrics():
+    metrics = {}
+    for name, component in (("retriever", retriever), ("reader", reader)):
+        if isinstance(component, (BatchedRetriever, BatchedReader)):
+            metrics[name] = component.batcher.metrics()
+    return metrics
+
+
+@router.get("/metrics/cascade")
+def cascade_metrics():
+    cascade_reader = reader.reader if isinstance(reader, BatchedReader) else reader
+    if isinstance(cascade_reader, CascadeReader):
+        return cascade_reader.stats
+    return {}
@@ -11,7 +11,8 @@ from fastapi import UploadFile, File, Form
 
 from rest_api.config import DB_HOST, DB_PORT, DB_USER, DB_PW, DB_INDEX, ES_CONN_SCHEME, TEXT_FIELD_NAME, \
     SEARCH_FIELD_NAME, FILE_UPLOAD_PATH, EMBEDDING_DIM, EMBEDDING_FIELD_NAME, EXCLUDE_META_DATA_FIELDS, VALID_LANGUAGES, \
-    FAQ_QUESTION_FIELD_NAME, REMOVE_NUMERIC_TABLES, REMOVE_WHITESPACE, REMOVE_EMPTY_LINES, REMOVE_HEADER_FOOTER, EMBEDDING_MODEL_PATH, EMBEDDING_MODEL_FORMAT, USE_GPU, RETRIEVER_TYPE
+    FAQ_QUESTION_FIELD_NAME, REMOVE_NUMERIC_TABLES, REMOVE_WHITESPACE, REMOVE_EMPTY_LINES, REMOVE_HEADER_FOOTER, EMBEDDING_MODEL_PATH, EMBEDDING_MODEL_FORMAT, USE_GPU, RETRIEVER_TYPE, MODEL_CACHE_DIR, MODEL_CACHE_OFFLINE, \
+    EMBEDDING_CACHE_PATH
 from haystack.database.elasticsearch import ElasticsearchDocumentStore
 from haystack.retriever.dense import DensePassageRetriever
 
@@ -41,7 +42,10 @@ retriever = DensePassageRetriever(
     document_store=document_store,
     embedding_model=EMBEDDING_MODEL_PATH,
     do_lower_case=True,
-    use_gpu=USE_GPU
+    use_gpu=USE_GPU,
+    model_cache_dir=MODEL_CACHE_DIR,
+    offline=MODEL_CACHE_OFFLINE,
+    embedding_cache=EMBEDDING_CACHE_PATH
 )
 
 @router.post("/update-embeddings")
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from haystack.batching import BatchedReader, BatchQueueFullError, DynamicBatcher
+from haystack.database.base import Document
+from haystack.reader.base import BaseReader
+
+
+def test_dynamic_batcher_concurrent_calls():
+    batch_sizes = []
+
+    def square(items):
+        batch_sizes.append(len(items))
+        time.sleep(0.01)
+        return [item * item for item in items]
+
+    batcher = DynamicBatcher(square, max_batch_size=8, max_wait_ms=20)
+    results = {}
+
+    def call(i):
+        results[i] = batcher.submit(i)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert results == {i: i * i for i in range(32)}
+    assert max(batch_sizes) <= 8
+    assert len(batch_sizes) < 32
+    metrics = batcher.metrics()
+    assert metrics["items"] == 32
+    assert metrics["batches"] == len(batch_sizes)
+    assert metrics["mean_batch_size"] > 1
+
+
+def test_dynamic_batcher_errors():
+    def fail(items):
+        raise RuntimeError("model failed")
+
+    batcher = DynamicBatcher(fail, max_wait_ms=1)
+    with pytest.raises(RuntimeError):
+        batcher.submit(1)
+    batcher.close()
+
+    blocker = threading.Event()
+    batcher = DynamicBatcher(lambda items: blocker.wait() and items, max_batch_size=1, max_wait_ms=0,
+                             max_queue_size=1)
+    first = batcher.submit_async(1)
+    # wait for the worker to take the first call, so that the next one fills the queue
+    while batcher.metrics()["queue_depth"] > 0:
+        time.sleep(0.001)
+    second = batcher.submit_async(2)
+    with pytest.raises(BatchQueueFullError):
+        batcher.submit(3)
+    blocker.set()
+    assert first.result() == 1 and second.result() == 2
+    assert batcher.metrics()["rejected"] == 1
+    batcher.close()
+
+
+class EchoReader(BaseReader):
+    def predict(self, question, documents, top_k=None):
+        return {"question": question, "answers": [{"document_id": doc.id} for doc in documents][:top_k]}
+
+
+def test_batched_reader():
+    reader = BatchedReader(EchoReader(), max_batch_size=4, max_wait_ms=5)
+    documents = [Document(id=str(i), text=f"text {i}") for i in range(3)]
+    result = reader.predict(question="Who?", documents=documents, top_k=2)
+    assert result == {"question": "Who?", "answers": [{"document_id": "0"}, {"document_id": "1"}]}
+    reader.batcher.close()
+
+
+class EarlyExitEchoReader(EchoReader):
+    supports_early_exit = True
+
+    def predict(self, question, documents, top_k=None, early_exit=False):
+        result = super().predict(question, documents, top_k=top_k)
+        if early_exit:
+            result["passages_read"] = 1
+        return result
+
+
+def test_batched_reader_early_exit():
+    reader = BatchedReader(EchoReader())
+    assert not reader.supports_early_exit
+    reader.batcher.close()
+
+    reader = BatchedReader(EarlyExitEchoReader(), max_batch_size=4, max_wait_ms=5)
+    assert reader.supports_early_exit
+    documents = [Document(id=str(i), text=f"text {i}") for i in range(3)]
+    result = reader.predict(question="Who?", documents=documents, top_k=2, early_exit=True)
+    assert result["passages_read"] == 1
+    assert reader.batcher.metrics()["batches"] == 0
+    reader.batcher.close()
@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 import time
 
@@ -22,3 +23,165 @@ def test_elasticsearch_update_meta(document_store_with_docs):
     time.sleep(1)
     updated_document = document_store_with_docs.query(query=None, filters={"name": ["filename1"]})[0]
     assert updated_document.meta["meta_field"] == "updated_meta"
+
+
+@pytest.mark.parametrize("document_store_with_docs", [("sql")], indirect=True)
+def test_sql_get_all_documents_generator(document_store_with_docs):
+    documents = list(document_store_with_docs.get_all_documents_generator(batch_size=2))
+    assert len(documents) == 3
+    assert [d.id for d in documents] == [d.id for d in document_store_with_docs.get_all_documents()]
+    assert all(d.tags == {} for d in documents)
+
+
+@pytest.mark.parametrize("document_store_with_docs", [("sql")], indirect=True)
+def test_sql_full_text_query(document_store_with_docs):
+    documents = document_store_with_docs.query(query="Who lives in Berlin?", top_k=1)
+    assert len(documents) == 1
+    assert documents[0].meta["name"] == "filename1"
+    assert documents[0].query_score > 0
+
+    documents = document_store_with_docs.query(query="my name", filters={"name": ["filename3"]})
+    assert [d.meta["name"] for d in documents] == ["filename3"]
+
+    document_store_with_docs.write_documents([{"text": "Berlin is the capital of Germany", "meta": {"name": "filename4"}}])
+    documents = document_store_with_docs.query(query="capital of Germany", top_k=5)
+    assert documents[0].meta["name"] == "filename4"
+
+
+def test_sql_query_by_embedding():
+    from haystack.database.sql import SQLDocumentStore
+
+    document_store = SQLDocumentStore(url="sqlite://")
+    document_store.write_documents([
+        {"text": "text 1", "embedding": np.array([1.0, 0.0, 0.0]), "meta": {"name": "filename1"}},
+        {"text": "text 2", "embedding": np.array([0.0, 1.0, 0.0]), "meta": {"name": "filename2"}},
+        {"text": "text 3", "meta": {"name": "filename3"}},
+    ])
+    documents = document_store.query_by_embedding(np.array([0.1, 1.0, 0.0]), top_k=5)
+    assert [d.meta["name"] for d in documents] == ["filename2", "filename1"]
+    assert "embedding" not in documents[0].meta
+
+    # rows written after the first query are added to the in-memory matrix
+    document_store.write_documents([{"text": "text 4", "embedding": np.array([0.0, 0.0, 1.0]), "meta": {"name": "filename4"}}])
+    documents = document_store.query_by_embedding(np.array([0.0, 0.0, 1.0]), top_k=1)
+    assert documents[0].meta["name"] == "filename4"
+
+    documents = document_store.query_by_embedding(np.array([0.0, 0.0, 1.0]), top_k=1, filters={"name": ["filename1"]})
+    assert documents[0].meta["name"] == "filename1"
+
+
+def test_sql_in_memory_concurrent_access():
+    from concurrent.futures import ThreadPoolExecutor
+    from haystack.database.sql import SQLDocumentStore
+
+    document_store = SQLDocumentStore(url="sqlite://")
+    document_store.write_documents([{"text": f"Berlin text {i}", "meta": {"name": f"filename{i}"}} for i in range(10)])
+
+    def work(i):
+        if i % 2:
+            document_store.write_documents([{"text": f"Berlin text {i} written concurrently"}])
+        return document_store.query(query="Berlin", top_k=3)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(work, range(64)))
+    assert all(len(documents) == 3 for documents in results)
+    assert len(document_store.get_all_documents()) == 10 + 32
+
+
+def test_sql_query_by_embedding_concurrent_writes(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    from haystack.database.sql import SQLDocumentStore
+
+    document_store = SQLDocumentStore(url=f"sqlite:///{tmp_path / 'embeddings.db'}")
+
+    def work(i):
+        document_store.write_documents([{"text": f"text {i}", "embedding": np.array([1.0, i, 0.0])}])
+        return document_store.query_by_embedding(np.array([1.0, 0.0, 0.0]), top_k=1)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(len(documents) == 1 for documents in executor.map(work, range(40)))
+    matrix, ids = document_store._get_embedding_matrix()
+    assert sorted(ids.tolist()) == ids.tolist() and len(set(ids.tolist())) == len(ids) == 40
+    assert matrix.shape == (40, 3)
+
+
+class TextStatsRetriever:
+    # module-level, so that it can be pickled to the worker processes of a PassageEmbeddingPool
+    def embed_passages(self, texts):
+        return [np.array([len(text), text.count(" "), 1.0], dtype=np.float32) for text in texts]
+
+
+class CachedTextStatsRetriever(TextStatsRetriever):
+    def __init__(self, embedding_cache):
+        self.embedding_cache = embedding_cache
+
+    def embed_passages(self, texts):
+        return self.embedding_cache.embed("text-stats", texts, super().embed_passages)
+
+
+@pytest.mark.parametrize("store_type", ["sql", "memory"])
+def test_update_embeddings_multiprocess(store_type):
+    from haystack.database.memory import InMemoryDocumentStore
+    from haystack.database.sql import SQLDocumentStore
+    from haystack.retriever.embedding_pool import PassageEmbeddingPool
+
+    retriever = TextStatsRetriever()
+    texts = [f"text {i} " + "x " * (i % 7) for i in range(200)]
+    with PassageEmbeddingPool(retriever, num_workers=2, batch_size=8, chunk_size=50) as pool:
+        embeddings = list(pool.embed(texts))
+    assert all(np.array_equal(emb, expected) for emb, expected in zip(embeddings, retriever.embed_passages(texts)))
+    assert sum(stats["passages"] for stats in pool.stats.values()) == len(texts)
+
+    if store_type == "sql":
+        document_store = SQLDocumentStore(url="sqlite://")
+    else:
+        document_store = InMemoryDocumentStore(embedding_field="embedding")
+    document_store.write_documents([{"text": text} for text in texts[:20]])
+    document_store.update_embeddings(retriever, num_workers=2)
+    query_emb = retriever.embed_passages([texts[13]])[0]
+    documents = document_store.query_by_embedding(query_emb, top_k=1)
+    assert documents[0].text == texts[13]
+
+
+def test_embedding_cache(tmp_path):
+    from haystack.retriever.embedding_cache import EmbeddingCache
+
+    retriever = TextStatsRetriever()
+    encoded = []
+
+    def embed_fn(texts):
+        encoded.extend(texts)
+        return retriever.embed_passages(texts)
+
+    cache = EmbeddingCache(tmp_path / "embeddings.db")
+    texts = ["a text", "another text", "a text", "a  text "]
+    embeddings = cache.embed("model-a", texts, embed_fn)
+    # whitespace variants and duplicates are only encoded once
+    assert encoded == ["a text", "another text"]
+    assert all(emb.dtype == np.float32 for emb in embeddings)
+    assert np.array_equal(embeddings[0], embeddings[3])
+    cache.close()
+
+    # persisted: a new cache instance only encodes the new text
+    cache = EmbeddingCache(tmp_path / "embeddings.db")
+    embeddings = cache.embed("model-a", ["another text", "a new text"], embed_fn)
+    assert encoded[2:] == ["a new text"]
+    assert np.array_equal(embeddings[0], retriever.embed_passages(["another text"])[0])
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1 and cache.stats["hit_rate"] == 0.5
+
+    # other models don't share embeddings
+    cache.embed("model-b", ["another text"], embed_fn)
+    assert encoded[3:] == ["another text"]
+
+
+def test_embedding_cache_multiprocess(tmp_path):
+    from haystack.retriever.embedding_cache import EmbeddingCache
+    from haystack.retriever.embedding_pool import iter_passage_embeddings
+
+    retriever = CachedTextStatsRetriever(EmbeddingCache(tmp_path / "embeddings.db"))
+    texts = [f"text {i}" for i in range(40)]
+    list(iter_passage_embeddings(retriever, texts[:30], num_workers=2, batch_size=8))
+    list(iter_passage_embeddings(retriever, texts, num_workers=2, batch_size=8))
+    # hits and misses in the workers are counted in the cache of this process
+    assert retriever.embedding_cache.stats["hits"] == 30
+    assert retriever.embedding_cache.stats["misses"] == 40
@@ -1,5 +1,13 @@
+import numpy as np
+import pytest
+import torch
+from transformers.modeling_bert import BertConfig
+
 from haystack.database.memory import InMemoryDocumentStore
+from haystack.retriever.backends import benchmark_query_latency
 from haystack.retriever.dense import DensePassageRetriever
+from haystack.retriever.dpr_utils import HFBertEncoder
+from haystack.retriever.model_cache import CachedDPRModel, DPRModelCache
 
 
 def test_dpr_inmemory_retrieval():
@@ -25,4 +33,118 @@ def test_dpr_inmemory_retrieval():
     document_store.write_documents(embedded)
 
     res = retriever.retrieve(query="Which philosopher attacked Schopenhauer?")
-    assert res[0].text == documents[1]["text"]
\ No newline at end of file
+    assert res[0].text == documents[1]["text"]
+
+
+@pytest.mark.parametrize("backend", ["torchscript", "onnx"])
+def test_dpr_export_backend_parity(backend, tmp_path):
+    if backend == "onnx":
+        pytest.importorskip("onnxruntime")
+    document_store = InMemoryDocumentStore(embedding_field="embedding")
+    export_dir = DensePassageRetriever.export_encoders(embedding_model="dpr-bert-base-nq",
+                                                       output_dir=tmp_path / "dpr-export", backend=backend)
+
+    torch_retriever = DensePassageRetriever(document_store=document_store, embedding_model="dpr-bert-base-nq",
+                                            use_gpu=False)
+    exported_retriever = DensePassageRetriever(document_store=document_store, embedding_model=str(export_dir),
+                                               use_gpu=False, backend=backend)
+    assert exported_retriever.model_fingerprint == torch_retriever.model_fingerprint
+
+    queries = ["Which philosopher attacked Schopenhauer?", "Where is the capital of Angola?", "Who is Aaron?"]
+    passages = ["Angola's capital, Luanda, lies on the Atlantic coast in the northwest of the country.",
+                "Aaron is a prophet, high priest, and the brother of Moses in the Abrahamic religions."]
+    for expected, exported in zip(torch_retriever.embed_queries(queries), exported_retriever.embed_queries(queries)):
+        assert np.allclose(expected, exported, atol=1e-4)
+    for expected, exported in zip(torch_retriever.embed_passages(passages), exported_retriever.embed_passages(passages)):
+        assert np.allclose(expected, exported, atol=1e-4)
+
+    latencies = benchmark_query_latency({"torch": torch_retriever, backend: exported_retriever}, queries, warmup=1)
+    assert set(latencies["torch"]) == {"mean", "p50", "p95", "p99"}
+    assert latencies[backend]["mean"] > 0
+
+
+def create_tiny_dpr_checkpoint(tmp_path):
+    # tiny DPR checkpoint with a local config / vocab instead of bert-base-uncased
+    config_dir = tmp_path / "config"
+    config = BertConfig(vocab_size=30, hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=37)
+    config.save_pretrained(str(config_dir))
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list("abcdefghijklmnopqrstuvwxy")
+    (config_dir / "vocab.txt").write_text("\n".join(vocab))
+    encoders = {"question_model.": HFBertEncoder(config, project_dim=0), "ctx_model.": HFBertEncoder(config, project_dim=0)}
+    model_dict = {prefix + key: value for prefix, encoder in encoders.items() for key, value in encoder.state_dict().items()}
+    encoder_params = {"do_lower_case": True, "pretrained_model_cfg": str(config_dir), "encoder_model_type": "hf_bert",
+                      "pretrained_file": None, "projection_dim": 0, "sequence_length": 16}
+    checkpoint = tmp_path / "checkpoint.cp"
+    torch.save({"model_dict": model_dict, "optimizer_dict": {}, "scheduler_dict": None, "offset": 0, "epoch": 0,
+                "encoder_params": encoder_params}, str(checkpoint))
+    return checkpoint, encoders
+
+
+def test_dpr_model_cache(tmp_path):
+    checkpoint, encoders = create_tiny_dpr_checkpoint(tmp_path)
+    cache_dir = tmp_path / "cache"
+    cached_model = DPRModelCache(cache_dir).load(str(checkpoint))
+    input_ids = torch.tensor([[2, 7, 8, 9, 3]])
+    for prefix, encoder in encoders.items():
+        state_dict = cached_model.load_state_dict(prefix)
+        assert all(torch.equal(state_dict[key], value) for key, value in encoder.state_dict().items())
+        cached_encoder = cached_model.load_encoder(prefix).eval()
+        assert not any(parameter.is_meta for parameter in cached_encoder.parameters())
+        with torch.no_grad():
+            expected = encoder.eval()(input_ids, torch.zeros_like(input_ids), torch.ones_like(input_ids))[1]
+            actual = cached_encoder(input_ids, torch.zeros_like(input_ids), torch.ones_like(input_ids))[1]
+        assert torch.allclose(actual, expected)
+    assert cached_model.encoder_params["sequence_length"] == 16
+
+    # second load: from the cache without converting or downloading anything
+    assert DPRModelCache(cache_dir, offline=True).load(str(checkpoint)).entry_dir == cached_model.entry_dir
+    # a converted model can be used directly, e.g. after copying it to another machine
+    assert DPRModelCache(tmp_path / "empty", offline=True).load(str(cached_model.entry_dir)).entry_dir \
+        == cached_model.entry_dir
+    with pytest.raises(ValueError):
+        DPRModelCache(tmp_path / "empty", offline=True).load(str(checkpoint))
+
+    # corrupted weights are detected when verifying them
+    weight_file = next(cached_model.entry_dir.glob("ctx_model.*.npy"))
+    weights = bytearray(weight_file.read_bytes())
+    weights[-1] ^= 1
+    weight_file.write_bytes(bytes(weights))
+    with pytest.raises(ValueError):
+        cached_model.load_state_dict("ctx_model.", verify=True)
+
+
+def test_dpr_length_sorted_batching(tmp_path):
+    checkpoint, _ = create_tiny_dpr_checkpoint(tmp_path)
+    retriever = DensePassageRetriever(document_store=InMemoryDocumentStore(), embedding_model=str(checkpoint),
+                                      use_gpu=False, batch_size=3, model_cache_dir=str(tmp_path / "cache"))
+    texts = ["abc", "a b c d e f g h i j k", "de", "f g h i j", "klmno", "a", "b c d e f g h i j k l m n o"]
+    # texts are encoded in batches of similar length, but returned in input order and without padding effects
+    batched = retriever.embed_passages(texts)
+    assert len(batched) == len(texts)
+    for text, embedding in zip(texts, batched):
+        assert np.allclose(embedding, retriever.embed_passages([text])[0], atol=1e-5)
+
+
+def test_dpr_shared_lazy_encoders(tmp_path, monkeypatch):
+    checkpoint, _ = create_tiny_dpr_checkpoint(tmp_path)
+    loaded = []
+    load_encoder = CachedDPRModel.load_encoder
+
+    def recording_load_encoder(self, prefix, *args, **kwargs):
+        loaded.append(prefix)
+        return load_encoder(self, prefix, *args, **kwargs)
+
+    monkeypatch.setattr(CachedDPRModel, "load_encoder", recording_load_encoder)
+    retrievers = [DensePassageRetriever(document_store=InMemoryDocumentStore(), embedding_model=str(checkpoint),
+                                        use_gpu=False, model_cache_dir=str(tmp_path / "cache")) for _ in range(2)]
+    # search only needs the query encoder, which is loaded once for both retrievers
+    for retriever in retrievers:
+        retriever.embed_queries(["abc"])
+    assert loaded == ["question_model."]
+    assert retrievers[0].query_encoder is retrievers[1].query_encoder
+
+    for retriever in retrievers:
+        retriever.embed_passages(["abc"])
+    assert loaded == ["question_model.", "ctx_model."]
+    assert retrievers[0].passage_encoder is retrievers[1].passage_encoder
@@ -1,3 +1,6 @@
+import numpy as np
+import pytest
+
 from haystack import Finder
 
 
@@ -35,3 +38,52 @@ def test_faq_retriever_in_memory_store():
     prediction = finder.get_answers_via_similar_questions(question="How to test this?", top_k_retriever=1)
 
     assert len(prediction.get('answers', [])) == 1
+
+
+@pytest.mark.parametrize("backend", ["torchscript", "onnx"])
+def test_embedding_retriever_export_backend_parity(backend, tmp_path):
+    if backend == "onnx":
+        pytest.importorskip("onnxruntime")
+
+    from haystack.database.memory import InMemoryDocumentStore
+    from haystack.retriever.dense import EmbeddingRetriever
+
+    document_store = InMemoryDocumentStore(embedding_field="embedding")
+    export_dir = EmbeddingRetriever.export_encoder(embedding_model="deepset/sentence_bert",
+                                                   output_dir=tmp_path / "embedding-export", backend=backend)
+
+    torch_retriever = EmbeddingRetriever(document_store=document_store, embedding_model="deepset/sentence_bert",
+                                         use_gpu=False)
+    exported_retriever = EmbeddingRetriever(document_store=document_store, embedding_model=str(export_dir),
+                                            use_gpu=False, backend=backend)
+    assert exported_retriever.model_fingerprint == torch_retriever.model_fingerprint
+
+    texts = ["How to test this library?", "By running tox in the command line!"]
+    for expected, exported in zip(torch_retriever.embed(texts), exported_retriever.embed(texts)):
+        assert np.allclose(expected, exported, atol=1e-4)
+
+
+def test_embedding_retriever_direct_path():
+    from haystack.database.memory import InMemoryDocumentStore
+    from haystack.retriever.dense import EmbeddingRetriever
+
+    document_store = InMemoryDocumentStore(embedding_field="embedding")
+    texts = ["How to test this library?", "By running tox in the command line!", "Short"]
+    for pooling_strategy in ["reduce_mean", "reduce_max", "cls_token"]:
+        retriever = EmbeddingRetriever(document_store=document_store, embedding_model="deepset/sentence_bert",
+                                       use_gpu=False, pooling_strategy=pooling_strategy, batch_size=2)
+        assert retriever._can_embed_direct()
+        expected = retriever.embedding_model.inference_from_dicts(dicts=[{"text": t} for t in texts])
+        embeddings = retriever.embed(texts)
+        assert len(embeddings) == len(texts)
+        for emb, exp in zip(embeddings, expected):
+            assert emb.dtype == np.float32
+            assert np.allclose(emb, exp["vec"], atol=1e-4)
+
+    # RoBERTa's byte-level BPE only gives FARM's tokens via its processor, so the inferencer is used
+    retriever = EmbeddingRetriever(document_store=document_store, embedding_model="deepset/roberta-base-squad2",
+                                   use_gpu=False, pooling_strategy="reduce_mean", batch_size=2)
+    assert not retriever._can_embed_direct()
+    expected = retriever.embedding_model.inference_from_dicts(dicts=[{"text": t} for t in texts])
+    for emb, exp in zip(retriever.embed(texts), expected):
+        assert np.allclose(emb, exp["vec"], atol=1e-4)
@@ -43,5 +43,33 @@ def test_finder_get_answers_single_result(reader, document_store_with_docs):
     assert len(prediction["answers"]) == 1
 
 
+def test_finder_get_answers_batch(reader, document_store_with_docs):
+    retriever = TfidfRetriever(document_store=document_store_with_docs)
+    finder = Finder(reader, retriever)
+    questions = ["Who lives in Berlin?", "Who lives in Paris?"]
+    predictions = finder.get_answers_batch(questions=questions, top_k_retriever=10, top_k_reader=3)
+    assert [prediction["question"] for prediction in predictions] == questions
+    assert predictions[0]["answers"][0]["answer"] == "Carla"
+    assert predictions[0]["answers"][0]["meta"]["meta_field"] == "test1"
+    assert predictions[1]["answers"][0]["answer"] == "Christelle"
+    assert set(predictions[0]["timings"]) == {"retriever", "reader"}
+    for prediction, question in zip(predictions, questions):
+        single = finder.get_answers(question=question, top_k_retriever=10, top_k_reader=3)
+        assert [a["answer"] for a in prediction["answers"]] == [a["answer"] for a in single["answers"]]
+        assert len(prediction["answers"]) == 3
 
 
+def test_finder_get_answers_early_exit(reader, document_store_with_docs):
+    retriever = TfidfRetriever(document_store=document_store_with_docs)
+    finder = Finder(reader, retriever)
+    if not reader.supports_early_exit:
+        with pytest.raises(ValueError):
+            finder.get_answers(question="Who lives in Berlin?", top_k_retriever=10, top_k_reader=3, early_exit=True)
+        return
+
+    num_documents = len(retriever.retrieve("Who lives in Berlin?", top_k=10))
+    prediction = finder.get_answers(question="Who lives in Berlin?", top_k_retriever=10, top_k_reader=3,
+                                    early_exit=True)
+    assert prediction["answers"][0]["answer"] == "Carla"
+    assert prediction["answers"][0]["meta"]["meta_field"] == "test1"
+    assert 1 <= prediction["passages_read"] <= num_documents
@@ -0,0 +1,50 @@
+from haystack.database.base import Document
+from haystack.pruning import PassagePruner
+
+
+def test_passage_pruner():
+    filler = " ".join(f"Sentence number {i} is about the weather in spring." for i in range(200))
+    text = filler + " My name is Carla and I live in Berlin. " + filler
+    documents = [Document(id="long", text=text, meta={"name": "long"}),
+                 Document(id="short", text="My name is Paul and I live in New York.")]
+    pruner = PassagePruner(sentences_per_window=2, top_k_windows=3, min_doc_length=1000)
+
+    pruned, offset_maps = pruner.prune("Who lives in Berlin?", documents)
+    assert [doc.id for doc in pruned] == ["long", "short"]
+    assert pruned[0].meta == {"name": "long"}
+    assert pruned[1].text == documents[1].text
+    assert list(offset_maps.keys()) == [0]
+    assert len(pruned[0].text) * 10 < len(text)
+    assert "Carla and I live in Berlin" in pruned[0].text
+
+    # answer as the reader would return it for the pruned text
+    start = pruned[0].text.index("Carla")
+    results = {"question": "Who lives in Berlin?",
+               "answers": [{"answer": "Carla", "document_id": "long",
+                            "offset_start_in_doc": start, "offset_end_in_doc": start + len("Carla")},
+                           {"answer": "Paul", "document_id": "short",
+                            "offset_start_in_doc": 11, "offset_end_in_doc": 15}]}
+    pruner.restore_offsets(results, pruned, offset_maps)
+    carla, paul = results["answers"]
+    assert text[carla["offset_start_in_doc"]:carla["offset_end_in_doc"]] == "Carla"
+    assert (paul["offset_start_in_doc"], paul["offset_end_in_doc"]) == (11, 15)
+
+
+def test_passage_pruner_shared_document_ids():
+    # paragraphs of the same document (e.g. from TfidfRetriever) share the document's id
+    filler = " ".join(f"Sentence number {i} is about the weather in spring." for i in range(100))
+    first = filler + " My name is Carla and I live in Berlin. " + filler
+    second = filler + filler + " My name is Carla and I live in Berlin. "
+    documents = [Document(id="doc", text=first), Document(id="doc", text=second)]
+    pruner = PassagePruner(sentences_per_window=2, top_k_windows=2, min_doc_length=1000)
+
+    pruned, offset_maps = pruner.prune("Who lives in Berlin?", documents)
+    assert sorted(offset_maps.keys()) == [0, 1]
+    answers = []
+    for doc in pruned:
+        start = doc.text.index("Berlin")
+        answers.append({"answer": "Berlin", "document_id": "doc", "offset_start_in_doc": start,
+                        "offset_end_in_doc": start + len("Berlin")})
+    results = pruner.restore_offsets({"question": "Who lives in Berlin?", "answers": answers}, pruned, offset_maps)
+    for answer, doc in zip(results["answers"], documents):
+        assert answer["offset_start_in_doc"] == doc.text.index("Berlin")
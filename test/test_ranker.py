@@ -0,0 +1,31 @@
+from haystack import Finder
+from haystack.database.base import Document
+from haystack.ranker.cross_encoder import CrossEncoderRanker
+from haystack.retriever.sparse import TfidfRetriever
+
+
+def test_cross_encoder_ranker(test_docs_xs):
+    docs = [Document(id=d["meta"]["name"], text=d["text"], meta=d["meta"]) for d in test_docs_xs]
+    ranker = CrossEncoderRanker("cross-encoder/ms-marco-MiniLM-L-6-v2", top_k=2, batch_size=2)
+
+    ranked = ranker.rank("Who lives in Berlin?", docs)
+    assert len(ranked) == 2
+    assert ranked[0].text == "My name is Carla and I live in Berlin"
+    assert ranked[0].query_score >= ranked[1].query_score
+    assert ranked[0].meta == {"meta_field": "test1", "name": "filename1"}
+
+    batch = ranker.rank_batch(["Who lives in Berlin?", "Who lives in New York?"], [docs, docs], top_k=1)
+    assert batch[0][0].text == "My name is Carla and I live in Berlin"
+    assert batch[1][0].text == "My name is Paul and I live in New York"
+
+
+def test_finder_with_ranker(reader, document_store_with_docs):
+    retriever = TfidfRetriever(document_store=document_store_with_docs)
+    ranker = CrossEncoderRanker("cross-encoder/ms-marco-MiniLM-L-6-v2", top_k=2)
+    finder = Finder(reader, retriever, ranker=ranker)
+    prediction = finder.get_answers(question="Who lives in Berlin?", top_k_retriever=10, top_k_reader=3)
+    assert prediction["answers"][0]["answer"] == "Carla"
+    assert prediction["answers"][0]["meta"]["meta_field"] == "test1"
+    # the reader only got the 2 documents of the ranker
+    assert len({answer["document_id"] for answer in prediction["answers"] if answer["document_id"]}) <= 2
+    assert set(prediction["timings"]) == {"retriever", "ranker", "reader"}
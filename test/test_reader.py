@@ -1,7 +1,14 @@
+import json
 import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 from haystack.database.base import Document
+from haystack.database.memory import InMemoryDocumentStore
 from haystack.reader.base import BaseReader
+from haystack.reader.cache import ReaderCache
+from haystack.reader.cascade import CascadeReader
+from haystack.reader.pretokenization import encode_reader_tokens
 from haystack.reader.farm import FARMReader
 from haystack.reader.transformers import TransformersReader
 
@@ -98,3 +105,162 @@ def test_top_k(test_docs_xs):
 
 
 
+def test_quantized_reader(test_docs_xs):
+    docs = [Document(id=d["meta"]["name"], text=d["text"], meta=d["meta"]) for d in test_docs_xs]
+    readers = [
+        FARMReader(model_name_or_path="distilbert-base-uncased-distilled-squad", num_processes=0, use_gpu=False,
+                   top_k_per_sample=5, quantize="dynamic_int8"),
+        TransformersReader(model="distilbert-base-uncased-distilled-squad", tokenizer="distilbert-base-uncased",
+                           use_gpu=-1, quantize="dynamic_int8"),
+    ]
+    for reader in readers:
+        quantized_size = reader.model_size_mb()
+        prediction = reader.predict(question="Who lives in Berlin?", documents=docs, top_k=5)
+        assert prediction["answers"][0]["answer"] == "Carla"
+
+        reader.set_quantization(None)
+        assert reader.model_size_mb() > quantized_size
+
+
+def test_transformers_reader_batching(test_docs_xs):
+    docs = [Document(id=d["meta"]["name"], text=d["text"], meta=d["meta"]) for d in test_docs_xs]
+    questions = ["Who lives in Berlin?", "Who lives in Paris?"]
+    predictions = {}
+    for batch_size in [1, 16]:
+        reader = TransformersReader(model="distilbert-base-uncased-distilled-squad", tokenizer="distilbert-base-uncased",
+                                    use_gpu=-1, batch_size=batch_size)
+        predictions[batch_size] = reader.predict_batch(questions=questions, documents_per_question=[docs, docs], top_k=3)
+        for question, prediction in zip(questions, predictions[batch_size]):
+            single = reader.predict(question=question, documents=docs, top_k=3)
+            assert [a["answer"] for a in prediction["answers"]] == [a["answer"] for a in single["answers"]]
+
+    assert predictions[1][0]["answers"][0]["answer"] == "Carla"
+    assert predictions[16][1]["answers"][0]["answer"] == "Christelle"
+    for small_batches, large_batches in zip(predictions[1], predictions[16]):
+        for small, large in zip(small_batches["answers"], large_batches["answers"]):
+            assert small["answer"] == large["answer"]
+            assert math.isclose(small["probability"], large["probability"], rel_tol=1e-4)
+
+
+def test_transformers_span_decoding():
+    from haystack.reader.transformers_utils import QuestionAnsweringPipeline
+
+    rng = np.random.RandomState(42)
+    start, end = rng.rand(4, 30), rng.rand(4, 30)
+    starts, ends, scores = QuestionAnsweringPipeline.decode_batch(start, end, topk=5, max_answer_len=4)
+    for row in range(4):
+        # all spans with start <= end < start + max_answer_len, scored via the full outer product
+        candidates = np.tril(np.triu(np.outer(start[row], end[row])), 3)
+        expected = np.sort(candidates.flatten())[::-1][:5]
+        assert np.allclose(scores[row], expected)
+        assert np.allclose(start[row, starts[row]] * end[row, ends[row]], scores[row])
+        assert ((ends[row] >= starts[row]) & (ends[row] - starts[row] < 4)).all()
+
+
+def test_farm_reader_preprocessing_pool(test_docs_xs):
+    docs = [Document(id=d["meta"]["name"], text=d["text"], meta=d["meta"]) for d in test_docs_xs]
+    reader = FARMReader(model_name_or_path="distilbert-base-uncased-distilled-squad", use_gpu=False,
+                        top_k_per_sample=5, num_processes=2, fast_path_max_passages=1, batch_size=2)
+    pooled = reader.predict(question="Who lives in Berlin?", documents=docs, top_k=5)
+    assert reader._preprocessing_pool is not None
+
+    reader.fast_path_max_passages = len(docs)
+    in_process = reader.predict(question="Who lives in Berlin?", documents=docs, top_k=5)
+    assert pooled["answers"][0]["answer"] == "Carla"
+    assert [a["answer"] for a in pooled["answers"]] == [a["answer"] for a in in_process["answers"]]
+    assert [a["document_id"] for a in pooled["answers"]] == [a["document_id"] for a in in_process["answers"]]
+    reader.close_preprocessing_pool()
+
+
+def test_farm_reader_concurrent_requests(test_docs_xs):
+    docs = [Document(id=d["meta"]["name"], text=d["text"], meta=d["meta"]) for d in test_docs_xs]
+    reader = FARMReader(model_name_or_path="distilbert-base-uncased-distilled-squad", use_gpu=False,
+                        top_k_per_sample=5, num_processes=0)
+    questions = ["Who lives in Berlin?", "Who lives in Paris?", "Where does Carla live?", "What is my name?"] * 4
+    expected = {q: reader.predict(question=q, documents=docs, top_k=3) for q in set(questions)}
+
+    # the requests of the REST API share the reader's processor on the in-process fast path
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda q: reader.predict(question=q, documents=docs, top_k=3), questions))
+    for question, result in zip(questions, results):
+        assert result["question"] == question
+        assert [(a["answer"], a["document_id"]) for a in result["answers"]] == \
+            [(a["answer"], a["document_id"]) for a in expected[question]["answers"]]
+
+
+def test_reader_result_cache(reader, test_docs_xs, tmp_path):
+    docs = [Document(id=d["meta"]["name"], text=d["text"], meta=d["meta"]) for d in test_docs_xs]
+    uncached = reader.predict(question="Who lives in Berlin?", documents=docs, top_k=3)
+
+    cache = ReaderCache(max_size=len(docs), path=tmp_path / "reader_cache.db")
+    reader.result_cache = cache
+    try:
+        first = reader.predict(question="Who lives in Berlin?", documents=docs, top_k=3)
+        assert cache.stats["misses"] == len(docs)
+        # normalized question and one new passage: only that passage is read
+        new_doc = Document(id="new", text="My name is Anna and I live in Rome")
+        second = reader.predict(question="who lives in  Berlin", documents=docs + [new_doc], top_k=3)
+        assert cache.stats["hits"] == len(docs)
+        assert cache.stats["misses"] == len(docs) + 1
+        assert len(cache) == len(docs)  # least recently used entry was evicted
+    finally:
+        reader.result_cache = None
+
+    assert [a["answer"] for a in first["answers"]] == [a["answer"] for a in uncached["answers"]]
+    assert first.get("no_ans_gap") == uncached.get("no_ans_gap")
+    assert second["answers"][0]["answer"] == uncached["answers"][0]["answer"]
+
+    # evicted entries are still on disk
+    disk_cache = ReaderCache(max_size=10, path=tmp_path / "reader_cache.db")
+    keys = [ReaderCache.key(reader.model_version, "Who lives in Berlin?", doc) for doc in docs + [new_doc]]
+    assert len(disk_cache.get(keys)) == len(docs) + 1
+    # answer offsets depend on the exact text, so whitespace variants of a passage don't share entries
+    spaced_doc = Document(id=new_doc.id, text=new_doc.text.replace(" ", "  "))
+    assert ReaderCache.key(reader.model_version, "Who lives in Berlin?", spaced_doc) != keys[-1]
+
+
+def test_reader_pretokenized_passages(reader, test_docs_xs):
+    document_store = InMemoryDocumentStore()
+    document_store.write_documents(test_docs_xs)
+    document_store.update_reader_tokens(reader)
+    docs = document_store.get_all_documents()
+    assert all(reader.tokenizer_fingerprint in doc.reader_tokens for doc in docs)
+
+    plain = reader.predict(question="Who lives in Berlin?", documents=[doc.copy(update={"reader_tokens": None})
+                                                                       for doc in docs], top_k=3)
+    pretokenized = reader.predict(question="Who lives in Berlin?", documents=docs, top_k=3)
+    assert [a["answer"] for a in pretokenized["answers"]] == [a["answer"] for a in plain["answers"]]
+    assert [a["offset_start"] for a in pretokenized["answers"]] == [a["offset_start"] for a in plain["answers"]]
+
+    # tokens as stored in Elasticsearch, and tokens of an outdated text (ignored)
+    encoded = [doc.copy(update={"reader_tokens": {key: encode_reader_tokens(tokens)
+                                                  for key, tokens in doc.reader_tokens.items()}}) for doc in docs]
+    result = reader.predict(question="Who lives in Berlin?", documents=encoded, top_k=3)
+    assert [a["answer"] for a in result["answers"]] == [a["answer"] for a in plain["answers"]]
+    outdated = encoded[0].copy(update={"text": "My name is Paula and I live in Berlin."})
+    result = reader.predict(question="Who lives in Berlin?", documents=[outdated], top_k=1)
+    assert result["answers"][0]["answer"] == "Paula"
+
+
+def test_cascade_reader(reader, test_docs_xs, tmp_path):
+    docs = [Document(id=d["meta"]["name"], text=d["text"], meta=d["meta"]) for d in test_docs_xs]
+    never = CascadeReader(fast_reader=reader, large_reader=reader, min_probability=0.0)
+    result = never.predict(question="Who lives in Berlin?", documents=docs, top_k=3)
+    assert result["answers"][0]["answer"] == "Carla"
+    assert not result["escalated"]
+
+    always = CascadeReader(fast_reader=reader, large_reader=reader, min_probability=1.01)
+    results = always.predict_batch(["Who lives in Berlin?", "Who lives in New York?"], [docs, docs], top_k=3)
+    assert [result["escalated"] for result in results] == [True, True]
+    assert results[0]["answers"][0]["answer"] == "Carla"
+    assert always.stats == {"questions": 2, "escalated": 2, "escalation_rate": 1.0}
+
+    squad = {"data": [{"title": "test", "paragraphs": [
+        {"context": "My name is Carla and I live in Berlin",
+         "qas": [{"id": "1", "question": "Who lives in Berlin?", "is_impossible": False,
+                  "answers": [{"text": "Carla", "answer_start": 11}]}]}]}]}
+    (tmp_path / "squad.json").write_text(json.dumps(squad))
+    eval_results = always.eval_on_file(tmp_path, "squad.json", probability_thresholds=[0.0, 1.01])
+    assert eval_results["large"]["EM"] == 1.0
+    assert [thresholds["escalation_rate"] for thresholds in eval_results["thresholds"]] == [0.0, 1.0]
+    assert eval_results["recommended"]["min_probability"] == 0.0
@@ -1,16 +1,25 @@
+import pytest
+
 from haystack.database.base import Document
+from haystack.database.memory import InMemoryDocumentStore
+from haystack.retriever.sparse import TfidfRetriever
 
 
-def test_tfidf_retriever():
-    from haystack.retriever.sparse import TfidfRetriever
+@pytest.fixture
+def dogs_and_cats_store():
+    document_store = InMemoryDocumentStore()
+    document_store.write_documents([{"text": f"paragraph {i} about {'dogs' if i % 3 == 0 else 'cats'}",
+                                     "meta": {"name": f"filename{i % 2}"}} for i in range(10)])
+    return document_store
 
+
+def test_tfidf_retriever():
     test_docs = [
         {"name": "testing the finder 1", "text": "godzilla says hello"},
         {"name": "testing the finder 2", "text": "optimus prime says bye"},
         {"name": "testing the finder 3", "text": "alien says arghh"}
     ]
 
-    from haystack.database.memory import InMemoryDocumentStore
     document_store = InMemoryDocumentStore()
     document_store.write_documents(test_docs)
 
@@ -26,3 +35,39 @@ def test_tfidf_retriever():
             meta={"name": "testing the finder 1"},
         )
     ]
+
+
+def test_tfidf_retriever_top_k(dogs_and_cats_store):
+    retriever = TfidfRetriever(dogs_and_cats_store)
+
+    documents = retriever.retrieve("dogs", top_k=3)
+    assert [d.text for d in documents] == ["paragraph 0 about dogs", "paragraph 3 about dogs", "paragraph 6 about dogs"]
+    # fewer matches than top_k are filled up with non-matching paragraphs
+    assert len(retriever.retrieve("zebra", top_k=2)) == 2
+
+
+def test_tfidf_retriever_save_load_and_add_documents(dogs_and_cats_store, tmp_path):
+    retriever = TfidfRetriever(dogs_and_cats_store, refit_ratio=None)
+    retriever.save(tmp_path)
+
+    loaded_retriever = TfidfRetriever.load(tmp_path, dogs_and_cats_store)
+    assert loaded_retriever.retrieve("dogs", top_k=3) == retriever.retrieve("dogs", top_k=3)
+
+    loaded_retriever.add_documents([Document(id="new", text="all about dogs and more dogs")])
+    assert loaded_retriever.retrieve("dogs", top_k=1)[0].id == "new"
+
+
+def test_tfidf_retriever_add_documents_without_fit():
+    retriever = TfidfRetriever(InMemoryDocumentStore(), refit_ratio=None, auto_fit=False)
+    retriever.add_documents([Document(id="1", text="all about dogs"), Document(id="2", text="all about cats")])
+    assert retriever.retrieve("cats", top_k=1)[0].id == "2"
+
+
+def test_tfidf_retriever_hashing_with_filters(dogs_and_cats_store):
+    retriever = TfidfRetriever(dogs_and_cats_store, vectorizer_type="hashing", n_features=2 ** 12, batch_size=4)
+    assert retriever.tfidf_matrix.dtype == "float32"
+    assert retriever.tfidf_matrix.shape == (10, 2 ** 12)
+
+    documents = retriever.retrieve("dogs", top_k=2, filters={"name": ["filename1"]})
+    assert [d.text for d in documents] == ["paragraph 3 about dogs", "paragraph 9 about dogs"]
+    assert all(d.meta["name"] == "filename1" for d in retriever.retrieve("dogs", top_k=5, filters={"name": ["filename1"]}))